@@ -1,24 +1,131 @@
 import os
-import csv
+import gzip
 import json
-import hashlib
-import shutil
-from threading import Thread
+import io
+import csv
+import time
+from threading import Lock
 from uuid import uuid4
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, send_file
-import folium
-from folium.plugins import TimestampedGeoJson
-from dd_recovery import DDRecovery
-
-# TODO:
-# 1. Extract dd metadata to be shown after upload
+from flask import Flask, render_template, request, redirect, url_for, session, send_file, jsonify, make_response, Response, g
+from dd_recovery import DDRecovery, safe_image_name
+from dd_metadata import load_metadata
+from ingest import stream_to_file
+from geocoder import make_geocoder
+from blob_store import BlobStore
+from results_store import FIELDS, open_results_store
+from map_data import cached_geojson
+from zip_stream import stream_zip
+from task_queue import SORT_COLUMNS, TaskQueue, TaskWorkerPool
+from progress import ProgressRegistry
+from metrics import MetricsRegistry, TaskMetrics, TaskProfiler
+from triage import BlockMap
 
 app = Flask(__name__)
 app.config["RESULTS_FOLDER"] = "results/"
+app.config["UPLOAD_FOLDER"] = os.path.join(app.config["RESULTS_FOLDER"], "uploads")
+app.config["CARVE_WORKERS"] = os.cpu_count() or 1
+app.config["RECOVERY_ENGINE"] = "builtin"  # builtin (carving) or fat (directory walk, falls back to carving)
+app.config["GEOCODER_BACKEND"] = "nominatim"  # nominatim, offline or none
+app.config["GAZETTEER_PATH"] = None  # Required by the offline backend
+app.config["GEOCODE_CACHE"] = os.path.join(app.config["RESULTS_FOLDER"], "geocode_cache.sqlite")
+app.config["GEOCODE_PRECISION"] = 3
+app.config["BLOB_FOLDER"] = os.path.join(app.config["RESULTS_FOLDER"], "blobs")
+app.config["RESULTS_PAGE_SIZE"] = 100
+app.config["RESULTS_MAX_PAGE_SIZE"] = 1000
+app.config["TASK_QUEUE"] = os.path.join(app.config["RESULTS_FOLDER"], "tasks.sqlite")
+app.config["TASK_WORKERS"] = 2  # Extraction tasks run at the same time
+app.config["TASK_CPU_BUDGET"] = os.cpu_count() or 1  # Carving workers shared by running tasks
+app.config["TASK_DISK_RESERVE"] = 1024 ** 3  # Free bytes kept on top of each image's size
+app.config["TASK_MAX_ATTEMPTS"] = 2  # Runs before an interrupted task is failed
+app.config["TASKS_PAGE_SIZE"] = 50
+app.config["PROGRESS_INTERVAL"] = 0.5  # Minimum seconds between progress events
+app.config["PROGRESS_HEARTBEAT"] = 15  # Seconds between events when nothing changes
+app.config["TASK_PROFILE"] = False  # Save a cProfile of every task as profile.pstats
+app.config["TASK_TRIAGE"] = False  # Default of the option to skip zero-filled and high-entropy blocks
 app.secret_key = 'supersecretkey'  # Needed for session management
 RECOVERED_FILES = "deleted.dd_results.csv"
-tasks = {}
+geocoder = None
+geocoder_lock = Lock()
+blob_store = None
+blob_store_lock = Lock()
+task_queue = None
+task_queue_lock = Lock()
+progress = ProgressRegistry()
+metrics = MetricsRegistry()
+metrics.describe("http_request_duration_seconds", "Time to build the response of a request, by route")
+metrics.describe("dd_tasks_total", "Extraction tasks finished, by status")
+metrics.describe("dd_stage_wall_seconds_total", "Wall time spent in each pipeline stage, summed over threads")
+metrics.describe("dd_stage_cpu_seconds_total", "CPU time of the threads running each pipeline stage")
+metrics.describe("dd_ingest_seconds_total", "Time spent writing and hashing uploads")
+
+
+def get_geocoder():
+    # One geocoder (and its cache connection) is shared by all tasks
+    global geocoder
+    with geocoder_lock:
+        if geocoder is None:
+            geocoder = make_geocoder(
+                app.config["GEOCODER_BACKEND"],
+                app.config["GAZETTEER_PATH"],
+                app.config["GEOCODE_CACHE"],
+                app.config["GEOCODE_PRECISION"],
+            )
+    return geocoder
+
+
+def get_blob_store():
+    # Carved files are deduplicated across all tasks
+    global blob_store
+    with blob_store_lock:
+        if blob_store is None:
+            blob_store = BlobStore(app.config["BLOB_FOLDER"])
+    return blob_store
+
+
+def get_task_queue():
+    # Started with the first request: tasks interrupted by a previous run
+    # are requeued (or failed) before the worker pool picks anything up
+    global task_queue
+    with task_queue_lock:
+        if task_queue is None:
+            task_queue = TaskQueue(
+                app.config["TASK_QUEUE"],
+                app.config["TASK_CPU_BUDGET"],
+                app.config["TASK_DISK_RESERVE"],
+                app.config["TASK_MAX_ATTEMPTS"],
+            )
+            task_queue.import_results(app.config["RESULTS_FOLDER"])
+            task_queue.recover()
+            TaskWorkerPool(task_queue, background_task, app.config["RESULTS_FOLDER"], app.config["TASK_WORKERS"]).start()
+    return task_queue
+
+
+@app.before_request
+def start_task_queue():
+    get_task_queue()
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_latency(response):
+    # Streamed responses (SSE, ZIP downloads) are timed to their first byte
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - started,
+                        route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Process metrics in the Prometheus text format."""
+    with progress.changed:
+        running = sum(1 for task in progress.tasks.values() if task.status == "in_progress")
+    gauges = {"dd_tasks_running": running}
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
 
 @app.route("/", methods=["GET", "POST"])
 def upload_file():
@@ -33,33 +140,43 @@ def upload_file():
                 <p>Only .dd files are allowed</p>
                 <button onclick="window.location.href='/'">Return</button>
             ''', 400
-        file_path = file.filename
-        file.save(file_path)
-
         file_upload_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        file_size = os.path.getsize(file_path)
-        task_id = str(uuid4())
+        upload_path = os.path.join(app.config["UPLOAD_FOLDER"], f"{uuid4().hex}.tmp")
+
+        # Write the image to disk and hash it (MD5/SHA-1/SHA-256) in a single pass
+        ingest = stream_to_file(file.stream, upload_path)
+        metrics.inc("dd_ingest_bytes_total", ingest['size'])
+        metrics.inc("dd_ingest_seconds_total", ingest['ingest_seconds'])
 
-        # Calculate the file hash (MD5sum)
-        hasher = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            while chunk := f.read(8192):
-                hasher.update(chunk)
-        file_hash = hasher.hexdigest()
+        # Images are stored by content, so uploads sharing a name no longer
+        # overwrite each other and a re-upload is stored once
+        file_path = os.path.join(app.config["UPLOAD_FOLDER"], ingest['sha256'] + ".dd")
+        if os.path.exists(file_path):
+            os.remove(upload_path)
+        else:
+            os.replace(upload_path, file_path)
+
+        # Partition table and volumes, parsed once per image from its boot sectors
+        load_metadata(file_path, image_metadata_path(ingest['sha256']))
+
+        # A known image reuses the task that already processed it, or resumes the one that failed
+        existing = get_task_queue().find_image(ingest['sha256'])
+        task_id = existing['task_id'] if existing else str(uuid4())
 
         # Store the file metadata in a dictionary
         file_metadata = {
-            'filename': file.filename,
-            'size': file_size,
+            'filename': safe_image_name(file.filename),
+            'size': ingest['size'],
             'path': file_path,
-            'hash': file_hash,
+            'hash': ingest['md5'],
+            'sha1': ingest['sha1'],
+            'sha256': ingest['sha256'],
+            'ingest_mbps': ingest['ingest_mbps'],
+            'ingest_seconds': ingest['ingest_seconds'],
             'datetime': file_upload_time,
             "task_id": task_id
         }
 
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
-
         # session['file_data'] = file_data
         session['file_metadata'] = file_metadata
 
@@ -67,6 +184,9 @@ def upload_file():
 
     return render_template("index.html")
 
+def image_metadata_path(sha256):
+    return os.path.join(app.config["UPLOAD_FOLDER"], sha256 + ".json")
+
 @app.route("/display")
 def display_file():
     file_data = session.get('file_data')
@@ -74,21 +194,54 @@ def display_file():
     # if not file_data or not file_metadata:
     if not file_metadata:
         return redirect(url_for('upload_file'))
-    return render_template("display.html", file_data=file_data, **file_metadata)
-
-
-def background_task(task_id, file_metadata):
-    processor = DDRecovery(file_metadata['path'], 'exif', task_id)
-    processor.run()
-    tasks[task_id]['status'] = 'completed'
+    existing = get_task_queue().get(file_metadata['task_id'])
+    # Sessions from before uploads were hashed have no SHA-256 to cache the layout under
+    sha256 = file_metadata.get('sha256')
+    image = load_metadata(file_metadata['path'], image_metadata_path(sha256) if sha256 else None)
+    return render_template("display.html", file_data=file_data, workers=app.config["CARVE_WORKERS"],
+                           engine=app.config["RECOVERY_ENGINE"], triage=app.config["TASK_TRIAGE"], existing=existing,
+                           image=image, **file_metadata)
+
+
+def background_task(task_id, file_metadata, workers):
+    task_progress = progress.start(task_id, file_metadata['size'])
+    task_metrics = TaskMetrics()
+    if 'ingest_seconds' in file_metadata:
+        task_metrics.record("ingest_hash", file_metadata['ingest_seconds'])
+    profiler = TaskProfiler() if app.config["TASK_PROFILE"] else None
+    task_dir = os.path.join(app.config['RESULTS_FOLDER'], task_id)
+    try:
+        # Partitions are processed in parallel; their layout was read at upload
+        sha256 = file_metadata.get('sha256')
+        image = load_metadata(file_metadata['path'], image_metadata_path(sha256) if sha256 else None)
+        processor = DDRecovery(file_metadata['path'], 'exif', task_id, file_metadata.get('engine', 'builtin'),
+                               workers=workers, geocoder=get_geocoder(),
+                               progress=task_progress, blob_store=get_blob_store(),
+                               image_name=file_metadata['filename'], metadata=image,
+                               metrics=task_metrics, profiler=profiler,
+                               triage=file_metadata.get('triage', app.config["TASK_TRIAGE"]))
+        processor.run()
+    except Exception as e:
+        task_progress.finish('failed', str(e) or type(e).__name__)
+        task_metrics.finish()
+        metrics.add_task(task_metrics.snapshot(), 'failed')
+        raise
+    finally:
+        # Kept next to metadata.json, for failed runs too
+        if os.path.isdir(task_dir):
+            task_metrics.save(task_dir)
+            if profiler:
+                profiler.save(task_dir)
+    metrics.add_task(task_metrics.snapshot(), 'completed')
     file_metadata['task_id'] = task_id
     file_metadata['status'] = 'completed'
 
     # Save the metadata to a JSON file
-    metadata_file_path = os.path.join(app.config['RESULTS_FOLDER'], task_id, "metadata.json")
+    metadata_file_path = os.path.join(task_dir, "metadata.json")
     os.makedirs(os.path.dirname(metadata_file_path), exist_ok=True)
     with open(metadata_file_path, 'w') as f:
         json.dump(file_metadata, f, indent=4)
+    task_progress.finish('completed')
 
 @app.route("/extract", methods=["POST"])
 def extract():
@@ -98,235 +251,360 @@ def extract():
         return redirect(url_for('upload_file'))
 
     task_id = file_metadata.get("task_id")
-
-    tasks[task_id] = {
-        'taskid': task_id,
-        'filename': file_metadata['filename'],
-        'datetime': file_metadata['datetime'],
-        'status': 'in_progress'
-    }
-
-    thread = Thread(target=background_task, args=(task_id, file_metadata))
-    thread.start()
+    existing = get_task_queue().get(task_id)
+    if existing and existing['status'] != 'failed':
+        # The image was already extracted (or is being extracted)
+        return redirect(url_for('task_status', task_id=task_id))
+
+    workers = request.form.get("workers", app.config["CARVE_WORKERS"], type=int)
+    priority = request.form.get("priority", 0, type=int)
+    engine = request.form.get("engine", app.config["RECOVERY_ENGINE"])
+    if engine not in ("builtin", "fat"):
+        engine = app.config["RECOVERY_ENGINE"]
+    # Unchecked checkboxes are not submitted at all
+    triage = request.form.get("triage") == "on"
+    file_metadata = dict(file_metadata, engine=engine, triage=triage)
+
+    # Queued rather than started here; the worker pool runs it once admitted
+    queued_id = get_task_queue().enqueue(file_metadata, workers, priority)
+    if queued_id != task_id:
+        # Another upload of the same image was extracted first
+        session['file_metadata'] = dict(session['file_metadata'], task_id=queued_id)
+        return redirect(url_for('task_status', task_id=queued_id))
 
     return redirect(url_for('tasks_list'))
 
 @app.route("/tasks")
 def tasks_list():
-    ttasks = {}
+    # Paged and sorted by the task index rather than by reading every
+    # task's metadata.json
+    sort = request.args.get('sort', 'datetime')
+    if sort not in SORT_COLUMNS:
+        sort = 'datetime'
+    descending = request.args.get('order', 'desc') != 'asc'
+    page = max(1, request.args.get('page', 1, type=int))
+    page_size = app.config["TASKS_PAGE_SIZE"]
+    rows, has_more = get_task_queue().page(sort, descending, (page - 1) * page_size, page_size)
+
     results_folder = app.config["RESULTS_FOLDER"]
-    for task_id in os.listdir(results_folder):
-        task_path = os.path.join(results_folder, task_id)
-        metadata_file = os.path.join(task_path, "metadata.json")
-        if os.path.exists(metadata_file):
-            with open(metadata_file, "r") as f:
-                task_metadata = json.load(f)
-                ttasks[task_id] = task_metadata
-                tasks[task_id] = {
-                    'taskid': task_id,
-                    'filename': task_metadata['filename'],
-                    'datetime': task_metadata['datetime'],
-                    'status': task_metadata['status']
-                }
-    
-    # Join with tasks dictionary and deduplicate
-    for task_id, task in tasks.items():
-        if task_id not in ttasks:
-            ttasks[task_id] = task
-
-    # Sort tasks by datetime
-    sorted_tasks = dict(sorted(ttasks.items(), key=lambda x: datetime.strptime(x[1]['datetime'], "%Y-%m-%d %H:%M:%S"), reverse=True))
-
-    # Add a local folder path for each task
-    for task_id, task in sorted_tasks.items():
-        task['local_folder'] = os.path.join(results_folder, task_id)
-
-    return render_template("tasks_list.html", tasks=sorted_tasks)
+    sorted_tasks = {}
+    for task in rows:
+        # Add a local folder path for each task
+        task['local_folder'] = os.path.join(results_folder, task['task_id'])
+        sorted_tasks[task['task_id']] = task
+
+    return render_template(
+        "tasks_list.html", tasks=sorted_tasks, sort=sort, order='desc' if descending else 'asc', page=page,
+        has_more=has_more,
+    )
 
 @app.route("/task_status/<task_id>")
 def task_status(task_id):
     metadata_file_path = os.path.join(app.config['RESULTS_FOLDER'], task_id, "metadata.json")
     if not os.path.exists(metadata_file_path):
-        # get from the tasks dictionary
-        task = tasks.get(task_id)
+        # get from the task queue
+        task = get_task_queue().get(task_id)
     else:
         with open(metadata_file_path, "r") as f:
             task = json.load(f)
 
     if not task:
         return "Task not found", 404
-    return render_template("task_status.html", task_id=task_id, filename=task["filename"], status=task['status'])
+    # Saved by the triage pass, once it has run
+    block_map = BlockMap.load(os.path.join(app.config['RESULTS_FOLDER'], task_id))
+    return render_template(
+        "task_status.html", task_id=task_id, filename=task["filename"], status=task['status'],
+        position=get_task_queue().position(task_id), error=task.get('error'),
+        triage=block_map and {"summary": block_map.summary(), "overview": block_map.overview(),
+                              "block_size": block_map.block_size},
+    )
+
+@app.route("/api/tasks/<task_id>/progress")
+def api_task_progress(task_id):
+    """Push the task's progress to the status page as server-sent events.
+
+    Events come from the in-memory progress registry, so watching a task
+    costs no disk I/O. Tasks not running in this process (queued, or
+    finished before a restart) get their state from the task queue. The
+    stream ends once the task has completed or failed.
+    """
+    queue = get_task_queue()
+    if not progress.get(task_id) and not queue.get(task_id):
+        return jsonify(error="Task not found"), 404
+
+    interval = app.config["PROGRESS_INTERVAL"]
+    heartbeat = app.config["PROGRESS_HEARTBEAT"]
+
+    def events():
+        version = None
+        timeout = 0  # The first event is sent straight away
+        while True:
+            snapshot = progress.wait(task_id, version, timeout)
+            timeout = heartbeat
+            if snapshot is None:
+                task = queue.get(task_id) or {}
+                snapshot = {"status": task.get('status', 'completed'), "error": task.get('error'),
+                            "position": queue.position(task_id)}
+            else:
+                version = snapshot["version"]
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot["status"] in ("completed", "failed"):
+                return
+            time.sleep(interval)
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def load_task_metadata(task_id):
+    file_metadata = session.get('file_metadata')
+    if file_metadata and file_metadata.get("task_id") == task_id:
+        return file_metadata
+    # check if the task_id exists in the results folder
+    metadata_file = os.path.join(app.config["RESULTS_FOLDER"], task_id, "metadata.json")
+    if not os.path.exists(metadata_file):
+        # metadata.json is written when the task completes; while it runs,
+        # its partial results are read with the metadata it was queued with
+        task = get_task_queue().get(task_id)
+        return json.loads(task['metadata']) if task else None
+    with open(metadata_file, "r") as f:
+        return json.load(f)
+
+def open_task_store(task_id, file_metadata):
+    task_dir = os.path.join(app.config['RESULTS_FOLDER'], task_id)
+    csv_file_path = os.path.join(task_dir, safe_image_name(file_metadata['filename']) + "_results.csv")
+    legacy_csv_path = os.path.join(task_dir, os.path.basename(file_metadata['filename']) + "_results.csv")
+    if not os.path.exists(csv_file_path) and os.path.exists(legacy_csv_path):
+        # Tasks from before names were sanitized exported under the bare basename
+        csv_file_path = legacy_csv_path
+    return open_results_store(task_dir, csv_file_path)
+
+def load_result_filter(args, task_id=None):
+    """Resolve the filter handle of a map/download request.
+
+    The handle comes from the task_id and filter query arguments, or from
+    the last /extraction_result view in the session. Returns
+    (task_id, file_metadata, filter_key, filters), or None if it cannot be
+    resolved.
+    """
+    task_id = task_id or args.get('task_id')
+    filter_key = args.get('filter')
+    if not task_id:
+        handle = session.get('result_filter') or {}
+        task_id, filter_key = handle.get('task_id'), handle.get('filter')
+    if not task_id:
+        return None
+    file_metadata = load_task_metadata(task_id)
+    if not file_metadata:
+        return None
+    filters = (None, None, False)
+    if filter_key:
+        store = open_task_store(task_id, file_metadata)
+        if not store:
+            return None
+        with store:
+            filters = store.load_filter(filter_key)
+        if filters is None:
+            return None
+    return task_id, file_metadata, filter_key, filters
+
+def result_filters(args):
+    """Return the (start_date, end_date, has_exif) filters of a results request.
+
+    Raises ValueError for a malformed date.
+    """
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    has_exif = args.get('has_exif')  # Get the "Has EXIF Data" filter value
+    if start_date and end_date:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    return start_date, end_date, has_exif == "true"
 
 @app.route("/extraction_result")
 def extraction_result():
     task_id = request.args.get('task_id')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    has_exif = request.args.get('has_exif')  # Get the "Has EXIF Data" filter value
-
     if not task_id:
         return "Task ID not provided", 400
 
-    file_metadata = session.get('file_metadata')
-    if not file_metadata or file_metadata.get("task_id") != task_id:
-        # check if the task_id exists in the results folder
-        results_folder = app.config["RESULTS_FOLDER"]
-        task_path = os.path.join(results_folder, task_id)
-        metadata_file = os.path.join(task_path, "metadata.json")
-        if not os.path.exists(metadata_file):
-            return "Invalid task ID", 400
-
-    csv_file_path = os.path.join(app.config['RESULTS_FOLDER'], task_id, file_metadata['filename'] + "_results.csv")
-    table_data = []
-
-    if os.path.exists(csv_file_path):
-        with open(csv_file_path, newline='', encoding="utf-8") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                if row['datetime'] != "":
-                    row_date = datetime.strptime(row['datetime'], "%Y:%m:%d %H:%M:%S")
-                    if start_date and end_date:
-                        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
-                        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
-                        if start_date_obj <= row_date <= end_date_obj:
-                            if has_exif and row.get('has_EXIF_data') == "true":
-                                table_data.append(row)
-                            elif has_exif != "true":
-                                table_data.append(row)
-                    else:
-                        if has_exif and row.get('has_EXIF_data') == "true":
-                            table_data.append(row)
-                        elif has_exif != "true":
-                            table_data.append(row)
-                else:
-                    if has_exif and row.get('has_EXIF_data') == "true":
-                        table_data.append(row)
-                    elif has_exif != "true":
-                        table_data.append(row)
-
-    # Store the filtered data in the session
-    session['filtered_data'] = table_data
-
-    # Calculate the total number of files
-    total_files = len(table_data)
-
-    return render_template("extraction_result.html", table_data=table_data, total_files=total_files)
+    file_metadata = load_task_metadata(task_id)
+    if not file_metadata:
+        return "Invalid task ID", 400
+
+    try:
+        filters = result_filters(request.args)
+    except ValueError:
+        return "Invalid date filter", 400
+
+    total_files = 0
+    filter_key = None
+    store = open_task_store(task_id, file_metadata)
+    if store:
+        with store:
+            total_files = store.count(*filters)
+            filter_key = store.save_filter(filters)
+
+    # Only a handle to the filter goes into the session; the map and
+    # downloads re-run it against the results store
+    session['result_filter'] = {'task_id': task_id, 'filter': filter_key}
+
+    # Rows are fetched page by page from the results API by the template
+    return render_template("extraction_result.html", total_files=total_files, task_id=task_id, filter_key=filter_key)
+
+@app.route("/api/tasks/<task_id>/results")
+def api_task_results(task_id):
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = request.args.get('limit', app.config["RESULTS_PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, app.config["RESULTS_MAX_PAGE_SIZE"]))
+
+    file_metadata = load_task_metadata(task_id)
+    if not file_metadata:
+        return jsonify(error="Invalid task ID"), 404
+
+    try:
+        filters = result_filters(request.args)
+    except ValueError:
+        return jsonify(error="Invalid date filter"), 400
+
+    store = open_task_store(task_id, file_metadata)
+    if not store:
+        return jsonify(columns=FIELDS, rows=[], next_cursor=None, total=0)
+
+    with store:
+        page, next_cursor = store.page(*filters, after_id=cursor, limit=limit)
+        response = {
+            "columns": FIELDS,
+            "rows": [list(row.values()) for _, row in page],
+            "next_cursor": next_cursor,
+        }
+        # Counting is only needed once, for the first page
+        if not cursor:
+            response["total"] = store.count(*filters)
+    return jsonify(response)
+
+def export_csv(rows, paths, batch_size=1000):
+    """Yield the results CSV in batches, collecting each row's carved file path."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for count, (path, row) in enumerate(rows, start=1):
+        writer.writerow(row.values())
+        if path:
+            paths.append(path)
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+def export_entries(task_dir, store, filters):
+    """(arcname, source) pairs of a filtered export.
+
+    The filtered rows as CSV, the carved files they refer to, and the
+    task's audit and metadata files.
+    """
+    paths = []
+    yield "results.csv", export_csv(store.export(*filters), paths)
+    for path in paths:
+        yield path, os.path.join(task_dir, path)
+    for name in ("audit.txt", "foremost/audit.txt", "metadata.json"):
+        if os.path.exists(os.path.join(task_dir, name)):
+            yield name, os.path.join(task_dir, name)
+
+def task_dir_entries(task_dir):
+    """(arcname, path) pairs of every file of a task, as before.
+
+    Archives and temporary files left in the folder by older versions are
+    skipped, as is the map cache.
+    """
+    for root, dirs, files in os.walk(task_dir):
+        dirs[:] = sorted(d for d in dirs if d != "geojson")
+        for name in sorted(files):
+            if name.endswith((".zip", ".tmp")):
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, task_dir), path
 
 @app.route("/download_results", methods=["GET"])
 def download_results():
-    task_id = request.args.get("task_id")
-    if not task_id:
+    """Stream the task's results as a ZIP, built on the fly.
+
+    With a filter handle that filters anything, only the rows of that
+    /extraction_result filter and their carved files are exported;
+    otherwise the whole task folder.
+    """
+    result_filter = load_result_filter(request.args)
+    if not result_filter:
         return "Task ID not provided", 400
+    task_id, file_metadata, filter_key, filters = result_filter
 
     # Path to the task directory
     task_dir = os.path.join(app.config["RESULTS_FOLDER"], task_id)
     if not os.path.exists(task_dir):
         return "Task directory not found", 404
 
-    # Create a ZIP file for the task directory
-    zip_path = os.path.join(app.config["RESULTS_FOLDER"], f"{task_id}.zip")
-    shutil.make_archive(zip_path.replace(".zip", ""), 'zip', task_dir)
+    if filter_key and any(filters):
+        store = open_task_store(task_id, file_metadata)
+        if not store:
+            return "No results available", 404
 
-    # Serve the ZIP file for download
-    return send_file(zip_path, as_attachment=True, download_name=f"{task_id}.zip")
+        def archive():
+            with store:
+                yield from stream_zip(export_entries(task_dir, store, filters))
+
+        download_name = f"{task_id}-{filter_key}.zip"
+    else:
+        def archive():
+            yield from stream_zip(task_dir_entries(task_dir))
+
+        download_name = f"{task_id}.zip"
+
+    return Response(archive(), mimetype="application/zip",
+                    headers={"Content-Disposition": f"attachment; filename={download_name}"})
 
 @app.route("/map_from_csv")
 def map_from_csv():
-    """Load GPS coordinates from CSV and add them as markers on a map."""
-    filtered_data = session.get('filtered_data')
-    if not filtered_data:
+    """Render the timeline map; the GeoJSON is fetched separately by the page."""
+    result_filter = load_result_filter(request.args)
+    if not result_filter:
         return "No filtered data available", 400
-
-    record_with_gps = []
-    coordinates = []
-    features = []
-
-    for row in filtered_data:
-        if row['GPS Coordinates'] and row['datetime']:
-            coords = row['GPS Coordinates'].strip("()").split(", ")
-            lat, lon = float(coords[0]), float(coords[1])
-            coordinates.append([lon, lat])  # GeoJSON uses [lon, lat] format
-            datetime_str = row['datetime'].replace(" ", "T").replace(":", "-", 2) + "Z"  # Convert to YYYY-MM-DDTHH:MM:SSZ format
-
-            record_with_gps.append({
-                'lat': lat,
-                'lon': lon,
-                'datetime': datetime_str,
-                'filename': row['fileName'],
-                'address': row['Address']
-            })
-
-    # Sort by datetime
-    record_with_gps = sorted(record_with_gps, key=lambda x: datetime.strptime(x['datetime'], "%Y-%m-%dT%H:%M:%SZ"))
-
-    # Set the map centered around the first coordinate
-    m = folium.Map(location=[record_with_gps[0]["lat"], record_with_gps[0]["lon"]], zoom_start=10)
-
-    # Create GeoJSON features (this is to generate the line connecting the points)
-    for i in range(len(record_with_gps) - 1):
-        feature = {
-            "type": "Feature",
-            "geometry": {
-                "type": "LineString",
-                "coordinates": [
-                    [record_with_gps[i]["lon"], record_with_gps[i]["lat"]],
-                    [record_with_gps[i + 1]["lon"], record_with_gps[i + 1]["lat"]]
-                ]
-            },
-            "properties": {
-                "times": [record_with_gps[i]["datetime"], record_with_gps[i + 1]["datetime"]],
-                "style": {"color": "blue", "weight": 5}
-            }
-        }
-        features.append(feature)
-
-# Add numbered markers with popups as GeoJSON features
-    for idx, coord in enumerate(record_with_gps, start=1):
-        feature = {
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": [coord["lon"], coord["lat"]]
-            },
-            "properties": {
-                "times": [coord["datetime"]],
-                "popup": f"""<b>{idx}.</b>
-                    <br>
-                    <b>Filename:</b> {coord['filename']}
-                    <br>
-                    <b>Address:</b> {coord['address']}
-                    <br>
-                    <b>Time:</b> {coord['datetime']}
-                """
-            }
-        }
-        features.append(feature)
-
-    # Create a GeoJSON object
-    geojson = {
-        "type": "FeatureCollection",
-        "features": features
-    }
-
-    # Add the TimestampedGeoJson to the map
-    TimestampedGeoJson(
-        data=json.dumps(geojson),
-        period="PT1H",
-        add_last_point=True,
-        auto_play=False,
-        loop=False,
-        max_speed=10,
-        loop_button=True,
-        date_options='YYYY-MM-DD HH:mm:ss',
-        time_slider_drag_update=True
-    ).add_to(m)
-
-    # Use this to render directly
-    return m.get_root().render()
-
-# Use this to render as a template to give more flexibility
-# map_html = m._repr_html_()
-# return render_template('timeline.html', map_html=map_html)
+    task_id, _, filter_key, _ = result_filter
+
+    geojson_url = url_for('api_task_geojson', task_id=task_id, filter=filter_key)
+    return render_template('timeline.html', geojson_url=geojson_url)
+
+@app.route("/api/tasks/<task_id>/geojson")
+def api_task_geojson(task_id):
+    """Serve the cached, gzipped GeoJSON of a task filter with an ETag.
+
+    With a zoom argument, large point sets are served as the precomputed
+    clustered/simplified level of detail for that zoom.
+    """
+    result_filter = load_result_filter(request.args, task_id)
+    if not result_filter:
+        return jsonify(error="Unknown task or filter"), 404
+    _, file_metadata, filter_key, filters = result_filter
+
+    store = open_task_store(task_id, file_metadata)
+    if not store:
+        return jsonify(error="No results available"), 404
+    with store:
+        task_dir = os.path.join(app.config['RESULTS_FOLDER'], task_id)
+        cached, etag = cached_geojson(task_dir, store, filter_key, filters, request.args.get('zoom', type=int))
+
+    if request.if_none_match.contains(etag):
+        cached.close()
+        response = make_response("", 304)
+    elif 'gzip' in request.accept_encodings:
+        # The response closes the file once it has been sent
+        response = send_file(cached, mimetype="application/json", etag=False, conditional=False)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        with cached, gzip.open(cached, "rb") as f:
+            response = make_response(f.read())
+        response.mimetype = "application/json"
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 if __name__ == "__main__":
     app.run(debug=True)
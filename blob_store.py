@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import sqlite3
+from threading import Lock
+from uuid import uuid4
+
+INDEX_NAME = "blobs.sqlite"
+
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class BlobStore:
+    """Content-addressed store shared by the carved files of every task.
+
+    Each distinct file is kept once, as <root>/<aa>/<sha256>, and the copies
+    carved by tasks are hard links to it. The EXIF row extracted from a blob
+    is remembered, so a file seen by an earlier task is neither parsed nor
+    geocoded again.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = Lock()
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, INDEX_NAME), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS exif (sha256 TEXT PRIMARY KEY, row TEXT NOT NULL)")
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def add(self, path):
+        """Deduplicate the file at path against the store; return its SHA-256.
+
+        The first copy of a file becomes the blob. Later copies are replaced
+        by a hard link to it. Where hard links are not available (another
+        filesystem, FAT/exFAT) the copy is left as it is.
+        """
+        digest = file_sha256(path)
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(path, blob)
+        except FileExistsError:
+            if not os.path.samefile(path, blob):
+                tmp_path = f"{path}.{uuid4().hex}.tmp"
+                try:
+                    os.link(blob, tmp_path)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        except OSError:
+            pass
+        return digest
+
+    def get_row(self, digest):
+        """The EXIF row cached for a blob, without its file name, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT row FROM exif WHERE sha256 = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        row = json.loads(row[0])
+        # GPS coordinates are a (lat, lon) tuple in the results table
+        if row[4]:
+            row[4] = tuple(row[4])
+        return row
+
+    def put_row(self, digest, row):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO exif (sha256, row) VALUES (?, ?)", (digest, json.dumps(row)))
+            self.conn.commit()
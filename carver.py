@@ -0,0 +1,301 @@
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+MB = 1024 * 1024
+SECTOR_SIZE = 512
+# Headers are searched a window at a time so every signature pass over the
+# window is served from the page cache rather than from disk.
+WINDOW_SIZE = 64 * MB
+# Bounds for the byte range handed to each worker process
+MIN_CHUNK_SIZE = 16 * MB
+MAX_CHUNK_SIZE = 256 * MB
+# Scan workers are started by the pool of a multi-threaded process (the web
+# app, the per-partition jobs), which fork() could copy with a lock held
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# (extension, header, footer, max_size)
+SIGNATURES = [
+    ("jpg", b"\xff\xd8\xff", b"\xff\xd9", 20 * MB),
+    ("png", b"\x89PNG\r\n\x1a\n", b"IEND\xaeB`\x82", 20 * MB),
+    ("gif", b"GIF87a", b"\x00\x3b", 8 * MB),
+    ("gif", b"GIF89a", b"\x00\x3b", 8 * MB),
+    ("pdf", b"%PDF-", b"%%EOF", 50 * MB),
+]
+
+# JPEG markers that carry no length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+
+
+def write_file(path, data):
+    """Write data to path as a new file.
+
+    A copy left by an earlier run is unlinked rather than truncated: it may
+    be a hard link to a blob in the blob store, which truncating would empty.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as out:
+        out.write(data)
+
+
+class Carver:
+    """Signature carver working directly on a memory-mapped image.
+
+    Carved files are written as <output_dir>/<ext>/<sector>.<ext>, the same
+    layout foremost produces, so DDRecovery.process_files can walk either.
+    ranges restricts the scan to some (start, end) byte ranges of the
+    image, e.g. the unallocated clusters of a filesystem; files starting in
+    them are still carved in full.
+
+    An interrupted carve resumes from `resume`, the state last passed to
+    `checkpoint` (a callable called after every chunk): scanning restarts
+    at the end of the last completed chunk.
+    """
+
+    def __init__(self, filename, output_dir, file_types=None, workers=1, progress=None, ranges=None, resume=None,
+                 checkpoint=None):
+        self.filename = filename
+        self.output_dir = output_dir
+        self.file_types = file_types
+        self.workers = max(1, workers or 1)
+        self.signatures = [sig for sig in SIGNATURES if file_types is None or sig[0] in file_types]
+        self.size = os.path.getsize(filename)
+        self.progress = progress
+        self.ranges = merge_ranges(ranges, self.size) if ranges is not None else [(0, self.size)] if self.size else []
+        self.scan_size = sum(end - start for start, end in self.ranges)
+        self.skipped_bytes = self.size - self.scan_size
+        self.checkpoint = checkpoint
+        # Everything below scanned_until was scanned, and its files carved, by an earlier run
+        resume = resume or {}
+        self.scanned_until = resume.get("scanned_until", 0)
+        self.carved_until = dict(resume.get("carved_until", {}))
+
+    def scan(self, mm, start=0, end=None):
+        """Return (start, end, ext) for every header found in [start, end).
+
+        Headers may straddle `end` and footers are searched past it, so files
+        crossing the range boundary are still found in full.
+        """
+        end = self.size if end is None else min(end, self.size)
+        hits = []
+        for window_start in range(start, end, WINDOW_SIZE):
+            window_end = min(window_start + WINDOW_SIZE, end)
+            for ext, header, footer, max_size in self.signatures:
+                search_end = min(window_end + len(header) - 1, self.size)
+                pos = mm.find(header, window_start, search_end)
+                while pos != -1:
+                    file_end = self.find_end(mm, ext, pos, footer, max_size)
+                    if file_end is not None:
+                        hits.append((pos, file_end, ext))
+                    pos = mm.find(header, pos + 1, search_end)
+        hits.sort()
+        return hits
+
+    def find_end(self, mm, ext, start, footer, max_size):
+        limit = min(start + max_size, self.size)
+        if ext == "jpg":
+            # Skip the marker segments first so a footer inside an embedded
+            # EXIF thumbnail does not truncate the image.
+            start = self.jpeg_scan_start(mm, start, limit)
+            if start is None:
+                return None
+        pos = mm.find(footer, start, limit)
+        if pos == -1:
+            return None
+        end = pos + len(footer)
+        if ext == "pdf":
+            # The trailer is normally terminated by an end-of-line marker
+            for eol in (b"\r\n", b"\n", b"\r"):
+                if mm[end:end + len(eol)] == eol:
+                    return end + len(eol)
+        return end
+
+    def jpeg_scan_start(self, mm, start, limit):
+        pos = start + 2
+        while pos + 4 <= limit:
+            if mm[pos] != 0xFF:
+                return None
+            marker = mm[pos + 1]
+            if marker == 0xFF:
+                pos += 1
+                continue
+            if marker in JPEG_STANDALONE_MARKERS:
+                pos += 2
+                continue
+            length = int.from_bytes(mm[pos + 2:pos + 4], "big")
+            if length < 2:
+                return None
+            if marker == 0xDA:
+                return pos + 2 + length
+            pos += 2 + length
+        return None
+
+    def chunks(self):
+        """Split the ranges to scan into chunks, a few per worker for load balancing.
+
+        A chunk is a list of (start, end) ranges adding up to about the
+        chunk size, so many small ranges (cluster slack) do not each cost a
+        round trip to a worker. Ranges scanned by an earlier run are left out.
+        """
+        ranges = self.unscanned()
+        chunk_size = -(-sum(end - start for start, end in ranges) // (self.workers * 4))
+        chunk_size = min(max(chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        chunks = []
+        chunk = []
+        chunk_bytes = 0
+        for start, end in ranges:
+            while start < end:
+                piece_end = min(end, start + chunk_size - chunk_bytes)
+                chunk.append((start, piece_end))
+                chunk_bytes += piece_end - start
+                start = piece_end
+                if chunk_bytes >= chunk_size:
+                    chunks.append(chunk)
+                    chunk = []
+                    chunk_bytes = 0
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def unscanned(self):
+        return [(max(start, self.scanned_until), end) for start, end in self.ranges if end > self.scanned_until]
+
+    def scan_chunk(self, mm, chunk):
+        hits = []
+        for start, end in chunk:
+            hits += self.scan(mm, start, end)
+        return hits
+
+    def scan_chunks(self, mm):
+        """Yield (chunk, hits) for each chunk, in image order.
+
+        With several workers the chunks are scanned in a process pool; every
+        worker maps the same file read-only so no image data is copied.
+        """
+        chunks = self.chunks()
+        if self.workers == 1 or len(chunks) == 1:
+            for chunk in chunks:
+                yield chunk, self.scan_chunk(mm, chunk)
+            return
+        with ProcessPoolExecutor(
+            max_workers=min(self.workers, len(chunks)),
+            mp_context=multiprocessing.get_context(POOL_START_METHOD),
+            initializer=_init_worker,
+            initargs=(self.filename, self.file_types),
+        ) as executor:
+            yield from zip(chunks, executor.map(_scan_worker, chunks))
+
+    def select(self, hits, carved_until):
+        """Drop hits that start inside a file already carved of the same type.
+
+        carved_until carries the end of the last carved file per type from one
+        chunk to the next, which removes the duplicates a file crossing a
+        chunk boundary would otherwise produce.
+        """
+        selected = []
+        for start, end, ext in hits:
+            if start < carved_until.get(ext, 0):
+                continue
+            carved_until[ext] = end
+            selected.append((start, end, ext))
+        return selected
+
+    def output_path(self, start, ext):
+        name = f"{start // SECTOR_SIZE:08d}"
+        if start % SECTOR_SIZE:
+            name += f"_{start % SECTOR_SIZE}"
+        return os.path.join(self.output_dir, ext, f"{name}.{ext}")
+
+    def carved_files(self):
+        """(start, end, ext, path) of the files an earlier run carved below scanned_until."""
+        carved = []
+        for ext in sorted({sig[0] for sig in self.signatures}):
+            folder = os.path.join(self.output_dir, ext)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                sector, _, offset = name.rsplit(".", 1)[0].partition("_")
+                try:
+                    start = int(sector) * SECTOR_SIZE + int(offset or 0)
+                except ValueError:
+                    continue
+                if start < self.scanned_until:
+                    path = os.path.join(folder, name)
+                    carved.append((start, start + os.path.getsize(path), ext, path))
+        carved.sort()
+        return carved
+
+    def write(self, mm, start, end, ext):
+        path = self.output_path(start, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file(path, mm[start:end])
+        return path
+
+    def write_audit(self, carved):
+        with open(os.path.join(self.output_dir, "audit.txt"), "w") as audit:
+            audit.write(f"Image: {self.filename}\n")
+            audit.write(f"Size: {self.size} bytes\n")
+            audit.write(f"Scanned: {self.scan_size} bytes\n")
+            audit.write(f"Skipped: {self.skipped_bytes} bytes\n")
+            audit.write(f"Files carved: {len(carved)}\n\n")
+            for start, end, ext, path in carved:
+                audit.write(f"{os.path.basename(path)}\t{end - start}\t{start}\n")
+
+    def carve(self):
+        """Scan the image ranges and yield the path of each carved file.
+
+        When resuming, only files carved after the last checkpoint are
+        yielded; the audit lists those of the earlier run too.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        carved = self.carved_files() if self.scanned_until else []
+        if self.scan_size:
+            with open(self.filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                carved_until = self.carved_until
+                scanned = sum(min(end, self.scanned_until) - start for start, end in self.ranges
+                              if start < self.scanned_until)
+                for chunk, hits in self.scan_chunks(mm):
+                    for start, end, ext in self.select(hits, carved_until):
+                        path = self.write(mm, start, end, ext)
+                        carved.append((start, end, ext, path))
+                        yield path
+                    scanned += sum(end - start for start, end in chunk)
+                    if self.progress:
+                        self.progress.update(bytes_scanned=scanned)
+                    if self.checkpoint:
+                        self.checkpoint(scanned_until=chunk[-1][1], carved_until=dict(carved_until))
+        self.write_audit(carved)
+
+
+def merge_ranges(ranges, size):
+    """Sort (start, end) byte ranges, clip them to the image and merge overlaps."""
+    merged = []
+    for start, end in sorted(ranges):
+        start, end = max(0, start), min(end, size)
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+# Per-process state for the scan workers
+_worker_carver = None
+_worker_mm = None
+
+
+def _init_worker(filename, file_types):
+    global _worker_carver, _worker_mm
+    _worker_carver = Carver(filename, None, file_types)
+    with open(filename, "rb") as f:
+        _worker_mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _scan_worker(chunk):
+    return _worker_carver.scan_chunk(_worker_mm, chunk)
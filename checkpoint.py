@@ -0,0 +1,52 @@
+import json
+import os
+from threading import Lock
+
+CHECKPOINT_NAME = "checkpoint.json"
+
+
+class Checkpoint:
+    """How far an extraction task got, so an interrupted run can resume.
+
+    Holds the carver state of each job (partition) after its last
+    completed chunk: the offset scanning reached and the end of the last
+    carved file per type. Which files were already EXIF-processed is not
+    kept here, it is the rows committed to the results store, and geocode
+    results are kept by the geocode cache.
+
+    key identifies the image and the settings the output depends on; a
+    checkpoint saved under another key is ignored. The file is replaced
+    atomically, so a crash leaves the previous checkpoint or the new one.
+    """
+
+    def __init__(self, task_dir, key):
+        self.path = os.path.join(task_dir, CHECKPOINT_NAME)
+        self.key = key
+        self.lock = Lock()
+        self.jobs = {}
+        self.resumed = False
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        if saved.get("key") == key:
+            self.jobs = saved.get("jobs", {})
+            self.resumed = True
+
+    def job(self, name):
+        """The state saved for a job, {} if it has none."""
+        with self.lock:
+            return dict(self.jobs.get(name, {}))
+
+    def save(self, job=None, **state):
+        """Update a job's state, if given, and write the checkpoint out."""
+        with self.lock:
+            if job is not None:
+                self.jobs.setdefault(job, {}).update(state)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"key": self.key, "jobs": self.jobs}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
@@ -1,6 +1,384 @@
 import argparse
-from uuid import uuid4
-import subprocess
+import json
+import os
+import struct
+from dataclasses import asdict, dataclass, field
+from uuid import UUID, uuid4
+
+from fat import FatError, parse_bpb
+
+SECTOR_SIZE = 512
+BOOT_SIGNATURE = b"\x55\xaa"
+# Logical blocks of 512 and 4096 bytes are both found in GPT images
+GPT_SECTOR_SIZES = (512, 4096)
+GPT_HEADER_SIZE = 92
+MAX_GPT_ENTRIES = 128
+# Entries are 128 bytes times a power of two; bounds keep a corrupted header from sizing the read
+MIN_GPT_ENTRY_SIZE = 128
+MAX_GPT_ENTRY_SIZE = 4096
+# Logical partitions followed through the EBR chain, as a guard against loops
+MAX_LOGICAL_PARTITIONS = 64
+
+MBR_EXTENDED_TYPES = {0x05, 0x0F, 0x85}
+MBR_GPT_PROTECTIVE = 0xEE
+MBR_TYPES = {
+    0x01: "FAT12",
+    0x04: "FAT16 <32M",
+    0x06: "FAT16",
+    0x07: "NTFS/exFAT",
+    0x0B: "FAT32 (CHS)",
+    0x0C: "FAT32 (LBA)",
+    0x0E: "FAT16 (LBA)",
+    0x82: "Linux swap",
+    0x83: "Linux",
+    0xEE: "GPT protective",
+    0xEF: "EFI System",
+}
+GPT_TYPES = {
+    "c12a7328-f81f-11d2-ba4b-00a0c93ec93b": "EFI System",
+    "e3c9e316-0b5c-4db8-817d-f92df00215ae": "Microsoft reserved",
+    "ebd0a0a2-b9e5-4433-87c0-68b6b72699c7": "Basic data",
+    "de94bba4-06d1-4d40-a16a-bfd50179d6ac": "Windows recovery",
+    "0fc63daf-8483-4772-8e79-3d69d8477de4": "Linux filesystem",
+    "0657fd6d-a4ab-43c4-84e5-0933c84b4f4f": "Linux swap",
+}
+
+
+@dataclass
+class Volume:
+    """A filesystem found at offset bytes into the image."""
+
+    filesystem: str
+    offset: int
+    size: int
+    bytes_per_sector: int
+    sectors_per_cluster: int
+    cluster_size: int
+    cluster_count: int
+    label: str = ""
+    serial: str = ""
+    oem: str = ""
+    # FAT/exFAT: byte offset of each FAT copy and its size in bytes
+    fat_offsets: list = field(default_factory=list)
+    fat_size: int = 0
+    root_dir_offset: int = 0
+    data_offset: int = 0
+    # NTFS: byte offset of the MFT
+    mft_offset: int = 0
+
+
+@dataclass
+class Partition:
+    index: int
+    offset: int
+    size: int
+    type: str
+    name: str = ""
+    bootable: bool = False
+    volume: Volume = None
+
+
+@dataclass
+class ImageMetadata:
+    size: int
+    scheme: str  # mbr, gpt, none (a volume without partition table) or unknown
+    sector_size: int = SECTOR_SIZE
+    disk_id: str = ""
+    partitions: list = field(default_factory=list)
+
+    @property
+    def volumes(self):
+        return [partition.volume for partition in self.partitions if partition.volume]
+
+    @property
+    def filesystem_type(self):
+        """The filesystem of the first volume, as the old `file -s` check reported it."""
+        volumes = self.volumes
+        return volumes[0].filesystem if volumes else "Unknown"
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        partitions = []
+        for partition in data.get("partitions", []):
+            volume = partition.get("volume")
+            partitions.append(Partition(**dict(partition, volume=Volume(**volume) if volume else None)))
+        return cls(**dict(data, partitions=partitions))
+
+
+class _Reader:
+    """Reads (offset, length) slices of the image through one open file."""
+
+    def __init__(self, f, size):
+        self.f = f
+        self.size = size
+
+    def read(self, offset, length):
+        if offset < 0 or offset >= self.size:
+            return b""
+        self.f.seek(offset)
+        return self.f.read(length)
+
+
+def _text(raw):
+    return raw.split(b"\x00", 1)[0].decode("ascii", "replace").strip()
+
+
+def _fat_volume(boot, offset):
+    try:
+        bpb = parse_bpb(boot)
+    except FatError:
+        return None
+    # The extended BPB sits after the FAT32-only fields
+    ebpb = 64 if bpb.fat_type == "FAT32" else 36
+    serial = ""
+    label = ""
+    if boot[ebpb + 2] in (0x28, 0x29):
+        serial = f"{struct.unpack_from('<I', boot, ebpb + 3)[0]:08X}"
+        label = _text(boot[ebpb + 7:ebpb + 18])
+    fat_offset = offset + bpb.reserved_sectors * bpb.bytes_per_sector
+    fat_size = bpb.fat_size * bpb.bytes_per_sector
+    root_dir_offset = fat_offset + bpb.num_fats * fat_size
+    return Volume(
+        filesystem=bpb.fat_type,
+        offset=offset,
+        size=bpb.total_sectors * bpb.bytes_per_sector,
+        bytes_per_sector=bpb.bytes_per_sector,
+        sectors_per_cluster=bpb.sectors_per_cluster,
+        cluster_size=bpb.bytes_per_sector * bpb.sectors_per_cluster,
+        cluster_count=bpb.cluster_count,
+        label="" if label == "NO NAME" else label,
+        serial=serial,
+        oem=_text(boot[3:11]),
+        fat_offsets=[fat_offset + i * fat_size for i in range(bpb.num_fats)],
+        fat_size=fat_size,
+        root_dir_offset=root_dir_offset,
+        data_offset=root_dir_offset + bpb.root_dir_sectors * bpb.bytes_per_sector,
+    )
+
+
+def _exfat_volume(boot, offset, reader):
+    (volume_length, fat_offset, fat_length, heap_offset, cluster_count, root_cluster,
+     serial) = struct.unpack_from("<QIIIIII", boot, 72)
+    sector_shift, cluster_shift, num_fats = struct.unpack_from("<BBB", boot, 108)
+    if not 9 <= sector_shift <= 12 or sector_shift + cluster_shift > 25 or num_fats not in (1, 2):
+        return None
+    bytes_per_sector = 1 << sector_shift
+    cluster_size = bytes_per_sector << cluster_shift
+    data_offset = offset + heap_offset * bytes_per_sector
+    root_dir_offset = data_offset + (root_cluster - 2) * cluster_size
+    # The label is an entry of the root directory, not part of the boot sector
+    label = ""
+    root = reader.read(root_dir_offset, cluster_size)
+    for pos in range(0, len(root) - 31, 32):
+        if root[pos] == 0x83:
+            length = min(root[pos + 1], 11)
+            label = root[pos + 2:pos + 2 + length * 2].decode("utf-16-le", "replace")
+            break
+        if root[pos] == 0x00:
+            break
+    fat_size = fat_length * bytes_per_sector
+    return Volume(
+        filesystem="exFAT",
+        offset=offset,
+        size=volume_length * bytes_per_sector,
+        bytes_per_sector=bytes_per_sector,
+        sectors_per_cluster=1 << cluster_shift,
+        cluster_size=cluster_size,
+        cluster_count=cluster_count,
+        label=label,
+        serial=f"{serial:08X}",
+        oem="EXFAT",
+        fat_offsets=[offset + fat_offset * bytes_per_sector + i * fat_size for i in range(num_fats)],
+        fat_size=fat_size,
+        root_dir_offset=root_dir_offset,
+        data_offset=data_offset,
+    )
+
+
+def _ntfs_volume(boot, offset):
+    bytes_per_sector, sectors_per_cluster = struct.unpack_from("<HB", boot, 11)
+    total_sectors, mft_cluster, _, serial = struct.unpack_from("<QQQ8xQ", boot, 40)
+    if bytes_per_sector not in (512, 1024, 2048, 4096) or not sectors_per_cluster:
+        return None
+    if sectors_per_cluster > 0x80:
+        # Large clusters are stored as a negative power of two
+        sectors_per_cluster = 1 << (256 - sectors_per_cluster)
+    cluster_size = bytes_per_sector * sectors_per_cluster
+    return Volume(
+        filesystem="NTFS",
+        offset=offset,
+        size=total_sectors * bytes_per_sector,
+        bytes_per_sector=bytes_per_sector,
+        sectors_per_cluster=sectors_per_cluster,
+        cluster_size=cluster_size,
+        cluster_count=total_sectors // sectors_per_cluster,
+        serial=f"{serial:016X}",
+        oem="NTFS",
+        mft_offset=offset + mft_cluster * cluster_size,
+    )
+
+
+def parse_volume(boot, offset, reader):
+    """Identify the volume whose boot sector is boot, or return None."""
+    if len(boot) < SECTOR_SIZE or boot[510:512] != BOOT_SIGNATURE:
+        return None
+    if boot[3:11] == b"EXFAT   ":
+        return _exfat_volume(boot, offset, reader)
+    if boot[3:11] == b"NTFS    ":
+        return _ntfs_volume(boot, offset)
+    # FAT has no magic of its own: a jump instruction and a sane BPB it is
+    if boot[0] in (0xEB, 0xE9):
+        return _fat_volume(boot, offset)
+    return None
+
+
+def _mbr_entries(sector):
+    for index in range(4):
+        status, part_type, lba_start, sectors = struct.unpack_from("<B3xB3xII", sector, 446 + index * 16)
+        if part_type and sectors:
+            yield status, part_type, lba_start, sectors
+
+
+def _mbr_partitions(mbr, reader):
+    partitions = []
+    for status, part_type, lba_start, sectors in _mbr_entries(mbr):
+        if part_type in MBR_EXTENDED_TYPES:
+            partitions.extend(_logical_partitions(lba_start, reader, len(partitions)))
+            continue
+        partitions.append(Partition(
+            index=len(partitions) + 1,
+            offset=lba_start * SECTOR_SIZE,
+            size=sectors * SECTOR_SIZE,
+            type=MBR_TYPES.get(part_type, f"0x{part_type:02X}"),
+            bootable=status == 0x80,
+        ))
+    return partitions
+
+
+def _logical_partitions(extended_start, reader, first_index):
+    """Follow the EBR chain of an extended partition."""
+    partitions = []
+    ebr_lba = extended_start
+    while len(partitions) < MAX_LOGICAL_PARTITIONS:
+        ebr = reader.read(ebr_lba * SECTOR_SIZE, SECTOR_SIZE)
+        if len(ebr) < SECTOR_SIZE or ebr[510:512] != BOOT_SIGNATURE:
+            break
+        entries = list(_mbr_entries(ebr))
+        if not entries:
+            break
+        status, part_type, lba_start, sectors = entries[0]
+        partitions.append(Partition(
+            index=first_index + len(partitions) + 1,
+            offset=(ebr_lba + lba_start) * SECTOR_SIZE,
+            size=sectors * SECTOR_SIZE,
+            type=MBR_TYPES.get(part_type, f"0x{part_type:02X}"),
+            bootable=status == 0x80,
+        ))
+        # The second entry points at the next EBR, relative to the extended partition
+        if len(entries) < 2 or entries[1][1] not in MBR_EXTENDED_TYPES:
+            break
+        ebr_lba = extended_start + entries[1][2]
+    return partitions
+
+
+def _gpt_partitions(reader):
+    for sector_size in GPT_SECTOR_SIZES:
+        header = reader.read(sector_size, sector_size)
+        if header[:8] == b"EFI PART":
+            break
+    else:
+        return None, None, []
+    header_size = struct.unpack_from("<I", header, 12)[0]
+    if not GPT_HEADER_SIZE <= header_size <= len(header):
+        return sector_size, None, []
+    disk_guid = str(UUID(bytes_le=header[56:72]))
+    entries_lba, num_entries, entry_size = struct.unpack_from("<QII", header, 72)
+    if not MIN_GPT_ENTRY_SIZE <= entry_size <= MAX_GPT_ENTRY_SIZE:
+        return sector_size, disk_guid, []
+    num_entries = min(num_entries, MAX_GPT_ENTRIES)
+    table = reader.read(entries_lba * sector_size, num_entries * entry_size)
+    partitions = []
+    for pos in range(0, len(table) - entry_size + 1, entry_size):
+        entry = table[pos:pos + entry_size]
+        if entry[:16] == bytes(16):
+            continue
+        type_guid = str(UUID(bytes_le=entry[:16]))
+        first_lba, last_lba = struct.unpack_from("<QQ", entry, 32)
+        partitions.append(Partition(
+            index=len(partitions) + 1,
+            offset=first_lba * sector_size,
+            size=(last_lba - first_lba + 1) * sector_size,
+            type=GPT_TYPES.get(type_guid, type_guid),
+            name=entry[56:128].decode("utf-16-le", "replace").split("\x00", 1)[0],
+        ))
+    return sector_size, disk_guid, partitions
+
+
+def read_metadata(filename):
+    """Identify the partition table and volumes of an image.
+
+    Only the sectors that describe the layout are read: the first sector,
+    the GPT header and entries, any EBRs, and each partition's boot sector.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        try:
+            return _read_layout(_Reader(f, size))
+        except (struct.error, ValueError) as e:
+            # A corrupted table is no reason to refuse the image: it is carved whole
+            print(f"Unreadable partition table in {filename}: {e}")
+            return ImageMetadata(size=size, scheme="unknown")
+
+
+def _read_layout(reader):
+    size = reader.size
+    first = reader.read(0, SECTOR_SIZE)
+    # A boot sector at offset 0 is a volume without partition table
+    volume = parse_volume(first, 0, reader)
+    if volume:
+        partition = Partition(index=1, offset=0, size=min(volume.size, size) or size,
+                              type=volume.filesystem, volume=volume)
+        return ImageMetadata(size=size, scheme="none", partitions=[partition])
+    if len(first) < SECTOR_SIZE or first[510:512] != BOOT_SIGNATURE:
+        return ImageMetadata(size=size, scheme="unknown")
+
+    entries = list(_mbr_entries(first))
+    if any(part_type == MBR_GPT_PROTECTIVE for _, part_type, _, _ in entries):
+        sector_size, disk_id, partitions = _gpt_partitions(reader)
+        metadata = ImageMetadata(size=size, scheme="gpt", sector_size=sector_size or SECTOR_SIZE,
+                                 disk_id=disk_id or "", partitions=partitions)
+    else:
+        disk_id = f"{struct.unpack_from('<I', first, 440)[0]:08X}"
+        metadata = ImageMetadata(size=size, scheme="mbr", disk_id=disk_id,
+                                 partitions=_mbr_partitions(first, reader))
+    for partition in metadata.partitions:
+        partition.volume = parse_volume(reader.read(partition.offset, SECTOR_SIZE), partition.offset, reader)
+    return metadata
+
+
+def load_metadata(filename, cache_path=None):
+    """read_metadata(filename), cached as JSON at cache_path.
+
+    Images are stored by content hash, so a cache file named after the
+    hash stays valid for as long as the image does.
+    """
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                return ImageMetadata.from_dict(json.load(f))
+        except (ValueError, TypeError):
+            pass
+    metadata = read_metadata(filename)
+    if cache_path:
+        tmp_path = f"{cache_path}.{uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(metadata.to_dict(), f)
+        os.replace(tmp_path, cache_path)
+    return metadata
+
 
 class DDMetadata:
     def __init__(self, filename, task_id):
@@ -11,42 +389,27 @@ class DDMetadata:
 
     def get_filesystem_type(self):
         try:
-            result = subprocess.run(['file', '-s', self.filename], stdout=subprocess.PIPE)
-            output = result.stdout.decode()
-            if 'FAT (16 bit)' in output:
-                return 'FAT16'
-            if 'FAT (32 bit)' in output:
-                return 'FAT32'
-            if 'NTFS' in output:
-                return 'NTFS'
-            return 'Unknown'
-        except Exception as e:
+            return read_metadata(self.filename).filesystem_type
+        except OSError as e:
             print(f"Error determining filesystem type: {e}")
             return 'Unknown'
 
     def get_metadata(self):
         print(f"Getting metadata from {self.filename}")
-
-        # Get filesystem type
-        filesystem_type = self.get_filesystem_type()
-        print(f"Filesystem type: {filesystem_type}")
-        self.metadata['filesystem_type'] = filesystem_type
-
-        # Get number of sector per fat
-        try:
-            with open(self.filename, 'rb') as f:
-                f.seek(36)  # Offset for FAT16/FAT32 sectors per FAT
-                sectors_per_fat = int.from_bytes(f.read(2), byteorder='little')
-                self.metadata['sectors_per_fat'] = sectors_per_fat
-        except Exception as e:
-            print(f"Error getting sectors per FAT: {e}")
+        image = read_metadata(self.filename)
+        print(f"Filesystem type: {image.filesystem_type}")
+        self.metadata = image.to_dict()
+        self.metadata['filesystem_type'] = image.filesystem_type
+        volumes = image.volumes
+        if volumes and volumes[0].fat_size:
+            self.metadata['sectors_per_fat'] = volumes[0].fat_size // volumes[0].bytes_per_sector
+        else:
             self.metadata['sectors_per_fat'] = 'Unknown'
-
-
+        return image
 
     def run(self):
         self.get_metadata()
-        print(self.metadata)
+        print(json.dumps(self.metadata, indent=4))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
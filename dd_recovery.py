@@ -1,73 +1,328 @@
 import argparse
+import copy
+import shutil
 import subprocess
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from queue import Queue
+from threading import Thread
 from uuid import uuid4
-from geopy.geocoders import Nominatim
-from exif import Image
-from prettytable import PrettyTable
+from werkzeug.utils import secure_filename
+from blob_store import BlobStore
+from carver import SIGNATURES, Carver, merge_ranges, write_file
+from checkpoint import Checkpoint
+from dd_metadata import read_metadata
+from fat import open_fat, safe_name
+from exif_reader import read_exif
+from geocoder import make_geocoder
+from metrics import TaskMetrics, TaskProfiler
+from progress import TaskProgress
+from results_store import ResultsWriter
+from triage import BlockMap
+
+# Files the FAT engine recovers, by extension: the types the carver finds
+FAT_FILE_TYPES = {ext for ext, _, _, _ in SIGNATURES} | {"jpeg"}
+# Folders of the output directory the builtin and FAT engines write files to
+CARVED_FOLDERS = {ext for ext, _, _, _ in SIGNATURES} | {"fat"}
+# Foremost refuses to write into a non-empty directory, and the output
+# directory already holds the results store and the checkpoint
+FOREMOST_FOLDER = "foremost"
+
+def safe_image_name(name):
+    """The uploaded file name, reduced to one safe path component.
+
+    The results CSV is named after it inside the task directory.
+    """
+    return secure_filename(os.path.basename(name.replace("\\", "/"))) or "image.dd"
 
 class DDRecovery:
-    def __init__(self, filename, required_info,task_id):
+    def __init__(self, filename, required_info,task_id, engine="builtin", workers=1, exif_workers=4, queue_depth=64, geocoder=None, progress=None,
+                 blob_store=None, image_name=None, metadata=None, metrics=None, profiler=None, triage=False):
         self.filename = filename
         self.required_info = required_info
         self.task_id = task_id
-        self.table = self.setup_table(required_info)
+        self.engine = engine
+        self.workers = workers
+        self.exif_workers = exif_workers
+        self.queue_depth = queue_depth
+        self.geocoder = geocoder or make_geocoder()
+        self.progress = progress or TaskProgress(os.path.getsize(filename))
+        self.blob_store = blob_store
+        # Stage timings and counters; a metrics.TaskProfiler also cProfiles the run
+        self.metrics = metrics or TaskMetrics()
+        self.profiler = profiler
+        # The CSV export is named after the uploaded file, whose name can
+        # differ from the content-addressed copy on disk
+        self.image_name = safe_image_name(image_name or filename)
+        # Rows go straight to the results store and CSV (a ResultsWriter)
+        # while the image is processed
+        self.results = None
+        # Where an interrupted run of the task got to (a Checkpoint), set by process_image()
+        self.checkpoint = None
+        # originalPath, created, modified, deleted of files recovered by name
+        self.fs_info = {}
         self.output_dir = f"results/{self.task_id}"
+        self.task_dir = self.output_dir
+        # Partition table and volumes (dd_metadata.ImageMetadata), read if not given
+        self.metadata = metadata
+        # With triage, a triage.BlockMap of the image rules out zero-filled
+        # and high-entropy blocks of the ranges about to be carved
+        self.triage = triage
+        self.block_map = None
+        # Set on the per-partition copies made by partition_jobs(): the
+        # partition's name, its byte ranges and where its volume starts
+        self.partition = ""
+        self.ranges = None
+        self.volume_offset = 0
 
-    def setup_table(self, required_info):
-        table = PrettyTable()
-        if required_info == "exif":
-            table.field_names = ["fileName", "has_EXIF_data", 'model', 'make', 'datetime', "GPS Coordinates", "Address"]
-        return table
+    def carver(self, ranges):
+        """A Carver for this job's ranges, resuming from and saving to the checkpoint.
+
+        Blocks ruled out by triage are left out of the ranges. What the
+        carver does not scan is counted as skipped.
+        """
+        job = self.partition or "image"
+        if self.block_map is not None:
+            ranges = self.triage_ranges(ranges if ranges is not None else [(0, self.block_map.size)])
+        carver = Carver(self.filename, self.output_dir, workers=self.workers, progress=self.progress, ranges=ranges,
+                        resume=self.checkpoint.job(job), checkpoint=lambda **state: self.checkpoint.save(job, **state))
+        # Skipped within this job's part of the image, not the whole image
+        skipped = self.progress.total_bytes - carver.scan_size
+        if skipped:
+            self.progress.update(total_bytes=carver.scan_size, bytes_skipped=skipped)
+        return carver
 
     def recover_dd(self):
-        # Run subprocess to extract the dd via foremost
+        """Carve the image, yielding the path of each file as soon as it is written."""
         print(f"Performing dd extract on {self.filename} to {self.output_dir}")
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
-        result = subprocess.run(["foremost", "-o", self.output_dir, self.filename], capture_output=True, text=True, errors="ignore")
+        if self.engine == "foremost":
+            # Foremost cannot resume a scan, only be skipped once it has finished
+            if not self.checkpoint.job("image").get("scanned_until"):
+                self.recover_dd_foremost()
+                self.checkpoint.save("image", scanned_until=self.progress.total_bytes)
+            self.progress.update(bytes_scanned=self.progress.total_bytes)
+            yield from self.carved_files()
+        elif (self.engine == "fat" and self.volume_offset is not None
+              and (volume := open_fat(self.filename, self.volume_offset))):
+            with volume.mm:
+                claimed = set()
+                yield from self.recover_fat(volume, claimed)
+                # Carve what the directory tree does not account for
+                ranges = volume.carve_ranges(claimed, image_end=self.ranges[-1][1] if self.ranges else len(volume.mm))
+            carver = self.carver(ranges)
+            print(f"Carving {carver.scan_size} unallocated bytes, skipping {self.progress.bytes_skipped} bytes")
+            yield from carver.carve()
+        else:
+            if self.engine == "fat" and self.volume_offset is not None:
+                where = f"Partition {self.partition} of {self.filename}" if self.partition else self.filename
+                print(f"{where} is not a FAT volume, carving it instead")
+            yield from self.carver(self.ranges).carve()
+
+    def recover_fat(self, volume, claimed):
+        """Recover files by walking the FAT directory tree, deleted ones included.
+
+        Files keep their original name, path and timestamps, which a
+        signature carver cannot know. They are written to
+        fat/live/ and fat/deleted/ under the output directory. The clusters
+        of recovered deleted files are added to claimed, so the carver does
+        not find them a second time. Files already written in full by an
+        interrupted run are not read again.
+        """
+        print(f"Walking {volume.fat_type} volume: {volume.cluster_count} clusters of {volume.cluster_size} bytes")
+        recovered = unrecoverable = 0
+        for entry in volume.walk():
+            if entry.is_dir or entry.name.rsplit(".", 1)[-1].lower() not in FAT_FILE_TYPES:
+                continue
+            clusters = volume.file_clusters(entry)
+            if clusters is None:
+                # Its clusters have been allocated to another file since
+                unrecoverable += 1
+                continue
+            if entry.deleted:
+                claimed.update(clusters)
+            recovered += 1
+            folder = os.path.join(self.output_dir, "fat", "deleted" if entry.deleted else "live")
+            os.makedirs(folder, exist_ok=True)
+            path = f"{folder}/{recovered:06d}_{safe_name(entry.name)}"
+            if not (os.path.exists(path) and os.path.getsize(path) == entry.size):
+                write_file(path, volume.read_clusters(clusters, entry.size))
+            self.fs_info[path] = [entry.path, entry.created, entry.modified, "true" if entry.deleted else "false"]
+            yield path
+        print(f"Recovered {recovered} files from the FAT, {unrecoverable} deleted files were overwritten")
+
+    def recover_dd_foremost(self):
+        # Run subprocess to extract the dd via foremost
+        foremost_dir = os.path.join(self.output_dir, FOREMOST_FOLDER)
+        if os.path.exists(foremost_dir):
+            # Left by a run interrupted before foremost finished
+            shutil.rmtree(foremost_dir)
+        result = subprocess.run(["foremost", "-o", foremost_dir, self.filename], capture_output=True, text=True, errors="ignore")
         print(f"Result stdout: {result.stdout.encode('utf-8').decode('utf-8')}")
         print(f"Result stderr: {result.stderr.encode('utf-8').decode('utf-8')}")
+        if result.returncode != 0:
+            raise RuntimeError(f"foremost exited with status {result.returncode}: {result.stderr.strip()}")
+        print("Extraction successful")
 
-        if result.stdout is None or result.stderr is not None:
-            print("Extraction successful")
+    def carved_files(self):
+        foremost_dir = os.path.join(self.output_dir, FOREMOST_FOLDER)
+        for folder in sorted(os.listdir(foremost_dir)):
+            if not os.path.isdir(f"{foremost_dir}/{folder}"):
+                continue
 
-    def process_files(self):
-        folders = os.listdir(self.output_dir)
+            files = os.listdir(f"{foremost_dir}/{folder}")
+            for file in files:
+                yield f"{foremost_dir}/{folder}/{file}"
+
+    def unprocessed_files(self, seen):
+        """Files an interrupted run carved that this run has not yielded again.
 
-        for folder in folders:
-            if folder in ["audit.txt", "metadata.json"]:
+        Those that were queued for EXIF extraction but have no row yet
+        still need processing.
+        """
+        for folder in sorted(CARVED_FOLDERS & set(os.listdir(self.output_dir))):
+            for root, _, files in os.walk(os.path.join(self.output_dir, folder)):
+                for file in sorted(files):
+                    file_dir = os.path.join(root, file)
+                    if file_dir not in seen:
+                        yield file_dir
+
+    def process_file(self, file_dir):
+        folder, file = file_dir.split("/")[-2:]
+        print(f"Processing file: ({file}) from {folder} folder")
+
+        # Files already carved by an earlier task share its blob and reuse
+        # its row instead of being parsed and geocoded again
+        digest = None
+        if self.blob_store:
+            with self.metrics.stage("blob_dedup"):
+                digest = self.blob_store.add(file_dir)
+        if self.required_info == "exif":
+            fs_info = self.fs_info.get(file_dir, ["", "", "", ""]) + [self.partition]
+            cached = self.blob_store.get_row(digest) if digest else None
+            if digest:
+                self.metrics.count("blob_cache_misses" if cached is None else "blob_cache_hits")
+            if cached is not None:
+                print(f"{file} was processed by an earlier task")
+                self.add_row(file_dir, [file] + cached + fs_info)
+                return
+            row = self.extract_exif(file_dir, file)
+            # A failed address lookup (None) is not cached, so it is retried
+            lookup_failed = row[6] is None
+            row[6] = row[6] or ""
+            self.add_row(file_dir, row + fs_info)
+            if digest and not lookup_failed:
+                self.blob_store.put_row(digest, row[1:])
+
+    def exif_worker(self, work, failures):
+        """Process queued files until None, recording the first failure in failures.
+
+        After a failure the queue is still drained, so the producer is never
+        left waiting on a queue no worker reads.
+        """
+        while (file_dir := work.get()) is not None:
+            if failures:
+                continue
+            try:
+                self.process_file(file_dir)
+            except Exception as e:
+                print(f"Processing {file_dir} failed: {e}")
+                failures.append(e)
                 continue
+            self.progress.add(files_parsed=1)
+            self.metrics.count("files_parsed")
 
-            files = os.listdir(f"{self.output_dir}/{folder}")
-            for file in files:
-                print(f"Processing file: ({file}) from {folder} folder")
-                file_dir = f"{self.output_dir}/{folder}/{file}"
+    def profiled(self, fn, *args):
+        """Call fn, under the profiler when the task is profiled."""
+        return self.profiler.call(fn, *args) if self.profiler else fn(*args)
+
+    def process_files(self):
+        """Run carving and EXIF extraction as a producer/consumer pipeline.
+
+        Carved files go onto a bounded queue that a pool of EXIF workers
+        drains, so parsing overlaps carving and at most queue_depth files are
+        waiting at any time. When resuming, files that already have a row
+        are not processed again. A file that fails to process stops the
+        carve and fails the task; a rerun resumes and retries it.
+        """
+        work = Queue(maxsize=self.queue_depth)
+        failures = []
+        workers = [Thread(target=self.profiled, args=(self.exif_worker, work, failures), daemon=True)
+                   for _ in range(self.exif_workers)]
+        for worker in workers:
+            worker.start()
+
+        start = time.perf_counter()
+        carved = 0
+        seen = set()
+        files = self.recover_dd()
+        if self.checkpoint.resumed:
+            files = chain(files, self.unprocessed_files(seen))
+        try:
+            for file_dir in self.metrics.timed("carve", files):
+                if failures:
+                    break
+                if carved == 0:
+                    print(f"First file carved after {time.perf_counter() - start:.2f}s")
+                carved += 1
+                self.progress.add(files_carved=1)
+                self.metrics.count("files_carved")
+                seen.add(file_dir)
+                if os.path.relpath(file_dir, self.task_dir) in self.results.paths:
+                    self.progress.add(files_parsed=1)
+                    self.metrics.count("files_resumed")
+                    continue
+                work.put(file_dir)
+            self.progress.update(stage="parsing")
+        finally:
+            for _ in workers:
+                work.put(None)
+            for worker in workers:
+                worker.join()
+        if failures:
+            raise failures[0]
+        print(f"Processed {carved} files in {time.perf_counter() - start:.2f}s")
 
-                if self.required_info == "exif":
-                    self.extract_exif(file_dir, file)
+    def add_row(self, file_dir, row):
+        with self.metrics.stage("results_write"):
+            self.results.add(os.path.relpath(file_dir, self.task_dir), row)
 
     def extract_exif(self, file_dir, file_name):
         try:
-            with open(file_dir, "rb") as f:
-                img = Image(file_dir)
-                has_exif = img.has_exif
-                if has_exif:
-                    print(f"{file_name} contains exif data")
+            with self.metrics.stage("exif_parse"):
+                tags = read_exif(file_dir)
+            if tags:
+                print(f"{file_name} contains exif data")
 
+                coords = ""
+                address = ""
+                if "gps_latitude" in tags and "gps_longitude" in tags:
                     # Extract coordinates
-                    coords = (self.decimal_coords(img.gps_latitude, img.gps_latitude_ref),
-                              self.decimal_coords(img.gps_longitude, img.gps_longitude_ref))
+                    coords = (self.decimal_coords(tags["gps_latitude"], tags.get("gps_latitude_ref")),
+                              self.decimal_coords(tags["gps_longitude"], tags.get("gps_longitude_ref")))
                     # Get Address from the coordinates
-                    geo_loc = Nominatim(user_agent="GetLoc")
-                    locname = geo_loc.reverse(coords)
-                    self.table.add_row([file_name, "true", img.get('make'), img.get('model'), img.get("datetime_original"), coords, locname.address])
-                else:
-                    self.table.add_row([file_name, "false", "", "", "", "", ""])
+                    address = self.reverse_geocode(coords)
+                return [file_name, "true", tags.get('model'), tags.get('make'), tags.get("datetime_original"), coords, address]
+            return [file_name, "false", "", "", "", "", ""]
         except Exception as e:
             print(f"Error: {e}")
             print(f"Ignoring {file_name} as it is not the target required Info: ({self.required_info})")
-            self.table.add_row([file_name, "false", "", "", "", "", ""])
+            return [file_name, "false", "", "", "", "", ""]
+
+    def reverse_geocode(self, coords):
+        self.progress.add(geocode_lookups=1)
+        try:
+            with self.metrics.stage("geocode"):
+                address, hit = self.geocoder.lookup(*coords)
+        except Exception as e:
+            print(f"Error reverse geocoding {coords}: {e}")
+            self.metrics.count("geocode_errors")
+            return None
+        self.metrics.count("geocode_cache_hits" if hit else "geocode_cache_misses")
+        return address
 
     def decimal_coords(self, coords, ref):
         decimal_degrees = coords[0] + coords[1] / 60 + coords[2] / 3600
@@ -75,19 +330,130 @@ class DDRecovery:
             decimal_degrees = -decimal_degrees
         return decimal_degrees
 
-    def run(self):
-        self.recover_dd()
+    def partition_jobs(self):
+        """Split the image into units of work that are processed in parallel.
+
+        Each partition, and the space no partition covers (gaps, deleted
+        partitions), gets a shallow copy of this DDRecovery with its own
+        output folder, byte ranges and progress, sharing the results table.
+        An image without a partition table is a single job: this one.
+        Foremost can only scan whole images, so it is never split.
+        """
+        metadata = self.metadata or read_metadata(self.filename)
+        if self.engine == "foremost" or metadata.scheme not in ("mbr", "gpt") or not metadata.partitions:
+            return [self]
+        size = os.path.getsize(self.filename)
+        regions = []
+        for partition in metadata.partitions:
+            start, end = partition.offset, min(partition.offset + partition.size, size)
+            if start < end:
+                regions.append((f"p{partition.index}", [(start, end)], start))
+        covered = merge_ranges([ranges[0] for _, ranges, _ in regions], size)
+        gaps = [(start, end) for start, end in zip([0] + [end for _, end in covered], [start for start, _ in covered] + [size])
+                if start < end]
+        if gaps:
+            regions.append(("unpartitioned", gaps, None))
+
+        workers = max(1, self.workers // min(len(regions), self.workers))
+        jobs = []
+        for name, ranges, volume_offset in regions:
+            job = copy.copy(self)
+            job.partition = name
+            job.ranges = ranges
+            job.volume_offset = volume_offset
+            job.output_dir = os.path.join(self.output_dir, name)
+            job.workers = workers
+            job.progress = self.progress.partition(name, sum(end - start for start, end in ranges))
+            jobs.append(job)
+        return jobs
+
+    def process_job(self):
         self.process_files()
-        print(self.table)
-        with open(f"{self.output_dir}/{self.filename}_results.csv", "w", newline="") as output:
-            output.write(self.table.get_csv_string())
+        self.progress.update(stage="done")
+
+    def run(self):
+        self.profiled(self.process_image)
+        self.metrics.count("bytes_scanned", self.progress.bytes_scanned)
+        self.metrics.finish()
+
+    def triage_ranges(self, ranges):
+        """Triage the blocks of the ranges about to be carved and return the ranges worth scanning.
+
+        The map is saved after each job, so an interrupted task does not
+        triage the same blocks again.
+        """
+        stage = self.progress.stage
+        self.progress.update(stage="triage")
+        with self.metrics.stage("triage"):
+            self.block_map.triage(self.filename, ranges)
+            self.block_map.save(self.task_dir)
+        kept = self.block_map.carve_ranges(ranges)
+        triaged_out = sum(end - start for start, end in ranges) - sum(end - start for start, end in kept)
+        where = f"partition {self.partition}" if self.partition else self.filename
+        print(f"Triage of {where}: skipping {triaged_out} zero-filled or high-entropy bytes")
+        self.metrics.count("bytes_triaged_out", triaged_out)
+        self.progress.update(stage=stage)
+        return kept
+
+    def process_image(self):
+        # Set before partition_jobs(), so every job shares the checkpoint and the writer
+        self.checkpoint = Checkpoint(self.output_dir, [os.path.basename(self.filename),
+                                                       os.path.getsize(self.filename), self.engine, self.required_info])
+        if self.checkpoint.resumed:
+            print(f"Resuming task {self.task_id} from its checkpoint")
+        elif os.path.exists(self.output_dir):
+            # Output of another image or engine, or of a run that saved no checkpoint
+            shutil.rmtree(self.output_dir)
+        os.makedirs(self.output_dir, exist_ok=True)
+        # Saved up front, so a run interrupted before its first chunk resumes too
+        self.checkpoint.save()
+        csv_path = f"{self.output_dir}/{self.image_name}_results.csv"
+        self.results = ResultsWriter(self.output_dir, csv_path, header=self.required_info == "exif",
+                                     resume=self.checkpoint.resumed)
+        # Foremost always scans the whole image, so triage would not save it anything.
+        # Blocks are triaged per job, once its engine knows which ranges it carves.
+        if self.triage and self.engine != "foremost":
+            size = os.path.getsize(self.filename)
+            block_map = BlockMap.load(self.output_dir)
+            self.block_map = block_map if block_map is not None and block_map.size == size else BlockMap(size)
+        try:
+            jobs = self.partition_jobs()
+            if jobs == [self]:
+                self.process_files()
+            else:
+                print(f"Processing {len(jobs)} partitions of {self.filename}: {', '.join(job.partition for job in jobs)}")
+                with ThreadPoolExecutor(max_workers=min(len(jobs), self.workers)) as executor:
+                    for future in [executor.submit(job.profiled, job.process_job) for job in jobs]:
+                        future.result()
+            self.progress.update(stage="writing")
+        finally:
+            # Whatever was processed stays readable, even if the run failed
+            with self.metrics.stage("results_write"):
+                self.results.close()
+        print(f"Wrote {self.results.rows} result rows to {csv_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--filename", help="File Name with paths")
     parser.add_argument("--requiredInfo", help="Required type info to extract")
     parser.add_argument("--task_id", help="Task ID",default=str(uuid4()))
+    parser.add_argument("--engine", help="Recovery engine: builtin or foremost carving, or fat (walks the FAT, deleted files included)", choices=["builtin", "foremost", "fat"], default="builtin")
+    parser.add_argument("--workers", help="Number of carving worker processes", type=int, default=os.cpu_count())
+    parser.add_argument("--exif_workers", help="Number of EXIF extraction threads", type=int, default=4)
+    parser.add_argument("--geocoder", help="Reverse geocoding backend", choices=["nominatim", "offline", "none"], default="nominatim")
+    parser.add_argument("--gazetteer", help="Gazetteer file for the offline geocoder (GeoNames .txt or name,latitude,longitude .csv)")
+    parser.add_argument("--blob_store", help="Directory of the carved-file store shared between runs (no deduplication if omitted)")
+    parser.add_argument("--geocode_precision", help="Decimal places coordinates are rounded to for geocode caching", type=int, default=3)
+    parser.add_argument("--profile", help="Save a cProfile of the run to profile.pstats in the output directory", action="store_true")
+    parser.add_argument("--triage", help="Skip zero-filled and high-entropy blocks when carving", action="store_true")
     args = parser.parse_args()
 
-    processor = DDRecovery(args.filename, args.requiredInfo, args.task_id)
+    geocoder = make_geocoder(args.geocoder, args.gazetteer, precision=args.geocode_precision)
+    blob_store = BlobStore(args.blob_store) if args.blob_store else None
+    processor = DDRecovery(args.filename, args.requiredInfo, args.task_id, args.engine, args.workers, args.exif_workers,
+                           geocoder=geocoder, blob_store=blob_store, profiler=TaskProfiler() if args.profile else None,
+                           triage=args.triage)
     processor.run()
+    processor.metrics.save(processor.output_dir)
+    if processor.profiler:
+        processor.profiler.save(processor.output_dir)
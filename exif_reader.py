@@ -0,0 +1,151 @@
+import struct
+
+# Enough for the SOI marker and the start of APP1 in almost every JPEG; the
+# rest of APP1 is read only when the segment is longer than this.
+HEAD_SIZE = 4096
+
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIME_ORIGINAL = 0x9003
+GPS_TAGS = {1: "gps_latitude_ref", 2: "gps_latitude", 3: "gps_longitude_ref", 4: "gps_longitude"}
+
+# TIFF field type -> (struct code, size in bytes)
+FIELD_TYPES = {1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("I", 4), 5: ("II", 8), 7: ("B", 1), 9: ("i", 4), 10: ("ii", 8)}
+
+
+class ExifParseError(ValueError):
+    pass
+
+
+def _read_at(f, head, offset, size):
+    if offset + size <= len(head):
+        return head[offset:offset + size]
+    f.seek(offset)
+    return f.read(size)
+
+
+def _find_app1(f):
+    """Return the Exif APP1 payload, None if the JPEG has no Exif segment."""
+    head = f.read(HEAD_SIZE)
+    if head[:2] != b"\xff\xd8":
+        raise ExifParseError("not a JPEG")
+    pos = 2
+    while True:
+        segment = _read_at(f, head, pos, 4)
+        if len(segment) < 4:
+            raise ExifParseError("truncated JPEG header")
+        if segment[0] != 0xFF:
+            raise ExifParseError(f"bad marker at offset {pos}")
+        marker = segment[1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0xDA, 0xD9):
+            # Image data starts: there is no Exif segment
+            return None
+        length = struct.unpack(">H", segment[2:4])[0]
+        if length < 2:
+            raise ExifParseError(f"bad segment length at offset {pos}")
+        if marker == 0xE1:
+            payload = _read_at(f, head, pos + 4, length - 2)
+            if payload.startswith(b"Exif\x00\x00"):
+                return payload[6:]
+        pos += 2 + length
+
+
+class _Tiff:
+    def __init__(self, data):
+        if data[:2] == b"II":
+            self.order = "<"
+        elif data[:2] == b"MM":
+            self.order = ">"
+        else:
+            raise ExifParseError("bad TIFF byte order")
+        self.data = data
+
+    def unpack(self, fmt, offset):
+        try:
+            return struct.unpack_from(self.order + fmt, self.data, offset)
+        except struct.error:
+            raise ExifParseError(f"TIFF offset {offset} out of range")
+
+    def ifd(self, offset, tags):
+        """Return {tag: value} for the given tags of one IFD.
+
+        Only those entries are decoded: MakerNote and the like can be
+        large, and a corrupted count would otherwise size the unpack.
+        """
+        entries = {}
+        (count,) = self.unpack("H", offset)
+        for i in range(count):
+            tag, field_type, n, value_offset = self.unpack("HHII", offset + 2 + i * 12)
+            if tag not in tags or field_type not in FIELD_TYPES:
+                continue
+            code, size = FIELD_TYPES[field_type]
+            start = offset + 2 + i * 12 + 8 if size * n <= 4 else value_offset
+            if start + size * n > len(self.data):
+                raise ExifParseError(f"TIFF tag 0x{tag:04X} runs past the end of the payload")
+            if field_type == 2:
+                raw = self.data[start:start + n]
+                entries[tag] = raw.split(b"\x00", 1)[0].decode("ascii", errors="replace").strip()
+            elif field_type in (5, 10):
+                values = [self.unpack(code, start + j * 8) for j in range(n)]
+                entries[tag] = tuple(num / den if den else 0.0 for num, den in values)
+            else:
+                values = self.unpack(code * n, start)
+                entries[tag] = values[0] if n == 1 else values
+        return entries
+
+
+def parse_exif_header(path):
+    """Read only the JPEG header and return the tags the results table uses.
+
+    Returns None for a JPEG without Exif and raises ExifParseError for
+    anything this reader does not understand.
+    """
+    with open(path, "rb") as f:
+        payload = _find_app1(f)
+    if payload is None:
+        return None
+
+    tiff = _Tiff(payload)
+    (ifd0_offset,) = tiff.unpack("I", 4)
+    ifd0 = tiff.ifd(ifd0_offset, (TAG_MAKE, TAG_MODEL, TAG_EXIF_IFD, TAG_GPS_IFD))
+    tags = {"make": ifd0.get(TAG_MAKE), "model": ifd0.get(TAG_MODEL), "datetime_original": None}
+    if TAG_EXIF_IFD in ifd0:
+        tags["datetime_original"] = tiff.ifd(ifd0[TAG_EXIF_IFD], (TAG_DATETIME_ORIGINAL,)).get(TAG_DATETIME_ORIGINAL)
+    if TAG_GPS_IFD in ifd0:
+        gps = tiff.ifd(ifd0[TAG_GPS_IFD], GPS_TAGS)
+        for tag, name in GPS_TAGS.items():
+            if tag in gps:
+                tags[name] = gps[tag]
+    return tags
+
+
+def parse_exif_library(path):
+    """Same result as parse_exif_header, using the full `exif` library."""
+    from exif import Image
+
+    img = Image(path)
+    if not img.has_exif:
+        return None
+    tags = {"make": img.get("make"), "model": img.get("model"), "datetime_original": img.get("datetime_original")}
+    for name in GPS_TAGS.values():
+        value = img.get(name)
+        if value is not None:
+            tags[name] = value
+    return tags
+
+
+def read_exif(path):
+    """Return the EXIF tags of a carved file, or None if it has none.
+
+    The header-only reader handles ordinary JPEGs; anything it cannot parse
+    is handed to the `exif` library.
+    """
+    try:
+        return parse_exif_header(path)
+    except ExifParseError:
+        return parse_exif_library(path)
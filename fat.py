@@ -0,0 +1,364 @@
+import mmap
+import os
+import re
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+DIR_ENTRY_SIZE = 32
+DELETED = 0xE5
+ATTR_READ_ONLY = 0x01
+ATTR_HIDDEN = 0x02
+ATTR_SYSTEM = 0x04
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_LFN = 0x0F
+# Characters of a long file name entry: offsets of its three UTF-16 runs
+LFN_RUNS = ((1, 11), (14, 26), (28, 32))
+# Deleted directories are followed at most this deep, as their chains are gone
+MAX_DEPTH = 32
+
+FatEntry = namedtuple(
+    "FatEntry", "path name short_name attributes first_cluster size created modified accessed deleted"
+)
+FatEntry.is_dir = property(lambda self: bool(self.attributes & ATTR_DIRECTORY))
+# Sizes are in sectors; first_data_sector is counted from the start of the volume
+Bpb = namedtuple(
+    "Bpb", "bytes_per_sector sectors_per_cluster reserved_sectors num_fats root_entry_count fat_size total_sectors"
+    " root_dir_sectors first_data_sector cluster_count fat_type"
+)
+
+
+class FatError(ValueError):
+    pass
+
+
+def lfn_checksum(short_name):
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+def fat_datetime(date, time=0, centiseconds=0):
+    """FAT packed date/time -> 'YYYY-MM-DD HH:MM:SS', or '' if unset or invalid."""
+    if not date:
+        return ""
+    year, month, day = 1980 + (date >> 9), (date >> 5) & 0x0F, date & 0x1F
+    hour, minute, second = time >> 11, (time >> 5) & 0x3F, (time & 0x1F) * 2 + centiseconds // 100
+    if not (1 <= month <= 12 and 1 <= day <= 31 and hour < 24 and minute < 60 and second < 60):
+        return ""
+    return f"{year:04d}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}"
+
+
+def safe_name(name):
+    """A recovered name that is safe to use as a single path component."""
+    name = re.sub(r'[\x00-\x1f/\\:*?"<>|]', "_", name).strip(" .")
+    return name or "_"
+
+
+def parse_bpb(boot):
+    """Parse and check the BIOS parameter block of a FAT boot sector."""
+    (bytes_per_sector, sectors_per_cluster, reserved_sectors, num_fats, root_entry_count,
+     total_sectors_16, _, fat_size_16) = struct.unpack_from("<HBHBHHBH", boot, 11)
+    (total_sectors_32, fat_size_32) = struct.unpack_from("<II", boot, 32)
+    if bytes_per_sector not in (512, 1024, 2048, 4096):
+        raise FatError(f"bad bytes per sector: {bytes_per_sector}")
+    if sectors_per_cluster == 0 or sectors_per_cluster & (sectors_per_cluster - 1):
+        raise FatError(f"bad sectors per cluster: {sectors_per_cluster}")
+    if num_fats == 0 or reserved_sectors == 0:
+        raise FatError("bad FAT layout")
+
+    fat_size = fat_size_16 or fat_size_32
+    total_sectors = total_sectors_16 or total_sectors_32
+    root_dir_sectors = -(-root_entry_count * DIR_ENTRY_SIZE // bytes_per_sector)
+    first_data_sector = reserved_sectors + num_fats * fat_size + root_dir_sectors
+    if fat_size == 0 or total_sectors <= first_data_sector:
+        raise FatError("bad FAT layout")
+    cluster_count = (total_sectors - first_data_sector) // sectors_per_cluster
+
+    # Microsoft's rule: the FAT type follows from the cluster count alone
+    if cluster_count < 4085:
+        fat_type = "FAT12"
+    elif cluster_count < 65525:
+        fat_type = "FAT16"
+    else:
+        fat_type = "FAT32"
+    return Bpb(bytes_per_sector, sectors_per_cluster, reserved_sectors, num_fats, root_entry_count, fat_size,
+               total_sectors, root_dir_sectors, first_data_sector, cluster_count, fat_type)
+
+
+class FatVolume:
+    """A FAT12/16/32 volume read straight from a memory-mapped image.
+
+    The BPB is parsed once and the first FAT is decoded into a NumPy array
+    of next-cluster values; directory and file data are read from the map
+    one contiguous cluster run at a time. offset is where the volume
+    starts in the image, for partitioned disks.
+    """
+
+    def __init__(self, mm, offset=0):
+        self.mm = mm
+        self.offset = offset
+        boot = mm[offset:offset + 512]
+        if len(boot) < 512 or boot[510:512] != b"\x55\xaa":
+            raise FatError("no boot sector signature")
+        bpb = parse_bpb(boot)
+        self.bytes_per_sector = bpb.bytes_per_sector
+        self.sectors_per_cluster = bpb.sectors_per_cluster
+        self.reserved_sectors = bpb.reserved_sectors
+        self.num_fats = bpb.num_fats
+        self.root_entry_count = bpb.root_entry_count
+        self.fat_size = bpb.fat_size
+        self.total_sectors = bpb.total_sectors
+        self.cluster_count = bpb.cluster_count
+        self.fat_type = bpb.fat_type
+        self.cluster_size = self.bytes_per_sector * self.sectors_per_cluster
+        self.fat_offset = offset + self.reserved_sectors * self.bytes_per_sector
+        self.root_dir_offset = self.fat_offset + self.num_fats * self.fat_size * self.bytes_per_sector
+        self.root_dir_size = bpb.root_dir_sectors * self.bytes_per_sector
+        self.data_offset = self.root_dir_offset + self.root_dir_size
+        self.root_cluster = struct.unpack_from("<I", boot, 44)[0] if self.fat_type == "FAT32" else 0
+        self.end_of_chain = {"FAT12": 0xFF8, "FAT16": 0xFFF8, "FAT32": 0x0FFFFFF8}[self.fat_type]
+        self.fat = self.read_fat()
+
+    def read_fat(self):
+        """Decode the first FAT into an array indexed by cluster number."""
+        entries = self.cluster_count + 2
+        if self.fat_type == "FAT12":
+            raw = np.frombuffer(self.mm[self.fat_offset:self.fat_offset + (entries * 3 + 1) // 2 + 1], dtype=np.uint8)
+            raw = raw[:len(raw) // 3 * 3].reshape(-1, 3).astype(np.uint32)
+            fat = np.empty(len(raw) * 2, dtype=np.uint32)
+            fat[0::2] = raw[:, 0] | ((raw[:, 1] & 0x0F) << 8)
+            fat[1::2] = (raw[:, 1] >> 4) | (raw[:, 2] << 4)
+        elif self.fat_type == "FAT16":
+            fat = np.frombuffer(self.mm[self.fat_offset:self.fat_offset + entries * 2], dtype="<u2").astype(np.uint32)
+        else:
+            fat = np.frombuffer(self.mm[self.fat_offset:self.fat_offset + entries * 4], dtype="<u4") & 0x0FFFFFFF
+        if len(fat) < entries:
+            raise FatError("FAT truncated")
+        return fat[:entries]
+
+    def valid_cluster(self, cluster):
+        return 2 <= cluster < self.cluster_count + 2
+
+    def cluster_offset(self, cluster):
+        return self.data_offset + (cluster - 2) * self.cluster_size
+
+    def chain(self, first_cluster):
+        """Clusters of an allocated chain, stopping at a loop or a bad link."""
+        clusters = []
+        seen = set()
+        cluster = first_cluster
+        while self.valid_cluster(cluster) and cluster not in seen:
+            seen.add(cluster)
+            clusters.append(cluster)
+            cluster = int(self.fat[cluster])
+            if cluster >= self.end_of_chain:
+                break
+        return clusters
+
+    def runs(self, clusters):
+        """Group clusters into (first_cluster, count) runs of adjacent clusters."""
+        runs = []
+        for cluster in clusters:
+            if runs and runs[-1][0] + runs[-1][1] == cluster:
+                runs[-1][1] += 1
+            else:
+                runs.append([cluster, 1])
+        return runs
+
+    def read_clusters(self, clusters, size=None):
+        """Read clusters in order, one slice of the map per contiguous run."""
+        parts = []
+        for first, count in self.runs(clusters):
+            start = self.cluster_offset(first)
+            parts.append(self.mm[start:start + count * self.cluster_size])
+        data = b"".join(parts)
+        return data if size is None else data[:size]
+
+    def deleted_clusters(self, first_cluster, size):
+        """Clusters of a deleted file, assumed contiguous from its first one.
+
+        Deleting a file zeroes its FAT chain, so the clusters that follow
+        are the best guess. Returns None if any of them has been allocated
+        again since, i.e. the data has been overwritten.
+        """
+        count = max(1, -(-size // self.cluster_size))
+        if not self.valid_cluster(first_cluster) or not self.valid_cluster(first_cluster + count - 1):
+            return None
+        if np.any(self.fat[first_cluster:first_cluster + count]):
+            return None
+        return list(range(first_cluster, first_cluster + count))
+
+    def directory_data(self, entry):
+        if entry is None:
+            if self.fat_type == "FAT32":
+                return self.read_clusters(self.chain(self.root_cluster))
+            return self.mm[self.root_dir_offset:self.root_dir_offset + self.root_dir_size]
+        if entry.deleted:
+            # The size of a directory is not recorded; read one cluster
+            clusters = self.deleted_clusters(entry.first_cluster, self.cluster_size)
+            return self.read_clusters(clusters) if clusters else b""
+        return self.read_clusters(self.chain(entry.first_cluster))
+
+    def parse_directory(self, data, parent_path="", parent_deleted=False):
+        """Yield the FatEntry of every file and subdirectory in a directory's data.
+
+        Long file names are assembled from the LFN entries preceding each
+        short entry and kept if their checksum matches. For deleted entries,
+        whose first short-name byte was overwritten with 0xE5, the checksum
+        also recovers that lost character.
+        """
+        lfn_parts = []
+        for pos in range(0, len(data) - DIR_ENTRY_SIZE + 1, DIR_ENTRY_SIZE):
+            raw = data[pos:pos + DIR_ENTRY_SIZE]
+            first = raw[0]
+            if first == 0x00:
+                break
+            attributes = raw[11]
+            if attributes == ATTR_LFN:
+                lfn_parts.append(raw)
+                continue
+            parts, lfn_parts = lfn_parts, []
+            if attributes & ATTR_VOLUME_ID or raw[:2] in (b".\x00", b". ") or raw[:2] == b"..":
+                continue
+
+            deleted = first == DELETED or parent_deleted
+            short_raw = bytes(raw[:11])
+            long_name = self.long_name(parts, short_raw, first == DELETED)
+            if first == DELETED and long_name:
+                short_raw = bytes([self.lost_first_byte(parts[-1][13], short_raw)]) + short_raw[1:]
+            short_name = self.short_name(short_raw)
+            name = long_name or short_name
+
+            high, = struct.unpack_from("<H", raw, 20)
+            low, = struct.unpack_from("<H", raw, 26)
+            first_cluster = low | (high << 16 if self.fat_type == "FAT32" else 0)
+            ctime_tenth, ctime, cdate, adate = struct.unpack_from("<BHHH", raw, 13)
+            mtime, mdate = struct.unpack_from("<HH", raw, 22)
+            size, = struct.unpack_from("<I", raw, 28)
+            yield FatEntry(
+                path=f"{parent_path}/{name}", name=name, short_name=short_name, attributes=attributes,
+                first_cluster=first_cluster, size=size,
+                created=fat_datetime(cdate, ctime, ctime_tenth), modified=fat_datetime(mdate, mtime),
+                accessed=fat_datetime(adate), deleted=deleted,
+            )
+
+    def long_name(self, parts, short_raw, deleted):
+        """Assemble a long name from its LFN entries (stored last part first)."""
+        if not parts:
+            return None
+        checksum = parts[0][13]
+        if any(part[13] != checksum for part in parts):
+            return None
+        if not deleted:
+            if lfn_checksum(short_raw) != checksum or parts[0][0] & 0x40 == 0:
+                return None
+        elif self.lost_first_byte(checksum, short_raw) is None:
+            return None
+        chars = b"".join(bytes(part[start:end]) for part in reversed(parts) for start, end in LFN_RUNS)
+        name = chars.decode("utf-16-le", errors="replace")
+        return name.split("\x00", 1)[0] or None
+
+    @staticmethod
+    def lost_first_byte(checksum, short_raw):
+        """The first short-name byte that makes the LFN checksum match, if any."""
+        for byte in range(0x20, 0x7F):
+            if lfn_checksum(bytes([byte]) + short_raw[1:]) == checksum:
+                return byte
+        return None
+
+    @staticmethod
+    def short_name(short_raw):
+        base = short_raw[:8].decode("cp437", errors="replace").rstrip()
+        ext = short_raw[8:11].decode("cp437", errors="replace").rstrip()
+        if short_raw[0] == DELETED:
+            base = "_" + base[1:]
+        elif short_raw[0] == 0x05:
+            # 0x05 stands for a leading 0xE5 byte in the name
+            base = "σ" + base[1:]
+        return f"{base}.{ext}" if ext else base
+
+    def walk(self, include_deleted=True):
+        """Yield every file and directory entry, depth first from the root.
+
+        Deleted directories are followed too (their first cluster only), so
+        files deleted along with their folder are still found.
+        """
+        stack = [(None, "", False, 0)]
+        seen = set()
+        while stack:
+            directory, path, deleted, depth = stack.pop()
+            for entry in self.parse_directory(self.directory_data(directory), path, deleted):
+                if entry.deleted and not include_deleted:
+                    continue
+                yield entry
+                if entry.is_dir and depth < MAX_DEPTH and self.valid_cluster(entry.first_cluster):
+                    if (entry.first_cluster, entry.deleted) not in seen:
+                        seen.add((entry.first_cluster, entry.deleted))
+                        stack.append((entry, entry.path, entry.deleted, depth + 1))
+
+    def file_clusters(self, entry):
+        """Clusters holding the file's data, or None if it cannot be recovered."""
+        if entry.size == 0 or entry.first_cluster == 0:
+            return []
+        if entry.deleted:
+            return self.deleted_clusters(entry.first_cluster, entry.size)
+        clusters = self.chain(entry.first_cluster)
+        # A chain shorter than the size says has been damaged
+        return clusters if len(clusters) * self.cluster_size >= entry.size else None
+
+    def free_clusters(self, claimed=()):
+        """Bitmap of unallocated clusters, indexed from cluster 2.
+
+        claimed clusters (e.g. those of deleted files already recovered
+        by name) are counted as allocated.
+        """
+        free = self.fat[2:] == 0
+        if claimed:
+            free[np.fromiter(claimed, dtype=np.int64, count=len(claimed)) - 2] = False
+        return free
+
+    def carve_ranges(self, claimed=(), slack=True, image_end=None):
+        """Byte ranges of the image that can hold unlisted file data.
+
+        That is the unallocated clusters (less the claimed ones), the slack
+        after the end of each live file in its last cluster, the sectors
+        past the last whole cluster and, up to image_end, whatever follows
+        the volume in the image.
+        """
+        free = self.free_clusters(claimed)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], free.view(np.int8), [0]))))
+        ranges = [(self.cluster_offset(int(first) + 2), self.cluster_offset(int(last) + 2))
+                  for first, last in zip(edges[0::2], edges[1::2])]
+        if slack:
+            for entry in self.walk(include_deleted=False):
+                if entry.is_dir or not entry.size % self.cluster_size:
+                    continue
+                clusters = self.file_clusters(entry)
+                if clusters:
+                    last = clusters[-(-entry.size // self.cluster_size) - 1]
+                    ranges.append((self.cluster_offset(last) + entry.size % self.cluster_size,
+                                   self.cluster_offset(last + 1)))
+        volume_end = self.offset + self.total_sectors * self.bytes_per_sector
+        data_end = self.cluster_offset(self.cluster_count + 2)
+        if data_end < volume_end:
+            ranges.append((data_end, volume_end))
+        if image_end is not None and volume_end < image_end:
+            ranges.append((volume_end, image_end))
+        return sorted(ranges)
+
+
+def open_fat(filename, offset=0):
+    """Map an image and return its FatVolume, or None if it is not FAT."""
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return FatVolume(mm, offset)
+    except FatError:
+        mm.close()
+        return None
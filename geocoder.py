@@ -0,0 +1,285 @@
+import csv
+import math
+import os
+import sqlite3
+import time
+from threading import Event, Lock
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def coordinate_key(lat, lon, precision):
+    return f"{lat:.{precision}f},{lon:.{precision}f}"
+
+
+class GeocodeCache:
+    """On-disk reverse-geocode cache keyed by rounded coordinates.
+
+    Entries carry a last-used timestamp; once the cache grows past
+    max_entries the least recently used tenth is evicted. The row count
+    is kept in memory. Hits do not commit on their own: their last-used
+    times are written with the next insert, or once used_batch are pending.
+    """
+
+    def __init__(self, path, max_entries=100000, used_batch=256):
+        self.path = path
+        self.max_entries = max_entries
+        self.used_batch = used_batch
+        self.lock = Lock()
+        self.used = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, address TEXT, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)")
+        self.conn.commit()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+
+    def get(self, key):
+        """Return the cached address (possibly '') or None on a miss."""
+        with self.lock:
+            row = self.conn.execute("SELECT address FROM geocode WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.used[key] = time.time()
+            if len(self.used) >= self.used_batch:
+                self._write_used()
+                self.conn.commit()
+            return row[0]
+
+    def put(self, key, address):
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO geocode (key, address, last_used) VALUES (?, ?, ?)",
+                (key, address or "", time.time()),
+            )
+            if cursor.rowcount:
+                self.count += 1
+            else:
+                self.conn.execute(
+                    "UPDATE geocode SET address = ?, last_used = ? WHERE key = ?", (address or "", time.time(), key)
+                )
+            # Pending hits share this commit, and count towards recency before the oldest entries go
+            self._write_used()
+            if self.count > self.max_entries:
+                evict = self.count - self.max_entries + self.max_entries // 10
+                cursor = self.conn.execute(
+                    "DELETE FROM geocode WHERE key IN (SELECT key FROM geocode ORDER BY last_used LIMIT ?)",
+                    (evict,),
+                )
+                self.count -= cursor.rowcount
+            self.conn.commit()
+
+    def _write_used(self):
+        self.conn.executemany("UPDATE geocode SET last_used = ? WHERE key = ?",
+                              [(used, key) for key, used in self.used.items()])
+        self.used.clear()
+
+    def close(self):
+        with self.lock:
+            self._write_used()
+            self.conn.commit()
+            self.conn.close()
+
+
+class NominatimBackend:
+    """Online reverse geocoding through OpenStreetMap Nominatim.
+
+    A single client is shared and calls are spaced min_delay seconds apart,
+    as required by the Nominatim usage policy.
+    """
+
+    def __init__(self, user_agent="GetLoc", min_delay=1.0):
+        from geopy.geocoders import Nominatim
+
+        self.client = Nominatim(user_agent=user_agent)
+        self.min_delay = min_delay
+        self.lock = Lock()
+        self.last_call = 0.0
+
+    def reverse(self, lat, lon):
+        with self.lock:
+            wait = self.last_call + self.min_delay - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                location = self.client.reverse((lat, lon))
+            finally:
+                self.last_call = time.monotonic()
+        return location.address if location else None
+
+
+def _unit_vector(lat, lon):
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+class KDTree:
+    """Static 3-d tree over points on the unit sphere.
+
+    Straight-line (chord) distance between unit vectors grows with the
+    great-circle distance, so the nearest point in 3-d is the nearest place.
+    """
+
+    def __init__(self, points):
+        # Node arrays: point index, split axis, left child, right child
+        self.points = points
+        self.index = []
+        self.axis = []
+        self.left = []
+        self.right = []
+        self.root = self._build(list(range(len(points))), 0)
+
+    def _build(self, indices, depth):
+        if not indices:
+            return -1
+        axis = depth % 3
+        indices.sort(key=lambda i: self.points[i][axis])
+        middle = len(indices) // 2
+        node = len(self.index)
+        self.index.append(indices[middle])
+        self.axis.append(axis)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.left[node] = self._build(indices[:middle], depth + 1)
+        self.right[node] = self._build(indices[middle + 1:], depth + 1)
+        return node
+
+    def nearest(self, target):
+        """Return (point index, squared chord distance) of the nearest point."""
+        best = [-1, float("inf")]
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node == -1:
+                continue
+            point = self.points[self.index[node]]
+            distance = sum((a - b) ** 2 for a, b in zip(point, target))
+            if distance < best[1]:
+                best = [self.index[node], distance]
+            delta = target[self.axis[node]] - point[self.axis[node]]
+            near, far = (self.left[node], self.right[node]) if delta < 0 else (self.right[node], self.left[node])
+            # The far side can only hold a closer point if the splitting
+            # plane is nearer than the best match so far.
+            if delta * delta < best[1]:
+                stack.append(far)
+            stack.append(near)
+        return best[0], best[1]
+
+
+class OfflineBackend:
+    """Nearest-place lookup against a local gazetteer, for air-gapped use.
+
+    Accepts a GeoNames dump (tab separated, e.g. cities1000.txt) or a CSV
+    with name, latitude and longitude columns (country optional).
+    """
+
+    def __init__(self, gazetteer_path, max_distance_km=50.0):
+        self.max_distance_km = max_distance_km
+        self.places = []
+        points = []
+        for name, lat, lon in self.load(gazetteer_path):
+            self.places.append(name)
+            points.append(_unit_vector(lat, lon))
+        self.tree = KDTree(points)
+
+    def load(self, path):
+        with open(path, newline="", encoding="utf-8") as f:
+            if path.endswith(".csv"):
+                for row in csv.DictReader(f):
+                    name = ", ".join(part for part in (row["name"], row.get("country", "")) if part)
+                    yield name, float(row["latitude"]), float(row["longitude"])
+            else:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) < 9:
+                        continue
+                    yield f"{fields[1]}, {fields[8]}", float(fields[4]), float(fields[5])
+
+    def reverse(self, lat, lon):
+        if not self.places:
+            return None
+        index, chord_squared = self.tree.nearest(_unit_vector(lat, lon))
+        distance_km = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_squared) / 2))
+        if distance_km > self.max_distance_km:
+            return None
+        return self.places[index]
+
+
+class NullBackend:
+    def reverse(self, lat, lon):
+        return None
+
+
+class Geocoder:
+    """Reverse geocoder with a persistent cache in front of a backend.
+
+    Coordinates are rounded to `precision` decimal places before lookup, so
+    photos taken close together share one cache entry. Concurrent requests
+    for the same key wait for a single backend call instead of issuing
+    their own.
+    """
+
+    def __init__(self, backend, cache=None, precision=3):
+        self.backend = backend
+        self.cache = cache
+        self.precision = precision
+        self.lock = Lock()
+        self.in_flight = {}
+        self.lookups = 0
+        self.cache_hits = 0
+
+    def reverse(self, lat, lon):
+        return self.lookup(lat, lon)[0]
+
+    def lookup(self, lat, lon):
+        """(address, True if it came from the cache or a concurrent lookup)."""
+        key = coordinate_key(lat, lon, self.precision)
+        with self.lock:
+            pending = self.in_flight.get(key)
+            if pending is None:
+                pending = self.in_flight[key] = [Event(), None]
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            pending[0].wait()
+            with self.lock:
+                self.cache_hits += 1
+            return pending[1], True
+
+        try:
+            address = self.cache.get(key) if self.cache else None
+            hit = address is not None
+            if hit:
+                with self.lock:
+                    self.cache_hits += 1
+            else:
+                with self.lock:
+                    self.lookups += 1
+                lat, lon = (float(value) for value in key.split(","))
+                address = self.backend.reverse(lat, lon) or ""
+                if self.cache:
+                    self.cache.put(key, address)
+            pending[1] = address
+            return address, hit
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            pending[0].set()
+
+
+def make_geocoder(backend="nominatim", gazetteer=None, cache_path="results/geocode_cache.sqlite", precision=3):
+    if backend == "offline":
+        if not gazetteer:
+            raise ValueError("The offline geocoder needs a gazetteer file")
+        geo_backend = OfflineBackend(gazetteer)
+    elif backend == "none":
+        geo_backend = NullBackend()
+    else:
+        geo_backend = NominatimBackend()
+    cache = GeocodeCache(cache_path) if cache_path else None
+    return Geocoder(geo_backend, cache, precision)
@@ -0,0 +1,47 @@
+import hashlib
+import os
+import time
+
+# Large reusable buffer: evidence images are tens of GB, so the per-call
+# overhead of small reads dominates long before disk bandwidth does.
+CHUNK_SIZE = 4 * 1024 * 1024
+HASH_ALGORITHMS = ("md5", "sha1", "sha256")
+
+
+def stream_to_file(stream, file_path, chunk_size=CHUNK_SIZE):
+    """Copy an upload stream to file_path, hashing it on the way through.
+
+    The image is read once into a single reusable buffer, so memory use is
+    bounded by chunk_size regardless of image size. Returns the size, the
+    digests and the ingest throughput.
+    """
+    hashers = {name: hashlib.new(name) for name in HASH_ALGORITHMS}
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    readinto = getattr(stream, "readinto", None)
+    size = 0
+
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    start = time.perf_counter()
+    with open(file_path, "wb") as out:
+        while True:
+            if readinto is not None:
+                n = readinto(buffer)
+                chunk = view[:n]
+            else:
+                chunk = stream.read(chunk_size)
+                n = len(chunk)
+            if not n:
+                break
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            out.write(chunk)
+            size += n
+    elapsed = time.perf_counter() - start
+    view.release()
+
+    result = {name: hasher.hexdigest() for name, hasher in hashers.items()}
+    result["size"] = size
+    result["ingest_seconds"] = round(elapsed, 3)
+    result["ingest_mbps"] = round(size / (1024 * 1024) / elapsed, 2) if elapsed > 0 else 0.0
+    return result
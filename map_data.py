@@ -0,0 +1,272 @@
+import gzip
+import hashlib
+import html
+import json
+import math
+import os
+from uuid import uuid4
+
+import numpy as np
+
+# Bump when the feature layout changes so stale cache files are not served
+GEOJSON_VERSION = 3
+CACHE_DIR = "geojson"
+
+# Below this many points every zoom gets the full-detail layer
+LOD_MIN_POINTS = 1000
+# Zoom levels a reduced layer is precomputed for; a map at zoom z uses the
+# highest level <= z
+LOD_ZOOMS = (2, 5, 8, 11, 14, 17)
+# Points closer than this on screen are merged into one cluster marker
+CLUSTER_CELL_PX = 40
+# Most cluster markers a reduced level holds; a level whose zoom would have
+# more is clustered at the highest lower zoom that fits
+MAX_LEVEL_FEATURES = 5000
+# Track vertices that move the line by less than this are dropped
+SIMPLIFY_TOLERANCE_PX = 2
+TILE_SIZE_PX = 256
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def _timeline_records(points):
+    return [(lat, lon, when.replace(" ", "T") + "Z", file_name, address) for lat, lon, when, file_name, address in points]
+
+
+def _popup(idx, file_name, address, when):
+    return (f"<b>{idx}.</b><br><b>Filename:</b> {html.escape(file_name)}"
+            f"<br><b>Address:</b> {html.escape(address or '')}<br><b>Time:</b> {when}")
+
+
+def point_features(points):
+    """Build the full-detail timeline features for GPS points sorted by time.
+
+    points are (lat, lon, datetime, file_name, address) tuples, with
+    datetime as 'YYYY-MM-DD HH:MM:SS'. One LineString joins each consecutive
+    pair, followed by a numbered Point per photo.
+    """
+    records = _timeline_records(points)
+    features = []
+
+    # Create GeoJSON features (this is to generate the line connecting the points)
+    for (lat, lon, when, _, _), (next_lat, next_lon, next_when, _, _) in zip(records, records[1:]):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": [[lon, lat], [next_lon, next_lat]]},
+            "properties": {"times": [when, next_when], "style": {"color": "blue", "weight": 5}},
+        })
+
+    # Add numbered markers with popups as GeoJSON features
+    for idx, (lat, lon, when, file_name, address) in enumerate(records, start=1):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"times": [when], "popup": _popup(idx, file_name, address, when)},
+        })
+    return features
+
+
+def mercator(lat, lon):
+    """Web Mercator position of a coordinate, both axes scaled to [0, 1]."""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0
+    return x, y
+
+
+def simplify_track(xy, tolerance):
+    """Douglas-Peucker: indices of the vertices to keep, in order.
+
+    Iterative, so 100k-point tracks do not hit the recursion limit, and the
+    distances of each span are computed with NumPy in one go.
+    """
+    if len(xy) < 3:
+        return list(range(len(xy)))
+    points = np.asarray(xy, dtype=np.float64)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    tolerance_squared = tolerance * tolerance
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = points[first], points[last]
+        span = points[first + 1:last] - start
+        direction = end - start
+        length_squared = direction @ direction
+        if length_squared == 0:
+            distances = (span * span).sum(axis=1)
+        else:
+            # Squared distance from each point to the segment
+            t = np.clip(span @ direction / length_squared, 0.0, 1.0)
+            offset = span - t[:, None] * direction
+            distances = (offset * offset).sum(axis=1)
+        farthest = int(distances.argmax())
+        if distances[farthest] > tolerance_squared:
+            farthest += first + 1
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return np.flatnonzero(keep).tolist()
+
+
+def cluster_points(records, xy, zoom):
+    """Group time-ordered records into grid cells of CLUSTER_CELL_PX at `zoom`.
+
+    Returns one cluster per occupied cell, as a list of record indices in
+    time order.
+    """
+    cell = CLUSTER_CELL_PX / (TILE_SIZE_PX * 2 ** zoom)
+    cells = {}
+    for i, (x, y) in enumerate(xy):
+        cells.setdefault((int(x / cell), int(y / cell)), []).append(i)
+    return list(cells.values())
+
+
+def capped_clusters(records, xy, zoom):
+    """Return (zoom, clusters): cluster_points at the highest zoom, up to
+    zoom, that gives at most MAX_LEVEL_FEATURES clusters.
+
+    Cells nest from one zoom to the next, so the cluster count only grows
+    with the zoom.
+    """
+    clusters = cluster_points(records, xy, zoom)
+    while len(clusters) > MAX_LEVEL_FEATURES and zoom > 0:
+        zoom -= 1
+        clusters = cluster_points(records, xy, zoom)
+    return zoom, clusters
+
+
+def lod_features(records, xy, zoom, clusters=None):
+    """Clustered points plus a simplified track for one zoom level.
+
+    clusters are those of cluster_points at zoom, computed when not given.
+    """
+    tolerance = SIMPLIFY_TOLERANCE_PX / (TILE_SIZE_PX * 2 ** zoom)
+    kept = simplify_track(xy, tolerance)
+    features = [{
+        "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": [[records[i][1], records[i][0]] for i in kept]},
+        "properties": {"times": [records[i][2] for i in kept], "style": {"color": "blue", "weight": 5}},
+    }] if len(kept) > 1 else []
+
+    if clusters is None:
+        clusters = cluster_points(records, xy, zoom)
+    for members in clusters:
+        first = records[members[0]]
+        if len(members) == 1:
+            popup = _popup(members[0] + 1, first[3], first[4], first[2])
+        else:
+            last = records[members[-1]]
+            names = "<br>".join(html.escape(records[i][3]) for i in members[:10])
+            more = f"<br>... and {len(members) - 10} more" if len(members) > 10 else ""
+            popup = (f"<b>{len(members)} photos</b><br><b>From:</b> {first[2]}<br><b>To:</b> {last[2]}"
+                     f"<br><b>Files:</b><br>{names}{more}")
+        lat = sum(records[i][0] for i in members) / len(members)
+        lon = sum(records[i][1] for i in members) / len(members)
+        # A cluster appears on the timeline with its earliest photo
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"times": [first[2]], "popup": popup, "count": len(members)},
+        })
+    return features
+
+
+def _write_cached(cache_dir, name, geojson):
+    body = json.dumps(geojson, separators=(",", ":")).encode("utf-8")
+    etag = hashlib.sha256(body).hexdigest()
+    path = os.path.join(cache_dir, name + ".json.gz")
+    tmp_path = f"{path}.{uuid4().hex}.tmp"
+    with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+    return name + ".json.gz", etag
+
+
+def build_levels(cache_dir, prefix, points):
+    """Write every level of detail for one filter and return the manifest."""
+    records = _timeline_records(points)
+    levels = {"full": _write_cached(cache_dir, prefix + "-full", {
+        "type": "FeatureCollection", "features": point_features(points),
+    })}
+    zooms = []
+    if len(records) > LOD_MIN_POINTS:
+        xy = [mercator(lat, lon) for lat, lon, _, _, _ in records]
+        built = None
+        for zoom in LOD_ZOOMS:
+            level_zoom, clusters = capped_clusters(records, xy, zoom)
+            if level_zoom == built:
+                # Capped to the level below, which pick_level serves
+                # instead; so would every finer level be
+                break
+            levels[str(zoom)] = _write_cached(cache_dir, f"{prefix}-z{zoom}", {
+                "type": "FeatureCollection", "features": lod_features(records, xy, level_zoom, clusters),
+            })
+            zooms.append(zoom)
+            built = level_zoom
+    return {"points": len(records), "zooms": zooms, "levels": levels}
+
+
+def pick_level(manifest, zoom):
+    if zoom is None or not manifest["zooms"]:
+        return "full"
+    usable = [level for level in manifest["zooms"] if level <= zoom]
+    return str(usable[-1] if usable else manifest["zooms"][0])
+
+
+def remove_stale(cache_dir, current):
+    """Delete the cache files of older results revisions and layouts.
+
+    Every file name starts with "<filter>-<revision>-v<version>", so a
+    file belongs to the current revision when that part ends in current.
+    """
+    for name in os.listdir(cache_dir):
+        if name.split("-", 1)[-1].startswith((current + "-", current + ".")):
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            # Removed by a concurrent request
+            pass
+
+
+def _open_level(cache_dir, manifest_path, zoom):
+    """(file, etag) of the cached level for zoom, or None if it is gone."""
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        name, etag = manifest["levels"][pick_level(manifest, zoom)]
+        return open(os.path.join(cache_dir, name), "rb"), etag
+    except FileNotFoundError:
+        return None
+
+
+def cached_geojson(task_dir, store, filter_key, filters, zoom=None):
+    """Return (file, etag) of the gzipped GeoJSON for a task filter and zoom.
+
+    All levels of detail are built together, once per filter and results
+    revision, and listed in a small manifest; later calls only read the
+    manifest. Files of earlier revisions are deleted when a new one is
+    written. The file is returned open, so a request building a newer
+    revision can delete it without breaking the response that sends it;
+    files deleted before they could be opened are built again. The ETag
+    is the SHA-256 of the JSON body.
+    """
+    current = f"{store.revision()}-v{GEOJSON_VERSION}"
+    prefix = f"{filter_key or 'all'}-{current}"
+    cache_dir = os.path.join(task_dir, CACHE_DIR)
+    manifest_path = os.path.join(cache_dir, prefix + ".manifest.json")
+    while True:
+        level = _open_level(cache_dir, manifest_path, zoom)
+        if level:
+            return level
+        os.makedirs(cache_dir, exist_ok=True)
+        manifest = build_levels(cache_dir, prefix, store.gps_points(*filters))
+        # The manifest is renamed into place last, so a reader that finds
+        # it also finds every file it lists
+        tmp_path = f"{manifest_path}.{uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+        remove_stale(cache_dir, current)
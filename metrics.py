@@ -0,0 +1,194 @@
+import cProfile
+import json
+import os
+import pstats
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+METRICS_NAME = "metrics.json"
+PROFILE_NAME = "profile.pstats"
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def hit_rate(hits, misses):
+    return round(hits / (hits + misses), 4) if hits + misses else None
+
+
+class TaskMetrics:
+    """Per-stage wall and CPU time, and counters, of one extraction task.
+
+    Stages can run on several threads at once (EXIF parsing, geocoding), so
+    their times add up across threads and a stage's wall time can exceed
+    the task's. CPU time is that of the calling thread: the carving worker
+    processes are not counted in it.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = time.monotonic()
+        self.finished = None
+        # name -> [calls, wall seconds, CPU seconds]
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def timed(self, name, iterable):
+        """Iterate, timing the production of each item as a call of the stage."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def record(self, name, wall, cpu=0.0, calls=1):
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += calls
+            stage[1] += wall
+            stage[2] += cpu
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = (self.finished or time.monotonic()) - self.started
+            stages = {
+                name: {"calls": calls, "wall_s": round(wall, 4), "cpu_s": round(cpu, 4)}
+                for name, (calls, wall, cpu) in self.stages.items()
+            }
+            counters = dict(self.counters)
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "stages": stages,
+            "counters": counters,
+            "rates": {
+                "files_per_s": round(counters.get("files_carved", 0) / elapsed, 2) if elapsed else 0.0,
+                "bytes_per_s": round(counters.get("bytes_scanned", 0) / elapsed) if elapsed else 0,
+                "blob_cache_hit_rate": hit_rate(counters.get("blob_cache_hits", 0), counters.get("blob_cache_misses", 0)),
+                "geocode_cache_hit_rate": hit_rate(
+                    counters.get("geocode_cache_hits", 0), counters.get("geocode_cache_misses", 0)
+                ),
+            },
+        }
+
+    def save(self, task_dir):
+        with open(os.path.join(task_dir, METRICS_NAME), "w") as f:
+            json.dump(self.snapshot(), f, indent=4)
+
+
+class TaskProfiler:
+    """cProfile of a task across the threads it runs on.
+
+    A profiler only sees the thread it is enabled in, so every thread the
+    task starts runs its target through call(); the profiles are merged
+    when saved.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.profiles = []
+
+    def call(self, fn, *args):
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        return profile.runcall(fn, *args)
+
+    def save(self, task_dir):
+        with self.lock:
+            if not self.profiles:
+                return
+            pstats.Stats(*self.profiles).dump_stats(os.path.join(task_dir, PROFILE_NAME))
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, rendered for Prometheus."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.lock = Lock()
+        self.buckets = buckets
+        self.help = {}
+        # (name, labels) -> value, where labels is a sorted tuple of pairs
+        self.counters = {}
+        # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self.histograms = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            histogram[bisect_left(self.buckets, value)] += 1
+            histogram[-1] += value
+
+    def add_task(self, snapshot, status):
+        """Fold a finished task's TaskMetrics snapshot into the totals."""
+        self.inc("dd_tasks_total", status=status)
+        for stage, times in snapshot["stages"].items():
+            self.inc("dd_stage_calls_total", times["calls"], stage=stage)
+            self.inc("dd_stage_wall_seconds_total", times["wall_s"], stage=stage)
+            self.inc("dd_stage_cpu_seconds_total", times["cpu_s"], stage=stage)
+        for name, value in snapshot["counters"].items():
+            self.inc(f"dd_{name}_total", value)
+
+    def render(self, gauges=None):
+        """The text exposition format; gauges are {name: value} read at scrape time."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for name, value in sorted((gauges or {}).items()):
+            header(name, "gauge")
+            lines.append(f"{name} {value}")
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,170 @@
+import time
+from threading import Condition
+
+MB = 1024 * 1024
+
+# How long a finished task's last snapshot stays in the registry
+FINISHED_TTL = 3600
+
+
+class TaskProgress:
+    """Counters of one extraction task, safe to update from any thread.
+
+    DDRecovery bumps them as the image is scanned and files are carved,
+    parsed and geocoded; snapshot() derives the throughput and ETA.
+    """
+
+    def __init__(self, total_bytes, changed=None):
+        self.total_bytes = total_bytes
+        self.changed = changed or Condition()
+        self.version = 0
+        self.started = time.monotonic()
+        self.finished = None
+        self.status = "in_progress"
+        self.stage = "carving"
+        self.error = None
+        self.bytes_scanned = 0
+        # Allocated bytes a filesystem-aware scan leaves out of total_bytes
+        self.bytes_skipped = 0
+        self.scanned_at = self.started
+        self.files_carved = 0
+        self.files_parsed = 0
+        self.geocode_lookups = 0
+        self.partitions = []
+
+    def _changed(self):
+        self.version += 1
+        self.changed.notify_all()
+
+    def add(self, **counts):
+        with self.changed:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+            self._changed()
+
+    def update(self, **values):
+        with self.changed:
+            for name, value in values.items():
+                setattr(self, name, value)
+            if "bytes_scanned" in values:
+                self.scanned_at = time.monotonic()
+            self._changed()
+
+    def finish(self, status, error=None):
+        self.update(status=status, stage="done", error=error, finished=time.monotonic())
+
+    def partition(self, name, total_bytes):
+        """Progress of one partition of the image, counted in this task's totals too."""
+        with self.changed:
+            partition = PartitionProgress(self, name, total_bytes)
+            self.partitions.append(partition)
+            self._changed()
+        return partition
+
+    def snapshot(self):
+        with self.changed:
+            elapsed = (self.finished or time.monotonic()) - self.started
+            # Scan throughput, up to the last chunk scanned
+            scan_seconds = self.scanned_at - self.started
+            mbps = self.bytes_scanned / MB / scan_seconds if scan_seconds > 0 else 0.0
+            eta = None
+            if self.status == "in_progress":
+                if self.bytes_scanned < self.total_bytes:
+                    if mbps:
+                        eta = (self.total_bytes - self.bytes_scanned) / MB / mbps
+                elif self.files_parsed:
+                    # Carving is over; what is left is parsing the carved files
+                    eta = (self.files_carved - self.files_parsed) / (self.files_parsed / elapsed)
+            return {
+                "version": self.version,
+                "status": self.status,
+                "stage": self.stage,
+                "error": self.error,
+                "total_bytes": self.total_bytes,
+                "bytes_scanned": self.bytes_scanned,
+                "bytes_skipped": self.bytes_skipped,
+                "files_carved": self.files_carved,
+                "files_parsed": self.files_parsed,
+                "geocode_lookups": self.geocode_lookups,
+                "elapsed_s": round(elapsed, 1),
+                "mbps": round(mbps, 2),
+                "eta_s": None if eta is None else round(eta, 1),
+                "partitions": [partition.snapshot() for partition in self.partitions],
+            }
+
+
+class PartitionProgress:
+    """The TaskProgress interface for one partition processed on its own.
+
+    Byte and file counts are also applied to the task, so its totals, rate
+    and ETA keep covering the whole image.
+    """
+
+    COUNTERS = ("total_bytes", "bytes_scanned", "bytes_skipped", "files_carved", "files_parsed", "geocode_lookups")
+
+    def __init__(self, task, name, total_bytes):
+        self.task = task
+        self.name = name
+        self.total_bytes = total_bytes
+        self.stage = "carving"
+        for counter in self.COUNTERS[1:]:
+            setattr(self, counter, 0)
+
+    def add(self, **counts):
+        with self.task.changed:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+                setattr(self.task, name, getattr(self.task, name) + count)
+            self.task._changed()
+
+    def update(self, **values):
+        with self.task.changed:
+            for name, value in values.items():
+                if name in self.COUNTERS:
+                    setattr(self.task, name, getattr(self.task, name) + value - getattr(self, name))
+                setattr(self, name, value)
+            if "bytes_scanned" in values:
+                self.task.scanned_at = time.monotonic()
+            self.task._changed()
+
+    def snapshot(self):
+        return {"name": self.name, "stage": self.stage, **{name: getattr(self, name) for name in self.COUNTERS}}
+
+
+class ProgressRegistry:
+    """In-memory progress of the tasks running in this process."""
+
+    def __init__(self):
+        self.changed = Condition()
+        self.tasks = {}
+
+    def start(self, task_id, total_bytes):
+        with self.changed:
+            self._expire()
+            progress = self.tasks[task_id] = TaskProgress(total_bytes, self.changed)
+            self.changed.notify_all()
+        return progress
+
+    def get(self, task_id):
+        with self.changed:
+            return self.tasks.get(task_id)
+
+    def wait(self, task_id, version=None, timeout=None):
+        """Block until the task's progress moves past version; return its snapshot.
+
+        Returns None if the task has no progress here, e.g. it is still
+        queued or finished before a restart. The snapshot is returned
+        unchanged when the timeout expires.
+        """
+        with self.changed:
+            self.changed.wait_for(
+                lambda: task_id in self.tasks and self.tasks[task_id].version != version, timeout
+            )
+            progress = self.tasks.get(task_id)
+        return progress.snapshot() if progress else None
+
+    def _expire(self):
+        now = time.monotonic()
+        for task_id, progress in list(self.tasks.items()):
+            if progress.finished and now - progress.finished > FINISHED_TTL:
+                del self.tasks[task_id]
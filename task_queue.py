@@ -0,0 +1,287 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+from threading import Condition, Lock, Thread
+
+QUEUED = "queued"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    image_hash TEXT,
+    datetime TEXT NOT NULL,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    workers INTEGER NOT NULL DEFAULT 1,
+    size INTEGER NOT NULL DEFAULT 0,
+    metadata TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_image_hash ON tasks (image_hash);
+CREATE INDEX IF NOT EXISTS tasks_queue ON tasks (status, priority DESC, enqueued_at);
+CREATE INDEX IF NOT EXISTS tasks_datetime ON tasks (datetime);
+CREATE INDEX IF NOT EXISTS tasks_filename ON tasks (filename, datetime);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, datetime);
+"""
+# Columns /tasks can be sorted by; datetime breaks ties
+SORT_COLUMNS = ("datetime", "filename", "status")
+
+
+class TaskQueue:
+    """Durable FIFO-by-priority queue of extraction tasks, kept in SQLite.
+
+    The same table is the index of every task, past and present, that the
+    /tasks page is paged and sorted from.
+
+    A task is claimed only when it fits the CPU budget (the sum of the
+    carving workers of running tasks) and the disk budget (free space left
+    after the image size is reserved for its carved output). Tasks found
+    in_progress on startup were interrupted by a crash or restart: they are
+    queued again, or failed once they have used max_attempts.
+    """
+
+    def __init__(self, path, cpu_budget, disk_reserve=0, max_attempts=2):
+        self.path = path
+        self.cpu_budget = cpu_budget
+        self.disk_reserve = disk_reserve
+        self.max_attempts = max_attempts
+        self.lock = Lock()
+        self.changed = Condition(self.lock)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = [column[1] for column in self.conn.execute("PRAGMA table_info(tasks)")]
+        if columns and "image_hash" not in columns:
+            self.conn.execute("ALTER TABLE tasks ADD COLUMN image_hash TEXT")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def enqueue(self, file_metadata, workers=1, priority=0):
+        """Queue a task and return its task_id.
+
+        An image (by SHA-256) has one task that did not fail. If one is
+        already queued, running or completed, nothing is queued and its
+        task_id is returned instead. The check and the insert are one
+        transaction, so two uploads of an image cannot both queue it.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            task = self.conn.execute(
+                "SELECT task_id FROM tasks WHERE image_hash = ? AND status != ? ORDER BY enqueued_at DESC LIMIT 1",
+                (file_metadata.get("sha256"), FAILED),
+            ).fetchone()
+            if task:
+                self.conn.commit()
+                return task["task_id"]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, filename, image_hash, datetime, status, priority, workers, size,"
+                " metadata, enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_metadata["task_id"], file_metadata["filename"], file_metadata.get("sha256"),
+                 file_metadata["datetime"], QUEUED, priority, max(1, workers), file_metadata.get("size", 0),
+                 json.dumps(file_metadata), time.time()),
+            )
+            self.conn.commit()
+            self.changed.notify_all()
+        return file_metadata["task_id"]
+
+    def recover(self):
+        """Requeue or fail tasks left in_progress by a previous process.
+
+        Their partial output is kept: the rerun resumes from the task's
+        checkpoint. Returns the number of tasks requeued.
+        """
+        with self.lock:
+            interrupted = self.conn.execute(
+                "SELECT task_id, attempts FROM tasks WHERE status = ?", (IN_PROGRESS,)
+            ).fetchall()
+            requeued = 0
+            for task in interrupted:
+                if task["attempts"] >= self.max_attempts:
+                    self.conn.execute(
+                        "UPDATE tasks SET status = ?, finished_at = ?, error = ? WHERE task_id = ?",
+                        (FAILED, time.time(), "Interrupted too many times", task["task_id"]),
+                    )
+                else:
+                    self.conn.execute(
+                        "UPDATE tasks SET status = ?, started_at = NULL WHERE task_id = ?", (QUEUED, task["task_id"])
+                    )
+                    requeued += 1
+            self.conn.commit()
+            self.changed.notify_all()
+            return requeued
+
+    def claim(self, output_dir, timeout=None):
+        """Block until a queued task is admitted, mark it in_progress and return it.
+
+        Tasks are tried strictly in (priority, enqueue time) order, so a
+        large task at the head is not overtaken by smaller ones. A task that
+        does not fit on the disk even with nothing else running is failed.
+        Returns None on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while True:
+                task = self.conn.execute(
+                    "SELECT * FROM tasks WHERE status = ? ORDER BY priority DESC, enqueued_at LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if task:
+                    cpu_in_use = self.conn.execute(
+                        "SELECT COALESCE(SUM(workers), 0) FROM tasks WHERE status = ?", (IN_PROGRESS,)
+                    ).fetchone()[0]
+                    fits_disk = task["size"] + self.disk_reserve <= shutil.disk_usage(output_dir).free
+                    # One task always runs on its own, whatever its worker count
+                    fits_cpu = cpu_in_use == 0 or cpu_in_use + task["workers"] <= self.cpu_budget
+                    if fits_disk and fits_cpu:
+                        self.conn.execute(
+                            "UPDATE tasks SET status = ?, started_at = ?, attempts = attempts + 1 WHERE task_id = ?",
+                            (IN_PROGRESS, time.time(), task["task_id"]),
+                        )
+                        self.conn.commit()
+                        return dict(task)
+                    if not fits_disk and cpu_in_use == 0:
+                        self.conn.execute(
+                            "UPDATE tasks SET status = ?, finished_at = ?, error = ? WHERE task_id = ?",
+                            (FAILED, time.time(), "Not enough free disk space", task["task_id"]),
+                        )
+                        self.conn.commit()
+                        continue
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                # Woken when a task is queued or finishes
+                self.changed.wait(remaining)
+
+    def finish(self, task_id, error=None):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE tasks SET status = ?, finished_at = ?, error = ? WHERE task_id = ?",
+                (FAILED if error else COMPLETED, time.time(), error, task_id),
+            )
+            self.conn.commit()
+            self.changed.notify_all()
+
+    def get(self, task_id):
+        with self.lock:
+            task = self.conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return dict(task) if task else None
+
+    def find_image(self, image_hash):
+        """The latest task of an image (by SHA-256), or None.
+
+        A task that did not fail is preferred. A failed one is returned
+        otherwise, so the image is extracted again under the same task_id
+        and resumes from that task's checkpoint.
+        """
+        with self.lock:
+            task = self.conn.execute(
+                "SELECT * FROM tasks WHERE image_hash = ? ORDER BY status = ?, enqueued_at DESC LIMIT 1",
+                (image_hash, FAILED),
+            ).fetchone()
+        return dict(task) if task else None
+
+    def position(self, task_id):
+        """1-based place of a queued task in the queue, or None if it is not queued."""
+        with self.lock:
+            task = self.conn.execute(
+                "SELECT status, priority, enqueued_at FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if not task or task["status"] != QUEUED:
+                return None
+            ahead = self.conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status = ? AND"
+                " (priority > ? OR (priority = ? AND enqueued_at < ?))",
+                (QUEUED, task["priority"], task["priority"], task["enqueued_at"]),
+            ).fetchone()[0]
+        return ahead + 1
+
+    def page(self, sort="datetime", descending=True, offset=0, limit=50):
+        """Return (tasks, has_more) for one page of the task index.
+
+        Each sort order is served by an index, so a page costs the same
+        however many tasks there are, short of very deep offsets.
+        """
+        if sort not in SORT_COLUMNS:
+            sort = "datetime"
+        direction = "DESC" if descending else "ASC"
+        order = f"{sort} {direction}" if sort == "datetime" else f"{sort} {direction}, datetime {direction}"
+        with self.lock:
+            tasks = [dict(task) for task in self.conn.execute(
+                "SELECT task_id, filename, datetime, status, error FROM tasks"
+                f" ORDER BY {order} LIMIT ? OFFSET ?", (limit + 1, offset)
+            )]
+        return tasks[:limit], len(tasks) > limit
+
+    def import_results(self, output_dir):
+        """Index the tasks found in output_dir/<task_id>/metadata.json, once.
+
+        Only tasks that predate the index need this; later ones are added
+        when they are queued. The import is recorded in the database's
+        user_version so the results directory is scanned a single time.
+        """
+        with self.lock:
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] >= 1:
+                return 0
+            records = []
+            for task_id in os.listdir(output_dir) if os.path.isdir(output_dir) else []:
+                metadata_file = os.path.join(output_dir, task_id, "metadata.json")
+                if not os.path.exists(metadata_file):
+                    continue
+                with open(metadata_file, "r") as f:
+                    file_metadata = json.load(f)
+                records.append((
+                    task_id, file_metadata["filename"], file_metadata.get("sha256"), file_metadata["datetime"],
+                    file_metadata.get("status", COMPLETED),
+                    file_metadata.get("size", 0), json.dumps(file_metadata), os.path.getmtime(metadata_file),
+                ))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO tasks (task_id, filename, image_hash, datetime, status, size, metadata,"
+                " enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            self.conn.execute("PRAGMA user_version = 1")
+            self.conn.commit()
+            return len(records)
+
+
+class TaskWorkerPool:
+    """A fixed number of threads running tasks claimed from a TaskQueue.
+
+    run(task_id, file_metadata, workers) does the work; an exception marks
+    the task failed instead of killing the worker.
+    """
+
+    def __init__(self, queue, run, output_dir, size=1):
+        self.queue = queue
+        self.run = run
+        self.output_dir = output_dir
+        self.threads = [Thread(target=self.worker, name=f"task-worker-{i}", daemon=True) for i in range(size)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def worker(self):
+        while True:
+            task = self.queue.claim(self.output_dir)
+            try:
+                self.run(task["task_id"], json.loads(task["metadata"]), task["workers"])
+            except Exception as e:
+                print(f"Task {task['task_id']} failed: {e}")
+                self.queue.finish(task["task_id"], error=str(e) or type(e).__name__)
+            else:
+                self.queue.finish(task["task_id"])
@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from carver import Carver
+from synthetic_image import build_raw_image
+
+
+def count_files(output_dir):
+    total = 0
+    for root, _, files in os.walk(output_dir):
+        total += sum(1 for name in files if name != "audit.txt")
+    return total
+
+
+def bench_builtin(image, output_dir, workers=1):
+    start = time.perf_counter()
+    carved = sum(1 for _ in Carver(image, output_dir, workers=workers).carve())
+    return time.perf_counter() - start, carved
+
+
+def bench_foremost(image, output_dir):
+    start = time.perf_counter()
+    subprocess.run(["foremost", "-t", "jpg,png,gif,pdf", "-o", output_dir, image], capture_output=True)
+    return time.perf_counter() - start, count_files(output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image", help="Existing image to carve (a synthetic one is generated otherwise)")
+    parser.add_argument("--size_mb", help="Synthetic image size in MiB", type=int, default=256)
+    parser.add_argument("--files", help="Files embedded in the synthetic image", type=int, default=500)
+    parser.add_argument("--workers", help="Worker counts to benchmark the builtin carver with", type=int, nargs="+", default=[1, os.cpu_count()])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_carver_")
+    try:
+        image = args.image
+        embedded = None
+        if not image:
+            image = os.path.join(workdir, "synthetic.dd")
+            embedded = len(build_raw_image(image, args.size_mb, args.files))
+        size_mb = os.path.getsize(image) / (1024 * 1024)
+
+        report = {"image": image, "size_mb": round(size_mb, 1), "embedded": embedded}
+        engines = {}
+        for workers in sorted(set(args.workers)):
+            engines[f"builtin_{workers}"] = lambda image, output_dir, workers=workers: bench_builtin(image, output_dir, workers)
+        if shutil.which("foremost"):
+            engines["foremost"] = bench_foremost
+        for name, bench in engines.items():
+            elapsed, carved = bench(image, os.path.join(workdir, name))
+            report[name] = {
+                "seconds": round(elapsed, 3),
+                "mb_per_s": round(size_mb / elapsed, 1),
+                "files": carved,
+            }
+        print(json.dumps(report, indent=4))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
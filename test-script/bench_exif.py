@@ -0,0 +1,74 @@
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from exif_reader import parse_exif_header, parse_exif_library
+from synthetic_image import make_exif, make_jpeg
+
+
+def build_corpus(directory, count, size_kb, seed=0):
+    rng = random.Random(seed)
+    for i in range(count):
+        exif = make_exif(lat=rng.uniform(-60, 60), lon=rng.uniform(-170, 170))
+        with open(os.path.join(directory, f"{i:05d}.jpg"), "wb") as f:
+            f.write(make_jpeg(rng, size_kb * 1024, exif))
+
+
+def bench(parse, files, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for path in files:
+            try:
+                parse(path)
+            except Exception:
+                pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"seconds": round(best, 4), "files_per_s": round(len(files) / best, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="Directory of sample JPEGs (a synthetic corpus is generated otherwise)")
+    parser.add_argument("--count", help="Synthetic corpus size", type=int, default=200)
+    parser.add_argument("--size_kb", help="Synthetic JPEG size in KiB", type=int, default=3072)
+    parser.add_argument("--rounds", help="Timed rounds per parser; the best is reported", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = None
+    corpus = args.corpus
+    if not corpus:
+        workdir = corpus = tempfile.mkdtemp(prefix="bench_exif_")
+        build_corpus(corpus, args.count, args.size_kb)
+    try:
+        files = sorted(glob.glob(os.path.join(corpus, "*.jp*g")) + glob.glob(os.path.join(corpus, "*.JP*G")))
+        mismatches = 0
+        for path in files:
+            try:
+                mismatches += parse_exif_header(path) != parse_exif_library(path)
+            except Exception:
+                mismatches += 1
+        report = {
+            "files": len(files),
+            "mismatches": mismatches,
+            "header_reader": bench(parse_exif_header, files, args.rounds),
+            "exif_library": bench(parse_exif_library, files, args.rounds),
+        }
+        report["speedup"] = round(report["header_reader"]["files_per_s"] / report["exif_library"]["files_per_s"], 1)
+        print(json.dumps(report, indent=4))
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
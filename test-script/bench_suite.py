@@ -0,0 +1,243 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dd_metadata import DDMetadata, read_metadata
+from dd_recovery import DDRecovery
+from geocoder import Geocoder
+from synthetic_fat import build_fat_image
+
+MB = 1024 * 1024
+
+
+class StubBackend:
+    """Offline geocoder backend: a fixed address per coordinate, after an optional delay."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def reverse(self, lat, lon):
+        if self.delay:
+            time.sleep(self.delay)
+        return f"Stub address {lat:.3f}, {lon:.3f}"
+
+
+def percentiles(samples):
+    """Latency summary of a list of durations in seconds, in milliseconds."""
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": at(0.50),
+        "p90_ms": at(0.90),
+        "p99_ms": at(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    """Peak RSS so far of this process and of its reaped children (carving workers)."""
+    # ru_maxrss is in KiB on Linux
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def timed(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def bench_metadata(image, rounds):
+    report = {"read_metadata": timed(lambda: read_metadata(image), rounds)}
+    report["dd_metadata"] = timed(lambda: DDMetadata(image, "bench").get_metadata(), rounds)
+    report["filesystem_type"] = read_metadata(image).filesystem_type
+    return report
+
+
+def recovered_digests(output_dir):
+    digests = set()
+    for root, _, files in os.walk(output_dir):
+        for name in files:
+            with open(os.path.join(root, name), "rb") as f:
+                digests.add(hashlib.sha256(f.read()).hexdigest())
+    return digests
+
+
+def bench_recovery(image, engine, task_id, expected, workers, geocoder, triage=False):
+    start = time.perf_counter()
+    processor = DDRecovery(image, "exif", task_id, engine, workers=workers, geocoder=geocoder,
+                           image_name=os.path.basename(image), triage=triage)
+    processor.run()
+    elapsed = time.perf_counter() - start
+    snapshot = processor.metrics.snapshot()
+    found = recovered_digests(processor.output_dir) & expected
+    return {
+        "seconds": round(elapsed, 3),
+        "mb_per_s": round(os.path.getsize(image) / MB / elapsed, 1),
+        "files": processor.results.rows,
+        # Share of the sample files recovered byte for byte
+        "recall": round(len(found) / len(expected), 4) if expected else None,
+        "stages": snapshot["stages"],
+        "rates": snapshot["rates"],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_routes(flask_app, task_id, rounds):
+    client = flask_app.test_client()
+    # /extraction_result saves the filter handle that /map_from_csv reads back
+    routes = {
+        "/extraction_result": f"/extraction_result?task_id={task_id}",
+        "/map_from_csv": f"/map_from_csv?task_id={task_id}",
+        "/tasks": "/tasks",
+        "/api/tasks/<task_id>/results": f"/api/tasks/{task_id}/results",
+        "/api/tasks/<task_id>/geojson": f"/api/tasks/{task_id}/geojson",
+    }
+    report = {}
+    for name, url in routes.items():
+        statuses = set()
+
+        def get():
+            response = client.get(url)
+            response.get_data()
+            statuses.add(response.status_code)
+
+        report[name] = timed(get, rounds)
+        report[name]["status"] = sorted(statuses)
+    return report
+
+
+def compare(report, baseline):
+    """Relative change of throughput and median latency against a baseline report."""
+    changes = {}
+    previous = {image["name"]: image for image in baseline.get("images", [])}
+    for image in report["images"]:
+        before = previous.get(image["name"])
+        if not before:
+            continue
+        for engine, run in image["recovery"].items():
+            old = before.get("recovery", {}).get(engine)
+            if old and old["mb_per_s"]:
+                changes[f"{image['name']}/recovery/{engine}/mb_per_s"] = round(run["mb_per_s"] / old["mb_per_s"] - 1, 3)
+        for route, latency in image["routes"].items():
+            old = before.get("routes", {}).get(route)
+            if old and old["p50_ms"]:
+                changes[f"{image['name']}/routes{route}/p50_ms"] = round(latency["p50_ms"] / old["p50_ms"] - 1, 3)
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recovery, metadata and the web routes on synthetic FAT images")
+    parser.add_argument("--fat_types", help="FAT variants to generate", nargs="+", choices=["FAT12", "FAT16", "FAT32"],
+                        default=["FAT16", "FAT32"])
+    parser.add_argument("--size_mb", help="Synthetic volume size in MiB", type=int, default=128)
+    parser.add_argument("--files", help="Sample files per image", type=int, default=300)
+    parser.add_argument("--deleted_ratio", help="Share of sample files that are deleted", type=float, default=0.3)
+    parser.add_argument("--fragmented_ratio", help="Share of sample files that are fragmented", type=float, default=0.2)
+    parser.add_argument("--fill_ratio", help="Share of the volume taken by live filler files", type=float, default=0.0)
+    parser.add_argument("--engines", help="Recovery engines to run", nargs="+", choices=["builtin", "fat"],
+                        default=["builtin", "fat"])
+    parser.add_argument("--workers", help="Carving worker processes", type=int, default=os.cpu_count())
+    parser.add_argument("--triage", help="Run the entropy triage pass before carving", action="store_true")
+    parser.add_argument("--geocode_ms", help="Simulated latency of each geocoder call", type=float, default=0.0)
+    parser.add_argument("--rounds", help="Timed requests per route and metadata reads per image", type=int, default=50)
+    parser.add_argument("--seed", help="Random seed of the synthetic images", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file as well as stdout")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare throughput and latency with")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    cwd = os.getcwd()
+    # DDRecovery and the app write under results/ relative to the working directory
+    os.chdir(workdir)
+    try:
+        # Progress output of the pipeline goes to stderr; stdout is the report
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run(args, workdir)
+        if args.baseline:
+            with open(os.path.join(cwd, args.baseline)) as f:
+                report["change_vs_baseline"] = compare(report, json.load(f))
+        text = json.dumps(report, indent=4)
+        if args.output:
+            with open(os.path.join(cwd, args.output), "w") as f:
+                f.write(text)
+        print(text)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+def run(args, workdir):
+    # Imported here: the app resolves its results folder at import time
+    import app as webapp
+
+    webapp.app.config.update(GEOCODER_BACKEND="none", TASK_DISK_RESERVE=0, TASK_WORKERS=1)
+    # No cache: every run pays for the same lookups
+    geocoder = Geocoder(StubBackend(args.geocode_ms / 1000))
+    webapp.geocoder = geocoder
+
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": vars(args),
+        "images": [],
+    }
+    for fat_type in args.fat_types:
+        name = f"{fat_type}_{args.size_mb}MB"
+        image = os.path.join(workdir, f"{name}.dd")
+        start = time.perf_counter()
+        files = build_fat_image(image, fat_type, args.size_mb, args.files, args.deleted_ratio,
+                                args.fragmented_ratio, args.fill_ratio, args.seed)
+        samples = [file for file in files if not file["path"].endswith(".bin")]
+        expected = {hashlib.sha256(file["data"]).hexdigest() for file in samples}
+        entry = {
+            "name": name,
+            "fat_type": fat_type,
+            "size_mb": args.size_mb,
+            "files": len(samples),
+            "deleted": sum(file["deleted"] for file in samples),
+            "fragmented": sum(file["fragments"] > 1 for file in samples),
+            "generate_seconds": round(time.perf_counter() - start, 3),
+            "metadata": bench_metadata(image, args.rounds),
+            "recovery": {},
+        }
+        task_id = None
+        for engine in args.engines:
+            task_id = str(uuid4())
+            entry["recovery"][engine] = bench_recovery(image, engine, task_id, expected, args.workers, geocoder,
+                                                         args.triage)
+        # The routes read the results of the last run, found through its metadata.json
+        with open(os.path.join("results", task_id, "metadata.json"), "w") as f:
+            json.dump({"filename": os.path.basename(image), "task_id": task_id, "size": os.path.getsize(image),
+                       "path": image, "datetime": report["started"], "status": "completed"}, f)
+        entry["routes"] = bench_routes(webapp.app, task_id, args.rounds)
+        report["images"].append(entry)
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+if __name__ == "__main__":
+    main()
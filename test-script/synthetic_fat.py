@@ -0,0 +1,274 @@
+import random
+import struct
+
+from synthetic_image import sample_files
+
+SECTOR_SIZE = 512
+RESERVED_SECTORS = {"FAT12": 1, "FAT16": 1, "FAT32": 32}
+ROOT_ENTRIES = {"FAT12": 224, "FAT16": 512, "FAT32": 0}
+# Cluster counts each FAT type must fall in (Microsoft's rule)
+CLUSTER_LIMITS = {"FAT12": (1, 4084), "FAT16": (4085, 65524), "FAT32": (65525, 0x0FFFFFF5)}
+END_OF_CHAIN = {"FAT12": 0xFFF, "FAT16": 0xFFFF, "FAT32": 0x0FFFFFFF}
+DIRECTORY_SIZE = 16 * 1024
+FAT_DATE = ((2024 - 1980) << 9) | (5 << 5) | 1  # 2024-05-01
+FAT_TIME = (10 << 11) | (30 << 5)  # 10:30:00
+
+
+def _lfn_checksum(short_name):
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+def _short_entry(short_name, attributes, cluster, size):
+    return struct.pack(
+        "<11sBBBHHHHHHHI", short_name, attributes, 0, 0, FAT_TIME, FAT_DATE, FAT_DATE,
+        cluster >> 16, FAT_TIME, FAT_DATE, cluster & 0xFFFF, size,
+    )
+
+
+def _dir_entries(long_name, short_name, attributes, cluster, size):
+    """The LFN entries (last part first) followed by the short entry of a name."""
+    checksum = _lfn_checksum(short_name)
+    chars = long_name.encode("utf-16-le") + b"\x00\x00"
+    chars += b"\xff" * (-len(chars) % 26)
+    parts = [chars[i:i + 26] for i in range(0, len(chars), 26)]
+    entries = []
+    for seq in range(len(parts), 0, -1):
+        part = parts[seq - 1]
+        order = seq | (0x40 if seq == len(parts) else 0)
+        entries.append(struct.pack("<B10sBBB12sH4s", order, part[:10], 0x0F, 0, checksum, part[10:22], 0, part[22:26]))
+    entries.append(_short_entry(short_name, attributes, cluster, size))
+    return entries
+
+
+class _Directory:
+    def __init__(self, clusters, parent):
+        self.clusters = clusters
+        self.parent = parent
+        self.entries = []
+
+
+class SyntheticFat:
+    """Lay out a FAT12/16/32 volume in memory.
+
+    Files can be fragmented, or deleted: their entries are marked 0xE5 and
+    their chain freed, while the data stays in place as on a real card.
+    """
+
+    def __init__(self, fat_type, size_mb, sectors_per_cluster, rng):
+        self.fat_type = fat_type
+        self.rng = rng
+        self.sectors_per_cluster = sectors_per_cluster
+        self.cluster_size = sectors_per_cluster * SECTOR_SIZE
+        self.total_sectors = size_mb * 1024 * 1024 // SECTOR_SIZE
+        root_sectors = ROOT_ENTRIES[fat_type] * 32 // SECTOR_SIZE
+        clusters = self.total_sectors // sectors_per_cluster
+        entry_bits = {"FAT12": 12, "FAT16": 16, "FAT32": 32}[fat_type]
+        self.fat_sectors = -(-((clusters + 2) * entry_bits // 8 + 1) // SECTOR_SIZE)
+        self.root_offset = (RESERVED_SECTORS[fat_type] + 2 * self.fat_sectors) * SECTOR_SIZE
+        self.data_sector = RESERVED_SECTORS[fat_type] + 2 * self.fat_sectors + root_sectors
+        self.cluster_count = (self.total_sectors - self.data_sector) // sectors_per_cluster
+        low, high = CLUSTER_LIMITS[fat_type]
+        if not low <= self.cluster_count <= high:
+            raise ValueError(f"{size_mb} MiB with {sectors_per_cluster} sectors per cluster is not {fat_type}")
+        self.image = bytearray(self.total_sectors * SECTOR_SIZE)
+        self.fat = [0] * (self.cluster_count + 2)
+        self.fat[0], self.fat[1] = END_OF_CHAIN[fat_type] & ~0xFF | 0xF8, END_OF_CHAIN[fat_type]
+        self.next_free = 2
+        self.directories = []
+        self.files = []
+        self.root = _Directory(self.allocate(DIRECTORY_SIZE) if fat_type == "FAT32" else None, None)
+
+    def free_bytes(self):
+        return (self.cluster_count + 2 - self.next_free) * self.cluster_size
+
+    def cluster_offset(self, cluster):
+        return (self.data_sector + (cluster - 2) * self.sectors_per_cluster) * SECTOR_SIZE
+
+    def allocate(self, size, fragments=1):
+        """Allocate clusters for size bytes in up to `fragments` runs, with gaps between."""
+        count = max(1, -(-size // self.cluster_size))
+        fragments = min(fragments, count)
+        clusters = []
+        for i in range(fragments):
+            run = count // fragments + (1 if i < count % fragments else 0)
+            if i:
+                self.next_free += self.rng.randint(1, 8)
+            if self.next_free + run > self.cluster_count + 2:
+                raise ValueError("volume full")
+            clusters += range(self.next_free, self.next_free + run)
+            self.next_free += run
+        for cluster, following in zip(clusters, clusters[1:] + [END_OF_CHAIN[self.fat_type]]):
+            self.fat[cluster] = following
+        return clusters
+
+    def write_clusters(self, clusters, data):
+        for i, cluster in enumerate(clusters):
+            chunk = data[i * self.cluster_size:(i + 1) * self.cluster_size]
+            offset = self.cluster_offset(cluster)
+            self.image[offset:offset + len(chunk)] = chunk
+
+    def short_name(self, prefix, name):
+        ext = name.rsplit(".", 1)[-1].upper()[:3] if "." in name else ""
+        return f"{prefix}{len(self.files) + len(self.directories):07d}".encode() + ext.ljust(3).encode()
+
+    def _add_entries(self, directory, entries, clusters, deleted):
+        if deleted:
+            for cluster in clusters:
+                self.fat[cluster] = 0
+            entries = [b"\xe5" + entry[1:] for entry in entries]
+        directory.entries.extend(entries)
+
+    def add_file(self, directory, name, data, deleted=False, fragments=1):
+        # Deleted files are kept contiguous, as recovery assumes
+        clusters = self.allocate(len(data), 1 if deleted else fragments)
+        self.write_clusters(clusters, data)
+        entries = _dir_entries(name, self.short_name("F", name), 0x20, clusters[0], len(data))
+        self._add_entries(directory, entries, clusters, deleted)
+        self.files.append({
+            "directory": directory, "name": name, "deleted": deleted, "data": data,
+            "fragments": min(fragments, len(clusters)) if not deleted else 1,
+        })
+
+    def add_directory(self, parent, name, deleted=False, size=DIRECTORY_SIZE):
+        clusters = self.allocate(self.cluster_size if deleted else size)
+        directory = _Directory(clusters, parent)
+        entries = _dir_entries(name, self.short_name("D", ""), 0x10, clusters[0], 0)
+        self._add_entries(parent, entries, clusters, deleted)
+        self.directories.append(directory)
+        return directory
+
+    def finish(self):
+        for directory in [self.root] + self.directories:
+            data = b"".join(directory.entries)
+            if directory.parent is not None:
+                parent_cluster = directory.parent.clusters[0] if directory.parent.clusters else 0
+                data = (_short_entry(b".          ", 0x10, directory.clusters[0], 0)
+                        + _short_entry(b"..         ", 0x10, parent_cluster, 0) + data)
+            if directory.clusters:
+                if len(data) > len(directory.clusters) * self.cluster_size:
+                    raise ValueError("directory too large")
+                self.write_clusters(directory.clusters, data)
+            else:
+                if len(data) > ROOT_ENTRIES[self.fat_type] * 32:
+                    raise ValueError("too many root directory entries")
+                self.image[self.root_offset:self.root_offset + len(data)] = data
+        self.write_boot_sector()
+        self.write_fats()
+        return self.image
+
+    def write_boot_sector(self):
+        boot = bytearray(SECTOR_SIZE)
+        boot[0:3] = b"\xeb\x3c\x90"
+        boot[3:11] = b"MSDOS5.0"
+        fat32 = self.fat_type == "FAT32"
+        total_16 = self.total_sectors if self.total_sectors < 0x10000 and not fat32 else 0
+        struct.pack_into(
+            "<HBHBHHBHHHII", boot, 11, SECTOR_SIZE, self.sectors_per_cluster, RESERVED_SECTORS[self.fat_type], 2,
+            ROOT_ENTRIES[self.fat_type], total_16, 0xF8, 0 if fat32 else self.fat_sectors, 63, 255, 0,
+            0 if total_16 else self.total_sectors,
+        )
+        if fat32:
+            struct.pack_into("<IHHIHH", boot, 36, self.fat_sectors, 0, 0, self.root.clusters[0], 1, 6)
+            boot[66] = 0x29
+            boot[71:82] = b"SYNTHETIC  "
+            boot[82:90] = b"FAT32   "
+        else:
+            boot[38] = 0x29
+            boot[43:54] = b"SYNTHETIC  "
+            boot[54:62] = self.fat_type.ljust(8).encode()
+        boot[510:512] = b"\x55\xaa"
+        self.image[0:SECTOR_SIZE] = boot
+
+    def write_fats(self):
+        if self.fat_type == "FAT12":
+            entries = self.fat + [0] * (len(self.fat) % 2)
+            table = bytearray()
+            for a, b in zip(entries[0::2], entries[1::2]):
+                table += bytes([a & 0xFF, ((a >> 8) & 0x0F) | ((b & 0x0F) << 4), b >> 4])
+        elif self.fat_type == "FAT16":
+            table = struct.pack(f"<{len(self.fat)}H", *self.fat)
+        else:
+            table = struct.pack(f"<{len(self.fat)}I", *self.fat)
+        for copy in range(2):
+            offset = (RESERVED_SECTORS[self.fat_type] + copy * self.fat_sectors) * SECTOR_SIZE
+            self.image[offset:offset + len(table)] = table
+
+
+def sectors_per_cluster_for(fat_type, size_mb):
+    """The smallest power-of-two cluster size giving a valid cluster count."""
+    total_sectors = size_mb * 1024 * 1024 // SECTOR_SIZE
+    low, high = CLUSTER_LIMITS[fat_type]
+    for sectors_per_cluster in (1, 2, 4, 8, 16, 32, 64, 128):
+        clusters = total_sectors // sectors_per_cluster
+        if clusters <= high:
+            if clusters * 0.98 < low:
+                break
+            return sectors_per_cluster
+    raise ValueError(f"{size_mb} MiB cannot be formatted as {fat_type}")
+
+
+def build_fat_image(path, fat_type="FAT16", size_mb=64, files=100, deleted_ratio=0.3, fragmented_ratio=0.2,
+                    fill_ratio=0.0, seed=0):
+    """Write a FAT volume holding sample files, some deleted or fragmented.
+
+    fill_ratio of the space is first taken by live filler files (.bin), to
+    model a mostly full card. Returns the list of files as dicts with
+    path, deleted, fragments and data.
+    """
+    rng = random.Random(seed)
+    volume = SyntheticFat(fat_type, size_mb, sectors_per_cluster_for(fat_type, size_mb), rng)
+    dcim = volume.add_directory(volume.root, "DCIM")
+    # Room for the entries of every sample file: up to three LFN entries and the short one
+    camera = volume.add_directory(dcim, "100CANON", size=max(DIRECTORY_SIZE, 4 * 32 * (files + 2)))
+    old = volume.add_directory(dcim, "Old photos", deleted=True)
+
+    filler_left = int(volume.free_bytes() * fill_ratio)
+    filler = volume.add_directory(volume.root, "Videos")
+    while filler_left > 0:
+        size = min(filler_left, rng.randint(1, 8) * 1024 * 1024)
+        volume.add_file(filler, f"clip_{len(volume.files):05d}.bin", rng.randbytes(size))
+        filler_left -= size
+
+    for i, (ext, data) in enumerate(sample_files(rng, files)):
+        if len(data) + 2 * volume.cluster_size * 8 > volume.free_bytes():
+            break
+        deleted = rng.random() < deleted_ratio
+        directory = old if deleted and rng.random() < 0.2 else camera
+        fragments = rng.randint(2, 4) if rng.random() < fragmented_ratio else 1
+        name = f"IMG_{i:04d} holiday.{ext}"
+        # A deleted directory is only read as far as its first cluster, past its . and .. entries
+        if directory is old and 32 * (len(old.entries) + 2 + len(_dir_entries(name, b" " * 11, 0x20, 0, 0))) > volume.cluster_size:
+            directory = camera
+        volume.add_file(directory, name, data, deleted or directory is old, fragments)
+
+    with open(path, "wb") as f:
+        f.write(volume.finish())
+
+    paths = {id(dcim): "/DCIM", id(camera): "/DCIM/100CANON", id(old): "/DCIM/Old photos", id(filler): "/Videos"}
+    return [
+        {"path": f"{paths[id(file['directory'])]}/{file['name']}", "deleted": file["deleted"],
+         "fragments": file["fragments"], "data": file["data"]}
+        for file in volume.files
+    ]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="Image file to write", default="synthetic_fat.dd")
+    parser.add_argument("--fat_type", help="FAT variant", choices=["FAT12", "FAT16", "FAT32"], default="FAT16")
+    parser.add_argument("--size_mb", help="Volume size in MiB", type=int, default=64)
+    parser.add_argument("--files", help="Number of sample files", type=int, default=100)
+    parser.add_argument("--deleted_ratio", help="Share of sample files that are deleted", type=float, default=0.3)
+    parser.add_argument("--fill_ratio", help="Share of the volume taken by live filler files", type=float, default=0.0)
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    args = parser.parse_args()
+
+    files = build_fat_image(args.output, args.fat_type, args.size_mb, args.files, args.deleted_ratio,
+                            fill_ratio=args.fill_ratio, seed=args.seed)
+    print(f"Wrote {args.output} ({args.fat_type}) with {len(files)} files, "
+          f"{sum(file['deleted'] for file in files)} deleted")
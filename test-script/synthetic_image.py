@@ -0,0 +1,177 @@
+import random
+import struct
+
+SECTOR_SIZE = 512
+
+# TIFF field types
+ASCII = 2
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+
+
+def _ifd(entries, offset):
+    """Serialise one little-endian IFD placed at `offset` in the TIFF body.
+
+    entries is a list of (tag, type, count, value_bytes); values longer than
+    four bytes are stored in a data area right after the IFD.
+    """
+    entries = sorted(entries)
+    data_offset = offset + 2 + len(entries) * 12 + 4
+    table = struct.pack("<H", len(entries))
+    data = b""
+    for tag, field_type, count, value in entries:
+        if len(value) <= 4:
+            table += struct.pack("<HHI", tag, field_type, count) + value.ljust(4, b"\x00")
+        else:
+            table += struct.pack("<HHII", tag, field_type, count, data_offset + len(data))
+            data += value + (b"\x00" if len(value) % 2 else b"")
+    return table + struct.pack("<I", 0) + data
+
+
+def _ascii(text):
+    value = text.encode("ascii") + b"\x00"
+    return (ASCII, len(value), value)
+
+
+def _degrees(value):
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round(((value - degrees) * 60 - minutes) * 60 * 10000)
+    return (RATIONAL, 3, struct.pack("<6I", degrees, 1, minutes, 1, seconds, 10000))
+
+
+def make_exif(make="Canon", model="EOS 80D", datetime_original="2024:05:01 10:30:00", lat=None, lon=None):
+    """Build an APP1 Exif payload with the tags the results table uses."""
+    ifd0 = [
+        (0x010F,) + _ascii(make),
+        (0x0110,) + _ascii(model),
+        (0x8769, LONG, 1, b"\x00" * 4),
+    ]
+    if lat is not None and lon is not None:
+        ifd0.append((0x8825, LONG, 1, b"\x00" * 4))
+
+    # Lay the IFDs out one after the other; pointer values are patched in
+    # once the size of each block is known.
+    ifd0_size = len(_ifd(ifd0, 8))
+    exif_offset = 8 + ifd0_size
+    exif_ifd = _ifd([(0x9003,) + _ascii(datetime_original)], exif_offset)
+    gps_offset = exif_offset + len(exif_ifd)
+    ifd0 = [entry if entry[0] != 0x8769 else (0x8769, LONG, 1, struct.pack("<I", exif_offset)) for entry in ifd0]
+    ifd0 = [entry if entry[0] != 0x8825 else (0x8825, LONG, 1, struct.pack("<I", gps_offset)) for entry in ifd0]
+
+    tiff = b"II*\x00" + struct.pack("<I", 8) + _ifd(ifd0, 8) + exif_ifd
+    if lat is not None and lon is not None:
+        gps = [
+            (1,) + _ascii("N" if lat >= 0 else "S"),
+            (2,) + _degrees(lat),
+            (3,) + _ascii("E" if lon >= 0 else "W"),
+            (4,) + _degrees(lon),
+        ]
+        tiff += _ifd(gps, gps_offset)
+    return b"Exif\x00\x00" + tiff
+
+
+def _segment(marker, payload):
+    return b"\xff" + bytes([marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def _entropy_coded(rng, size):
+    # Compressed scan data never contains a bare 0xFF: it is always stuffed
+    # as 0xFF00, which is what keeps the EOI marker unambiguous.
+    data = bytearray(rng.randbytes(size))
+    return bytes(data).replace(b"\xff", b"\xff\x00")
+
+
+def make_jpeg(rng, size=64 * 1024, exif=None):
+    parts = [b"\xff\xd8"]
+    if exif is not None:
+        parts.append(_segment(0xE1, exif))
+    else:
+        parts.append(_segment(0xE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"))
+    parts.append(_segment(0xDB, b"\x00" + bytes(range(1, 65))))
+    parts.append(_segment(0xC0, b"\x08\x00\x10\x00\x10\x01\x01\x11\x00"))
+    parts.append(_segment(0xDA, b"\x01\x01\x00\x00\x3f\x00"))
+    parts.append(_entropy_coded(rng, size))
+    parts.append(b"\xff\xd9")
+    return b"".join(parts)
+
+
+def make_png(rng, size=32 * 1024):
+    body = rng.randbytes(size).replace(b"IEND", b"IENX")
+    return b"\x89PNG\r\n\x1a\n" + body + b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+
+def make_gif(rng, size=16 * 1024):
+    body = rng.randbytes(size).replace(b"\x00\x3b", b"\x01\x3b")
+    return b"GIF89a" + body + b"\x00\x3b"
+
+
+def make_pdf(rng, size=32 * 1024):
+    body = bytes(rng.choice(b"abcdefghijklmnopqrstuvwxyz \n") for _ in range(size))
+    return b"%PDF-1.4\n" + body + b"\n%%EOF\n"
+
+
+def sample_files(rng, count, gps_ratio=0.5):
+    """Yield (ext, data) for a mix of file types, mostly EXIF-tagged JPEGs."""
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.7:
+            exif = None
+            if rng.random() < 0.9:
+                gps = rng.random() < gps_ratio
+                exif = make_exif(
+                    datetime_original=f"2024:{rng.randint(1, 12):02d}:{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00",
+                    lat=rng.uniform(-60, 60) if gps else None,
+                    lon=rng.uniform(-170, 170) if gps else None,
+                )
+            yield "jpg", make_jpeg(rng, rng.randint(16, 256) * 1024, exif)
+        elif kind < 0.8:
+            yield "png", make_png(rng, rng.randint(8, 64) * 1024)
+        elif kind < 0.9:
+            yield "gif", make_gif(rng, rng.randint(4, 32) * 1024)
+        else:
+            yield "pdf", make_pdf(rng, rng.randint(4, 32) * 1024)
+
+
+def build_raw_image(path, size_mb=64, files=200, seed=0):
+    """Write an unformatted image with files at random sector offsets.
+
+    Gaps are a mix of zero-fill and random noise. Returns the list of
+    (offset, ext, length) that were embedded.
+    """
+    rng = random.Random(seed)
+    size = size_mb * 1024 * 1024
+    embedded = []
+    with open(path, "wb") as f:
+        f.truncate(size)
+        pos = 0
+        for ext, data in sample_files(rng, files):
+            gap = rng.randint(1, 64) * SECTOR_SIZE
+            if pos + gap + len(data) > size:
+                break
+            if rng.random() < 0.5:
+                f.seek(pos)
+                f.write(rng.randbytes(gap))
+            pos += gap
+            f.seek(pos)
+            f.write(data)
+            embedded.append((pos, ext, len(data)))
+            pos += len(data)
+            pos += -pos % SECTOR_SIZE
+    return embedded
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", help="Image file to write", default="synthetic.dd")
+    parser.add_argument("--size_mb", help="Image size in MiB", type=int, default=64)
+    parser.add_argument("--files", help="Number of files to embed", type=int, default=200)
+    parser.add_argument("--seed", help="Random seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embedded = build_raw_image(args.output, args.size_mb, args.files, args.seed)
+    print(f"Wrote {args.output} with {len(embedded)} embedded files")
@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import carver
+from blob_store import BlobStore, file_sha256
+from carver import Carver
+from synthetic_image import build_raw_image
+
+
+def carve(image, output_dir, workers):
+    paths = list(Carver(image, str(output_dir), workers=workers).carve())
+    return {os.path.relpath(path, output_dir): open(path, "rb").read() for path in paths}, len(paths)
+
+
+def test_carve_crossing_chunks_with_one_and_many_workers(tmp_path, monkeypatch):
+    # Small chunks, so many files cross a chunk boundary
+    monkeypatch.setattr(carver, "MIN_CHUNK_SIZE", 1024 * 1024)
+    image = str(tmp_path / "image.dd")
+    embedded = build_raw_image(image, size_mb=16, files=120, seed=3)
+    chunks = Carver(image, None, workers=4).chunks()
+    boundaries = [chunk[-1][1] for chunk in chunks[:-1]]
+    assert len(chunks) > 4
+    assert any(start < boundary < start + length for start, _, length in embedded for boundary in boundaries)
+
+    single, count = carve(image, tmp_path / "one", workers=1)
+    # One file per embedded file, none carved twice across a boundary
+    assert count == len(single) == len(embedded)
+    with open(image, "rb") as f:
+        data = f.read()
+    for start, ext, length in embedded:
+        name = f"{ext}/{start // 512:08d}.{ext}"
+        assert single[name] == data[start:start + length]
+
+    parallel, count = carve(image, tmp_path / "many", workers=4)
+    assert count == len(parallel)
+    assert parallel == single
+
+
+def test_carving_again_leaves_blobs_intact(tmp_path):
+    image = str(tmp_path / "image.dd")
+    embedded = build_raw_image(image, size_mb=4, files=10, seed=4)
+    store = BlobStore(str(tmp_path / "blobs"))
+    carved, _ = carve(image, tmp_path / "out", workers=1)
+    digests = {name: store.add(str(tmp_path / "out" / name)) for name in carved}
+
+    # The image changed inside a carved file, which is carved again under the same name
+    start, ext, length = embedded[0]
+    with open(image, "r+b") as f:
+        f.seek(start + length // 2)
+        f.write(b"\x00" * 16)
+    recarved, _ = carve(image, tmp_path / "out", workers=1)
+    name = f"{ext}/{start // 512:08d}.{ext}"
+    assert recarved[name] != carved[name]
+    for name, digest in digests.items():
+        assert file_sha256(store.blob_path(digest)) == digest
+    store.close()
@@ -0,0 +1,47 @@
+import os
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dd_metadata import read_metadata
+
+
+def gpt_image(path, entry_size=128, header_size=92, truncate=None):
+    """A protective MBR and a GPT header with one partition entry of entry_size bytes."""
+    mbr = bytearray(512)
+    struct.pack_into("<B3xB3xII", mbr, 446, 0, 0xEE, 1, 0xFFFFFFFF)
+    mbr[510:512] = b"\x55\xaa"
+    header = bytearray(512)
+    header[:8] = b"EFI PART"
+    struct.pack_into("<I", header, 12, header_size)
+    struct.pack_into("<QII", header, 72, 2, 1, entry_size)
+    entry = bytearray(max(entry_size, 128) if entry_size <= 4096 else 128)
+    entry[:16] = bytes(range(1, 17))
+    struct.pack_into("<QQ", entry, 32, 34, 2081)
+    data = bytes(mbr + header + entry)
+    data += bytes(2 * 1024 * 1024 - len(data))
+    with open(path, "wb") as f:
+        f.write(data[:truncate])
+    return str(path)
+
+
+def test_gpt_partition(tmp_path):
+    metadata = read_metadata(gpt_image(tmp_path / "gpt.dd"))
+    assert metadata.scheme == "gpt"
+    assert [(p.offset, p.size) for p in metadata.partitions] == [(34 * 512, 2048 * 512)]
+
+
+def test_corrupted_gpt_header(tmp_path):
+    # An entry size read from a corrupted header must not size the read
+    metadata = read_metadata(gpt_image(tmp_path / "size.dd", entry_size=0xFFFFFFF0))
+    assert metadata.scheme == "gpt" and metadata.partitions == []
+    metadata = read_metadata(gpt_image(tmp_path / "header.dd", header_size=0xFFFF))
+    assert metadata.partitions == []
+
+
+def test_truncated_gpt_header(tmp_path):
+    # The header ends after its signature: the image is carved whole
+    metadata = read_metadata(gpt_image(tmp_path / "short.dd", truncate=512 + 8))
+    assert metadata.scheme == "unknown" and metadata.partitions == []
+    assert metadata.size == 512 + 8
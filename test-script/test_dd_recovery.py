@@ -0,0 +1,142 @@
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import carver
+from dd_recovery import DDRecovery, safe_image_name
+from geocoder import Geocoder, NullBackend
+from results_store import STORE_NAME, ResultsStore
+from synthetic_fat import build_fat_image
+from synthetic_image import build_raw_image
+
+
+def recover(image, task_id, **kwargs):
+    processor = DDRecovery(image, "exif", task_id, geocoder=Geocoder(NullBackend()), **kwargs)
+    processor.run()
+    return processor
+
+
+def test_image_name_with_path_separators(tmp_path, monkeypatch):
+    assert safe_image_name("../x.dd") == "x.dd"
+    assert safe_image_name("sub/../../escape.dd") == "escape.dd"
+    assert safe_image_name("..\\..\\win.dd") == "win.dd"
+    assert safe_image_name("..") == "image.dd"
+
+    monkeypatch.chdir(tmp_path)
+    build_raw_image("image.dd", size_mb=4, files=5)
+    recover("image.dd", "task", image_name="sub/../../escape.dd")
+    assert os.path.exists(os.path.join("results", "task", "escape.dd_results.csv"))
+    assert sorted(os.listdir(tmp_path)) == ["image.dd", "results"]
+    assert os.listdir("results") == ["task"]
+
+
+def test_upload_stores_a_safe_name(tmp_path, monkeypatch):
+    import app
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(app.app.config["UPLOAD_FOLDER"])
+    app.app.config["TASK_WORKERS"] = 0
+    client = app.app.test_client()
+    image = b"\x00" * 4096
+    client.post("/", data={"file": (io.BytesIO(image), "../x.dd")}, content_type="multipart/form-data")
+    with client.session_transaction() as session:
+        assert session["file_metadata"]["filename"] == "x.dd"
+
+
+def run_in_thread(fn, timeout=60):
+    """fn's exception, or None; fails the test if fn is still running after timeout."""
+    outcome = []
+
+    def target():
+        try:
+            fn()
+        except Exception as e:
+            outcome.append(e)
+        else:
+            outcome.append(None)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the task hung"
+    return outcome[0]
+
+
+def test_failed_file_fails_the_task(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    build_raw_image("image.dd", size_mb=8, files=40)
+    process_file = DDRecovery.process_file
+    broken = []
+
+    def fail_once(self, file_dir):
+        if not broken:
+            broken.append(file_dir)
+            raise OSError("disk full")
+        process_file(self, file_dir)
+
+    monkeypatch.setattr(DDRecovery, "process_file", fail_once)
+    error = run_in_thread(lambda: recover("image.dd", "task"))
+    assert isinstance(error, OSError)
+
+    # The rerun resumes and processes the file that failed
+    monkeypatch.setattr(DDRecovery, "process_file", process_file)
+    resumed = recover("image.dd", "task")
+    reference = recover("image.dd", "reference")
+    assert resumed.results.rows == reference.results.rows > 0
+
+
+def test_every_worker_failing_does_not_hang(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    build_raw_image("image.dd", size_mb=8, files=40)
+
+    def fail(self, file_dir):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(DDRecovery, "process_file", fail)
+    error = run_in_thread(lambda: recover("image.dd", "task", exif_workers=2, queue_depth=2))
+    assert isinstance(error, OSError)
+
+
+def interrupt_after(monkeypatch, files):
+    """Make DDRecovery.recover_dd fail once it has yielded this many files."""
+    recover_dd = DDRecovery.recover_dd
+
+    def interrupted(self):
+        for count, file_dir in enumerate(recover_dd(self), 1):
+            yield file_dir
+            if count == files:
+                raise KeyboardInterrupt("interrupted")
+
+    monkeypatch.setattr(DDRecovery, "recover_dd", interrupted)
+    return recover_dd
+
+
+def exported(task_id):
+    with ResultsStore(os.path.join("results", task_id, STORE_NAME)) as store:
+        return sorted(tuple(row.values()) for _, row in store.export())
+
+
+@pytest.mark.parametrize("engine", ["builtin", "fat"])
+def test_resumed_run_matches_uninterrupted_run(tmp_path, monkeypatch, engine):
+    monkeypatch.chdir(tmp_path)
+    # Small chunks, so the carver saves checkpoints before it is interrupted
+    monkeypatch.setattr(carver, "MIN_CHUNK_SIZE", 1024 * 1024)
+    if engine == "fat":
+        build_fat_image("image.dd", "FAT16", size_mb=16, files=40, deleted_ratio=0.4, seed=2)
+    else:
+        build_raw_image("image.dd", size_mb=16, files=80, seed=2)
+
+    recover_dd = interrupt_after(monkeypatch, 25)
+    with pytest.raises(KeyboardInterrupt):
+        recover("image.dd", "task", engine=engine)
+    monkeypatch.setattr(DDRecovery, "recover_dd", recover_dd)
+    resumed = recover("image.dd", "task", engine=engine)
+    reference = recover("image.dd", "reference", engine=engine)
+    assert resumed.checkpoint.resumed
+    assert exported("task") == exported("reference")
+    assert resumed.results.rows == reference.results.rows > 25
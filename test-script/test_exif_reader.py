@@ -0,0 +1,42 @@
+import os
+import random
+import struct
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from exif_reader import ExifParseError, parse_exif_header
+from synthetic_image import make_exif, make_jpeg
+
+# Offset of IFD0's first entry in the APP1 payload: "Exif\0\0", TIFF header, entry count
+FIRST_ENTRY = 6 + 8 + 2
+
+
+def write_jpeg(path, exif):
+    with open(path, "wb") as f:
+        f.write(make_jpeg(random.Random(0), 4096, bytes(exif)))
+    return str(path)
+
+
+def test_gps_tags(tmp_path):
+    tags = parse_exif_header(write_jpeg(tmp_path / "gps.jpg", make_exif(lat=48.5, lon=-2.25)))
+    assert tags["make"] == "Canon" and tags["model"] == "EOS 80D"
+    assert tags["datetime_original"] == "2024:05:01 10:30:00"
+    assert tags["gps_latitude_ref"] == "N" and tags["gps_longitude_ref"] == "W"
+
+
+def test_unused_tag_with_corrupted_count_is_skipped(tmp_path):
+    # A MakerNote (UNDEFINED) claiming 200 million bytes in place of Make
+    exif = bytearray(make_exif())
+    struct.pack_into("<HHI", exif, FIRST_ENTRY, 0x927C, 7, 200_000_000)
+    tags = parse_exif_header(write_jpeg(tmp_path / "makernote.jpg", exif))
+    assert tags["make"] is None and tags["model"] == "EOS 80D"
+
+
+def test_used_tag_past_payload_end(tmp_path):
+    exif = bytearray(make_exif())
+    struct.pack_into("<HHI", exif, FIRST_ENTRY, 0x010F, 4, 200_000_000)
+    with pytest.raises(ExifParseError):
+        parse_exif_header(write_jpeg(tmp_path / "make.jpg", exif))
@@ -0,0 +1,40 @@
+import mmap
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fat import open_fat
+from synthetic_fat import build_fat_image
+
+SIZES_MB = {"FAT12": 2, "FAT16": 16, "FAT32": 40}
+
+
+@pytest.mark.parametrize("fat_type", ["FAT12", "FAT16", "FAT32"])
+def test_walk_finds_live_and_deleted_files(tmp_path, fat_type):
+    image = str(tmp_path / f"{fat_type}.dd")
+    files = build_fat_image(image, fat_type, SIZES_MB[fat_type], files=30, deleted_ratio=0.4, seed=1)
+    assert any(f["deleted"] for f in files) and any(not f["deleted"] for f in files)
+
+    volume = open_fat(image)
+    with volume.mm:
+        assert volume.fat_type == fat_type
+        entries = {entry.path: entry for entry in volume.walk() if not entry.is_dir}
+        assert sorted(entries) == sorted(f["path"] for f in files)
+        for f in files:
+            entry = entries[f["path"]]
+            assert entry.deleted == f["deleted"]
+            assert entry.size == len(f["data"])
+            clusters = volume.file_clusters(entry)
+            # Deleting a file clears its chain: only an unfragmented one is read back whole
+            if not f["deleted"] or f["fragments"] == 1:
+                assert volume.read_clusters(clusters, entry.size) == f["data"]
+        assert not [entry for entry in volume.walk(include_deleted=False) if entry.deleted]
+
+
+def test_not_a_fat_volume(tmp_path):
+    image = tmp_path / "zero.dd"
+    image.write_bytes(bytes(mmap.PAGESIZE))
+    assert open_fat(str(image)) is None
@@ -0,0 +1,91 @@
+import gzip
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from map_data import CACHE_DIR, LOD_ZOOMS, MAX_LEVEL_FEATURES, build_levels, cached_geojson, pick_level
+
+
+class Store:
+    """The part of ResultsStore that cached_geojson reads."""
+
+    def __init__(self, points, revision="1.1"):
+        self.points = points
+        self.current = revision
+
+    def revision(self):
+        return self.current
+
+    def gps_points(self, *filters):
+        return self.points
+
+
+def points(count):
+    return [(48.0 + i / 1000, 2.0 + i / 1000, f"2024-05-01 10:{i // 60 % 60:02d}:{i % 60:02d}", f"IMG_{i}.jpg", "")
+            for i in range(count)]
+
+
+def features(cached):
+    with cached, gzip.open(cached, "rb") as f:
+        return json.load(f)["features"]
+
+
+def test_served_file_survives_a_newer_revision(tmp_path):
+    task_dir = str(tmp_path)
+    store = Store(points(20))
+    served, etag = cached_geojson(task_dir, store, None, ())
+
+    # Another request builds the next revision, deleting this one's files
+    store.current = "2.2"
+    newer, newer_etag = cached_geojson(task_dir, store, None, ())
+    assert not any(name.startswith("all-1.1-") for name in os.listdir(os.path.join(task_dir, CACHE_DIR)))
+    assert len(features(served)) == len(features(newer)) == 39
+    assert newer_etag == etag
+
+
+def test_deleted_level_is_built_again(tmp_path):
+    task_dir = str(tmp_path)
+    store = Store(points(20))
+    cached, etag = cached_geojson(task_dir, store, None, ())
+    cached.close()
+    cache_dir = os.path.join(task_dir, CACHE_DIR)
+    # Deleted after the manifest was read, as by a concurrent request
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".manifest.json"):
+            os.remove(os.path.join(cache_dir, name))
+
+    rebuilt, rebuilt_etag = cached_geojson(task_dir, store, None, ())
+    assert rebuilt_etag == etag
+    assert len(features(rebuilt)) == 39
+
+
+def trips(count, seed=0):
+    """Photos along random walks, with a jump to another place every hundred or so."""
+    rng = random.Random(seed)
+    lat, lon = 48.0, 2.0
+    result = []
+    for i in range(count):
+        if rng.random() < 0.01:
+            lat, lon = rng.uniform(-60, 60), rng.uniform(-180, 180)
+        lat += rng.gauss(0, 0.001)
+        lon += rng.gauss(0, 0.001)
+        result.append((lat, lon, f"2024-01-01 00:00:{i:06d}", f"IMG_{i}.jpg", ""))
+    return result
+
+
+def test_levels_hold_at_most_max_level_features(tmp_path):
+    manifest = build_levels(str(tmp_path), "all", trips(100_000))
+    assert manifest["zooms"] and manifest["zooms"][0] == LOD_ZOOMS[0]
+    for zoom in manifest["zooms"]:
+        with gzip.open(tmp_path / manifest["levels"][str(zoom)][0], "rb") as f:
+            level = json.load(f)["features"]
+        markers = [feature for feature in level if feature["geometry"]["type"] == "Point"]
+        # One track plus the cluster markers
+        assert len(level) == len(markers) + 1
+        assert len(markers) <= MAX_LEVEL_FEATURES
+        assert sum(marker["properties"]["count"] for marker in markers) == 100_000
+    # Zooms past the last level are served that level
+    assert pick_level(manifest, LOD_ZOOMS[-1]) == str(manifest["zooms"][-1])
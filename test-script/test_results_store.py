@@ -0,0 +1,124 @@
+import csv
+import os
+import random
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from results_store import FIELDS, STORE_NAME, ResultsStore, ResultsWriter
+
+
+def row(name, has_exif=True, datetime="", coords=""):
+    return [name, "true" if has_exif else "false", "", "", datetime, coords, ""] + [""] * (len(FIELDS) - 7)
+
+
+def make_store(path, rows):
+    store = ResultsStore(str(path))
+    store.insert([(f"jpg/{r[0]}", r) for r in rows])
+    store.create_indexes()
+    return store
+
+
+def test_keyset_pages_walk_rows_in_id_order(tmp_path):
+    store = make_store(tmp_path / "results.sqlite", [row(f"{i}.jpg", i % 3 == 0) for i in range(100)])
+    for filters in [(), (None, None, True), ("2024-01-01", "2024-02-01", True, True)]:
+        where, params = store.where(*filters)
+        where = (where + " AND" if where else " WHERE") + " id > ?"
+        plan = " ".join(detail for _, _, _, detail in store.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM results" + where + " ORDER BY id LIMIT ?", params + [0, 10]))
+        # No sort of every matching row before each page
+        assert "TEMP B-TREE" not in plan
+
+
+def old_csv_filter(rows, start_date, end_date, has_exif):
+    """The filter /extraction_result applied to the CSV rows before the store."""
+    kept = []
+    for row in rows:
+        if has_exif and row["has_EXIF_data"] != "true":
+            continue
+        if row["datetime"] and start_date and end_date:
+            row_date = datetime.strptime(row["datetime"], "%Y:%m:%d %H:%M:%S")
+            if not datetime.strptime(start_date, "%Y-%m-%d") <= row_date <= datetime.strptime(end_date, "%Y-%m-%d"):
+                continue
+        kept.append(row)
+    return kept
+
+
+def test_filters_match_the_csv_filter(tmp_path):
+    rng = random.Random(0)
+    rows = []
+    for i in range(300):
+        has_exif = rng.random() < 0.7
+        when = ""
+        if has_exif and rng.random() < 0.8:
+            when = f"2024:{rng.randint(1, 4):02d}:{rng.randint(1, 28):02d} {rng.choice(['00:00:00', '10:30:00'])}"
+        coords = f"({rng.uniform(-50, 50)}, {rng.uniform(-50, 50)})" if when and rng.random() < 0.5 else ""
+        rows.append(row(f"{i}.jpg", has_exif, when, coords))
+    # Both ends of the range fall on a day that has rows at midnight and later
+    rows.append(row("start.jpg", True, "2024:02:01 00:00:00"))
+    rows.append(row("end.jpg", True, "2024:03:01 00:00:00"))
+    rows.append(row("after_end.jpg", True, "2024:03:01 10:30:00"))
+    store = make_store(tmp_path / "results.sqlite", rows)
+    csv_rows = [dict(zip(FIELDS, r)) for r in rows]
+
+    for start_date, end_date in [(None, None), ("2024-02-01", "2024-03-01"), ("2024-02-01", None)]:
+        for has_exif in (False, True):
+            expected = old_csv_filter(csv_rows, start_date, end_date, has_exif)
+            exported = [r for _, r in store.export(start_date, end_date, has_exif)]
+            assert exported == expected
+            assert store.count(start_date, end_date, has_exif) == len(expected)
+
+            paged = []
+            cursor = 0
+            while True:
+                page, cursor = store.page(start_date, end_date, has_exif, after_id=cursor, limit=7)
+                paged += [r for _, r in page]
+                if cursor is None:
+                    break
+            assert paged == expected
+
+            gps = [r for _, r in store.export(start_date, end_date, has_exif) if r["GPS Coordinates"]]
+            paged_gps = [r for _, r in store.page(start_date, end_date, has_exif, gps_only=True, limit=1000)[0]]
+            assert paged_gps == gps
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_writer_streams_rows_to_store_and_csv(tmp_path):
+    csv_path = str(tmp_path / "image.dd_results.csv")
+    rows = [row(f"{i}.jpg", i % 2 == 0, f"2024:01:{i + 1:02d} 10:00:00") for i in range(7)]
+    with ResultsWriter(str(tmp_path), csv_path, batch_size=3, interval=60) as writer:
+        for r in rows:
+            writer.add(f"jpg/{r[0]}", r)
+        # Full batches are written as they fill, the rest waits for the next one
+        assert [r[0] for r in read_csv(csv_path)[1:]] == ["0.jpg", "1.jpg", "2.jpg", "3.jpg", "4.jpg", "5.jpg"]
+    assert read_csv(csv_path) == [FIELDS] + rows
+    with ResultsStore(str(tmp_path / STORE_NAME)) as store:
+        assert [(path, list(r.values())) for path, r in store.export()] == [(f"jpg/{r[0]}", r) for r in rows]
+
+
+def test_writer_resume_keeps_rows_and_rewrites_the_csv(tmp_path):
+    csv_path = str(tmp_path / "image.dd_results.csv")
+    rows = [row(f"{i}.jpg") for i in range(5)]
+    writer = ResultsWriter(str(tmp_path), csv_path, batch_size=2, interval=60)
+    for r in rows[:4]:
+        writer.add(f"jpg/{r[0]}", r)
+    # A crash after the store committed the second batch but before the CSV got it
+    writer.closed.set()
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows([FIELDS] + rows[:2])
+
+    with ResultsWriter(str(tmp_path), csv_path, batch_size=2, interval=60, resume=True) as resumed:
+        assert read_csv(csv_path) == [FIELDS] + rows[:4]
+        assert resumed.paths == {f"jpg/{r[0]}" for r in rows[:4]}
+        assert resumed.rows == 4
+        resumed.add(f"jpg/{rows[4][0]}", rows[4])
+    assert read_csv(csv_path) == [FIELDS] + rows
+
+    # Without resume, the task starts over
+    ResultsWriter(str(tmp_path), csv_path).close()
+    assert read_csv(csv_path) == [FIELDS]
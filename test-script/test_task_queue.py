@@ -0,0 +1,88 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from task_queue import COMPLETED, FAILED, IN_PROGRESS, QUEUED, TaskQueue
+
+
+def task(task_id, sha256=None, size=0):
+    return {"task_id": task_id, "filename": f"{task_id}.dd", "sha256": sha256, "datetime": "2024-01-01 00:00:00",
+            "size": size}
+
+
+def test_claim_by_priority_within_the_cpu_budget(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.sqlite"), cpu_budget=4)
+    queue.enqueue(task("low"), workers=2, priority=0)
+    queue.enqueue(task("high"), workers=2, priority=5)
+    queue.enqueue(task("big"), workers=4, priority=0)
+
+    assert queue.claim(str(tmp_path), timeout=0)["task_id"] == "high"
+    assert queue.claim(str(tmp_path), timeout=0)["task_id"] == "low"
+    # The budget is used up, and the next task waits rather than being overtaken
+    assert queue.claim(str(tmp_path), timeout=0) is None
+    assert queue.position("big") == 1
+    queue.finish("high")
+    queue.finish("low", error="boom")
+    assert queue.get("high")["status"] == COMPLETED
+    assert queue.get("low")["status"] == FAILED
+    # A task larger than the budget still runs on its own
+    assert queue.claim(str(tmp_path), timeout=0)["task_id"] == "big"
+
+
+def test_task_that_cannot_fit_on_disk_fails(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.sqlite"), cpu_budget=1, disk_reserve=2 ** 62)
+    queue.enqueue(task("huge"))
+    assert queue.claim(str(tmp_path), timeout=0) is None
+    assert queue.get("huge")["status"] == FAILED
+
+
+def test_recover_requeues_interrupted_tasks(tmp_path):
+    path = str(tmp_path / "tasks.sqlite")
+    queue = TaskQueue(path, cpu_budget=4, max_attempts=2)
+    queue.enqueue(task("once"))
+    queue.enqueue(task("twice"))
+    queue.claim(str(tmp_path), timeout=0)
+    queue.claim(str(tmp_path), timeout=0)
+    # "twice" is interrupted a second time, using up its attempts
+    queue.conn.execute("UPDATE tasks SET attempts = 2 WHERE task_id = 'twice'")
+    queue.conn.commit()
+    queue.close()
+
+    # A restart finds both in progress
+    queue = TaskQueue(path, cpu_budget=4, max_attempts=2)
+    assert queue.get("once")["status"] == IN_PROGRESS
+    assert queue.recover() == 1
+    assert queue.get("once")["status"] == QUEUED
+    assert queue.get("twice")["status"] == FAILED
+    assert queue.claim(str(tmp_path), timeout=0)["task_id"] == "once"
+    assert queue.get("once")["attempts"] == 2
+
+
+def test_find_image_prefers_a_task_that_did_not_fail(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.sqlite"), cpu_budget=4)
+    assert queue.find_image("abc") is None
+    queue.enqueue(task("failed", "abc"))
+    queue.finish("failed", error="boom")
+    assert queue.find_image("abc")["task_id"] == "failed"
+    queue.enqueue(task("done", "abc"))
+    assert queue.find_image("abc")["task_id"] == "done"
+
+
+def test_an_image_is_queued_once(tmp_path):
+    queue = TaskQueue(str(tmp_path / "tasks.sqlite"), cpu_budget=4)
+    assert queue.enqueue(task("first", "abc")) == "first"
+    # Another upload of the image, extracted before the first task ran
+    assert queue.enqueue(task("second", "abc")) == "first"
+    assert queue.get("second") is None
+    # The same upload extracted twice does not reset its task
+    queue.claim(str(tmp_path), timeout=0)
+    assert queue.enqueue(task("first", "abc")) == "first"
+    assert queue.get("first")["status"] == IN_PROGRESS
+    # A failed image is queued again
+    queue.finish("first", error="boom")
+    assert queue.enqueue(task("first", "abc")) == "first"
+    assert queue.get("first")["status"] == QUEUED
+    # Images without a hash are never matched
+    assert queue.enqueue(task("old")) == "old"
+    assert queue.enqueue(task("older")) == "older"
@@ -0,0 +1,53 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from carver import Carver
+from triage import BLOCK_SIZE, DATA, HIGH, UNTRIAGED, ZERO, BlockMap
+
+# The smallest JPEG the carver accepts: SOI, an APP0 segment, SOS, some data, EOI
+JPEG = (b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+        b"\xff\xda\x00\x08\x01\x01\x00\x00\x3f\x00" + b"\x12\x34" * 256 + b"\xff\xd9")
+
+
+def random_bytes(rng, size):
+    # Without JPEG markers, so the random data holds no header or footer by chance
+    return rng.randbytes(size).replace(b"\xff\xd8", b"\xff\x00").replace(b"\xff\xd9", b"\xff\x00")
+
+
+def write_image(path, blocks):
+    with open(path, "wb") as f:
+        for block in blocks:
+            f.write(block)
+    return str(path)
+
+
+def test_header_in_random_block_is_carved(tmp_path):
+    rng = random.Random(0)
+    offset = BLOCK_SIZE // 2
+    mixed = random_bytes(rng, offset) + JPEG
+    mixed += random_bytes(rng, BLOCK_SIZE - len(mixed))
+    image = write_image(tmp_path / "mixed.dd", [random_bytes(rng, BLOCK_SIZE), mixed, bytes(BLOCK_SIZE)])
+
+    # By entropy alone the block holding the JPEG is as random as the first
+    assert list(BlockMap.scan(image, headers=()).classes) == [HIGH, HIGH, ZERO]
+    block_map = BlockMap.scan(image)
+    assert list(block_map.classes) == [HIGH, DATA, ZERO]
+
+    ranges = block_map.carve_ranges([(0, 3 * BLOCK_SIZE)])
+    assert ranges == [(BLOCK_SIZE, 2 * BLOCK_SIZE)]
+    carved = list(Carver(image, str(tmp_path / "out"), ranges=ranges).carve())
+    assert [os.path.basename(path) for path in carved] == [f"{(BLOCK_SIZE + offset) // 512:08d}.jpg"]
+
+
+def test_only_carved_ranges_are_triaged(tmp_path):
+    rng = random.Random(1)
+    image = write_image(tmp_path / "image.dd", [random_bytes(rng, BLOCK_SIZE), bytes(BLOCK_SIZE), JPEG])
+
+    block_map = BlockMap(os.path.getsize(image))
+    block_map.triage(image, [(BLOCK_SIZE + 512, BLOCK_SIZE + 4096)])
+    assert list(block_map.classes) == [UNTRIAGED, ZERO, UNTRIAGED]
+    # Untriaged blocks are carved as before
+    assert block_map.carve_ranges([(0, block_map.size)]) == [(0, BLOCK_SIZE), (2 * BLOCK_SIZE, block_map.size)]
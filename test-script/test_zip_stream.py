@@ -0,0 +1,51 @@
+import io
+import os
+import random
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zip_stream import stream_zip
+
+
+def build(entries):
+    return b"".join(stream_zip(entries))
+
+
+def sample_entries(tmp_path):
+    rng = random.Random(0)
+    photo = tmp_path / "photo.jpg"
+    photo.write_bytes(rng.randbytes(300 * 1024))
+    audit = tmp_path / "audit.txt"
+    audit.write_bytes(b"Files carved: 1\n" * 1000)
+    csv_chunks = [b"fileName,has_EXIF_data\n"] + [f"{i}.jpg,true\n".encode() for i in range(5000)]
+    return [("jpg/photo.jpg", str(photo)), ("audit.txt", str(audit)), ("results.csv", iter(csv_chunks))], {
+        "jpg/photo.jpg": photo.read_bytes(), "audit.txt": audit.read_bytes(), "results.csv": b"".join(csv_chunks),
+    }
+
+
+def test_stream_is_a_readable_zip(tmp_path):
+    entries, expected = sample_entries(tmp_path)
+    archive = zipfile.ZipFile(io.BytesIO(build(entries)))
+    assert archive.testzip() is None
+    assert {name: archive.read(name) for name in archive.namelist()} == expected
+    # Photos are stored as they are, text is deflated
+    assert archive.getinfo("jpg/photo.jpg").compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo("audit.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_zip64_sizes(tmp_path, monkeypatch):
+    # Entries over 4 GiB are impractical here: lower the limit the ZIP64
+    # records are needed past, so every entry above it uses them
+    monkeypatch.setattr(zipfile, "ZIP64_LIMIT", 64 * 1024)
+    entries, expected = sample_entries(tmp_path)
+    data = build(entries)
+    monkeypatch.undo()
+
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.testzip() is None
+    assert {name: archive.read(name) for name in archive.namelist()} == expected
+    # The sizes of the local header of a ZIP64 entry are in its extra field
+    offset = archive.getinfo("jpg/photo.jpg").header_offset
+    assert data[offset + 18:offset + 26] == b"\xff" * 8
@@ -0,0 +1,197 @@
+import json
+import mmap
+import os
+from threading import Lock
+
+import numpy as np
+
+from carver import SIGNATURES
+
+TRIAGE_NAME = "triage.json"
+BLOCK_SIZE = 1024 * 1024
+# Blocks histogrammed at a time, before being reduced to their class
+WINDOW_BLOCKS = 64
+# Block classes, by their code in the map. Blocks no engine scans are
+# never triaged.
+CLASSES = ("untriaged", "zero", "low", "data", "high")
+UNTRIAGED, ZERO, LOW, DATA, HIGH = range(len(CLASSES))
+# Shannon entropy bounds in bits per byte. Random or encrypted data comes
+# within 0.0002 bits of 8 over a full block, compressed image data rarely
+# above 7.99.
+LOW_ENTROPY = 2.0
+HIGH_ENTROPY = 7.999
+# Classes the carver does not scan: no signature can start there
+SKIPPED = (ZERO, HIGH)
+# Headers of the types the carver looks for
+HEADERS = sorted({header for _, header, _, _ in SIGNATURES})
+
+
+def has_header(mm, start, end, headers):
+    """Whether one of the headers starts in [start, end) of the image."""
+    return any(mm.find(header, start, min(end + len(header) - 1, len(mm))) != -1 for header in headers)
+
+
+def classify(counts):
+    """Class of each block, from its (blocks, 256) byte histogram."""
+    sizes = counts.sum(axis=1)
+    p = counts / np.maximum(sizes, 1)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Bytes that never occur give 0 * -inf, which nansum leaves out
+        entropy = -np.nansum(p * np.log2(p), axis=1)
+    classes = np.full(len(counts), DATA, dtype=np.uint8)
+    classes[entropy < LOW_ENTROPY] = LOW
+    classes[entropy >= HIGH_ENTROPY] = HIGH
+    classes[counts[:, 0] == sizes] = ZERO
+    return classes
+
+
+def classify_blocks(mm, blocks, block_size, headers):
+    """Class of each of the given blocks of a memory-mapped image.
+
+    Blocks are histogrammed a window at a time and each window is reduced
+    to its classes straight away, so memory does not grow with the image.
+    The arrays only view the mapping, so it cannot be closed until this
+    returns.
+    """
+    data = np.frombuffer(mm, dtype=np.uint8)
+    classes = np.empty(len(blocks), dtype=np.uint8)
+    counts = np.zeros((WINDOW_BLOCKS, 256), dtype=np.int64)
+    for window in range(0, len(blocks), WINDOW_BLOCKS):
+        window_blocks = blocks[window:window + WINDOW_BLOCKS]
+        counts[:] = 0
+        for i, block in enumerate(window_blocks):
+            values = data[block * block_size:(block + 1) * block_size]
+            # Zero-filled blocks, often most of an image, skip the histogram
+            if values.any():
+                counts[i] = np.bincount(values, minlength=256)
+            else:
+                counts[i, 0] = len(values)
+        classes[window:window + len(window_blocks)] = classify(counts[:len(window_blocks)])
+    for i in np.flatnonzero(classes == HIGH):
+        start = int(blocks[i]) * block_size
+        if has_header(mm, start, start + block_size, headers):
+            classes[i] = DATA
+    return classes
+
+
+def intersect_ranges(ranges, other):
+    """Byte ranges covered by both of two sorted lists of disjoint (start, end) ranges."""
+    result = []
+    i = j = 0
+    while i < len(ranges) and j < len(other):
+        start, end = max(ranges[i][0], other[j][0]), min(ranges[i][1], other[j][1])
+        if start < end:
+            result.append((start, end))
+        if ranges[i][1] < other[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+class BlockMap:
+    """Per-block triage of an image: all-zero, low-entropy, data or high-entropy.
+
+    Zero-filled and high-entropy (encrypted, compressed) blocks cannot hold
+    the start of a file the carver looks for, so carve_ranges() leaves
+    them out. Entropy is measured over the whole block, so a small file
+    can hide in a block of random data: a high-entropy block holding one
+    of the headers is counted as data instead. Files starting elsewhere
+    are still carved in full, across skipped blocks.
+
+    Only the blocks of the ranges an engine is about to carve are
+    triaged, by triage(); the others stay untriaged.
+    """
+
+    def __init__(self, size, block_size=BLOCK_SIZE, classes=None):
+        self.size = size
+        self.block_size = block_size
+        if classes is None:
+            classes = np.full(-(-size // block_size), UNTRIAGED, dtype=np.uint8)
+        self.classes = classes
+        self.lock = Lock()
+
+    @classmethod
+    def scan(cls, filename, block_size=BLOCK_SIZE, headers=HEADERS):
+        """Triage every block of the image."""
+        block_map = cls(os.path.getsize(filename), block_size)
+        block_map.triage(filename, [(0, block_map.size)], headers)
+        return block_map
+
+    def blocks(self, ranges):
+        """Indexes of the untriaged blocks the (start, end) ranges touch."""
+        touched = [np.arange(start // self.block_size, -(-end // self.block_size)) for start, end in ranges
+                   if start < end]
+        if not touched:
+            return np.zeros(0, dtype=np.int64)
+        blocks = np.unique(np.concatenate(touched))
+        blocks = blocks[blocks < len(self.classes)]
+        return blocks[self.classes[blocks] == UNTRIAGED]
+
+    def triage(self, filename, ranges, headers=HEADERS):
+        """Classify the blocks of the ranges that are not classified yet."""
+        blocks = self.blocks(ranges)
+        if not len(blocks):
+            return
+        with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            classes = classify_blocks(mm, blocks, self.block_size, headers)
+        with self.lock:
+            self.classes[blocks] = classes
+
+    def block_sizes(self):
+        sizes = np.full(len(self.classes), self.block_size, dtype=np.int64)
+        if len(sizes):
+            sizes[-1] = self.size - (len(sizes) - 1) * self.block_size
+        return sizes
+
+    def carve_ranges(self, ranges):
+        """The parts of the (start, end) ranges outside skipped blocks."""
+        scanned = np.concatenate(([False], ~np.isin(self.classes, SKIPPED), [False]))
+        edges = np.flatnonzero(scanned[1:] != scanned[:-1]) * self.block_size
+        kept = [(int(start), min(int(end), self.size)) for start, end in zip(edges[::2], edges[1::2])]
+        return intersect_ranges(sorted(ranges), kept)
+
+    def summary(self):
+        """Bytes of the image in each class."""
+        totals = np.bincount(self.classes, weights=self.block_sizes(), minlength=len(CLASSES))
+        return {name: int(total) for name, total in zip(CLASSES, totals)}
+
+    def overview(self, cells=128):
+        """The map shrunk to at most `cells` cells, each the class most of its blocks have."""
+        blocks = len(self.classes)
+        cells = min(cells, blocks)
+        if not cells:
+            return []
+        cell = np.arange(blocks) * cells // blocks
+        counts = np.bincount(cell * len(CLASSES) + self.classes, minlength=cells * len(CLASSES))
+        dominant = counts.reshape(cells, len(CLASSES)).argmax(axis=1)
+        starts = np.searchsorted(cell, np.arange(cells)) * self.block_size
+        ends = np.append(starts[1:], self.size)
+        return [{"class": CLASSES[code], "start": int(start), "end": int(end)}
+                for code, start, end in zip(dominant, starts, ends)]
+
+    def save(self, task_dir):
+        """Write the map out; partitions triaged in parallel each save it."""
+        path = os.path.join(task_dir, TRIAGE_NAME)
+        with self.lock:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({
+                    "size": self.size,
+                    "block_size": self.block_size,
+                    "summary": self.summary(),
+                    # One digit, the class code, per block
+                    "classes": (self.classes + ord("0")).tobytes().decode("ascii"),
+                }, f)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, task_dir):
+        """The block map saved in the task directory, or None."""
+        try:
+            with open(os.path.join(task_dir, TRIAGE_NAME)) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        classes = np.frombuffer(saved["classes"].encode("ascii"), dtype=np.uint8) - ord("0")
+        return cls(saved["size"], saved["block_size"], classes)
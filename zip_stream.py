@@ -0,0 +1,75 @@
+import io
+import os
+import time
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+# Formats that are compressed already: deflating them costs CPU for nothing
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".pdf", ".zip", ".gz"}
+
+
+class _Output(io.RawIOBase):
+    """Write-only, unseekable sink that hands back what was written so far.
+
+    zipfile falls back to data descriptors on unseekable output, so every
+    entry is written front to back and can be sent as soon as it is ready.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def compress_type(name):
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def _write_entry(archive, output, info, chunks, force_zip64=False):
+    with archive.open(info, "w", force_zip64=force_zip64) as entry:
+        for chunk in chunks:
+            entry.write(chunk)
+            if output.chunks:
+                yield output.take()
+
+
+def _read_chunks(path):
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+def stream_zip(entries):
+    """Yield a ZIP archive chunk by chunk, without writing it to disk.
+
+    entries yields (arcname, source) pairs, where source is the path of a
+    file or an iterable of bytes generated on the fly (e.g. a CSV).
+    """
+    output = _Output()
+    with zipfile.ZipFile(output, "w", allowZip64=True) as archive:
+        for arcname, source in entries:
+            if isinstance(source, (str, os.PathLike)):
+                info = zipfile.ZipInfo.from_file(source, arcname)
+                info.compress_type = compress_type(arcname)
+                yield from _write_entry(archive, output, info, _read_chunks(source))
+            else:
+                info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+                info.compress_type = compress_type(arcname)
+                # The size of generated content is unknown up front
+                yield from _write_entry(archive, output, info, source, force_zip64=True)
+            if output.chunks:
+                yield output.take()
+    # The central directory is written on close
+    yield output.take()